@@ -1,9 +1,11 @@
 import os
 import sys
+import multiprocessing
 from PyQt4.QtGui import *
 from PyQt4 import QtCore
 
 import module.launcher
+import module.workerPool
 import PostProcessingModule.menu
 
 
@@ -123,6 +125,10 @@ class Main(QMainWindow):
 
 
 if __name__ == '__main__':
+    # Gene tree files are parsed in worker processes, which must not start the GUI again in a frozen app.
+    multiprocessing.freeze_support()
+    # Start the worker processes before any Qt object or thread exists.
+    module.workerPool.start()
     app = QApplication(sys.argv)
     ex = Main()
     ex.show()
@@ -1,14 +1,18 @@
 import sys
 import os
+import functools
 from PyQt4.QtGui import *
 from PyQt4 import QtCore
 import dendropy
-import datetime
-import subprocess
 import shutil
 
 import TaxamapDlg
+import compression
 import taxaList
+import biMarkers
+import biMarkersWorker
+import nexusWriter
+import shards
 
 
 def resource_path(relative_path):
@@ -31,12 +35,15 @@ class MCMCBiMarkersPage(QMainWindow):
         super(MCMCBiMarkersPage, self).__init__()
 
         self.data = None
+        # biMarkers.Conversion of self.data, kept until other data is uploaded.
+        self.conversion = None
+        # biMarkersWorker.ReadJob of the file being read, which replaces self.data once read.
+        self.reading = None
         self.taxaList = []
         self.taxamap = {}
 
-        self.progress = QProgressDialog("Generating NEXUS file...", "", 0, 0, self)
-        self.progress.setCancelButton(None)
-        self.progress.setWindowModality(QtCore.Qt.WindowModal)
+        # Running worker threads -> their progress dialogs.
+        self.workers = {}
 
         self.initUI()
 
@@ -107,9 +114,9 @@ class MCMCBiMarkersPage(QMainWindow):
 
         # Mandatory parameter inputs
         self.dataTypeEdit = QComboBox(self)
-        self.dataTypeEdit.addItem("phased data")
-        self.dataTypeEdit.addItem("unphased data")
-        self.dataTypeEdit.addItem("bi-allelic markers data")
+        self.dataTypeEdit.addItem(biMarkers.PHASED)
+        self.dataTypeEdit.addItem(biMarkers.UNPHASED)
+        self.dataTypeEdit.addItem(biMarkers.BIALLELIC)
         self.dataTypeEdit.currentIndexChanged.connect(self.cleanData)
 
         self.dataFormatEdit = QComboBox(self)
@@ -272,6 +279,22 @@ class MCMCBiMarkersPage(QMainWindow):
         self.dominantMarkerEdit.addItem("1")
         self.dominantMarkerEdit.setDisabled(True)
 
+        # Inputs for splitting the output into independent runs.
+        self.shardsLbl = QCheckBox("Split into independent runs, one file each:", self)
+        self.shardsLbl.setObjectName("shards")
+        self.shardsLbl.stateChanged.connect(self.onChecked)
+
+        self.shardStrategyEdit = QComboBox(self)
+        self.shardStrategyEdit.addItem(shards.BOOTSTRAP)
+        self.shardStrategyEdit.addItem(shards.SEEDS)
+        self.shardStrategyEdit.addItem(shards.GRID)
+        self.shardStrategyEdit.setDisabled(True)
+
+        self.shardsEdit = QLineEdit()
+        self.shardsEdit.setDisabled(True)
+        self.shardsEdit.setPlaceholderText(shards.HINTS[shards.BOOTSTRAP])
+        self.shardStrategyEdit.currentIndexChanged.connect(self.showShardsHint)
+
         # Inputs for where the NEXUS file should be generated.
         outDestLbl = QLabel("Please specify destination for generated nexus file:")
         self.outDestEdit = QLineEdit()
@@ -393,6 +416,12 @@ class MCMCBiMarkersPage(QMainWindow):
         opLayout = QHBoxLayout()
         opLayout.addWidget(self.opLbl)
 
+        shardsLayout = QHBoxLayout()
+        shardsLayout.addWidget(self.shardsLbl)
+        shardsLayout.addStretch(1)
+        shardsLayout.addWidget(self.shardStrategyEdit)
+        shardsLayout.addWidget(self.shardsEdit)
+
         outDestLayout = QHBoxLayout()
         outDestLayout.addWidget(outDestLbl)
         outDestLayout.addWidget(self.outDestEdit)
@@ -452,6 +481,7 @@ class MCMCBiMarkersPage(QMainWindow):
         topLevelLayout.addLayout(diploidLayout)
         topLevelLayout.addLayout(dominantMarkerLayout)
         topLevelLayout.addLayout(opLayout)
+        topLevelLayout.addLayout(shardsLayout)
 
         topLevelLayout.addWidget(line3)
         topLevelLayout.addLayout(outDestLayout)
@@ -468,18 +498,6 @@ class MCMCBiMarkersPage(QMainWindow):
         self.setWindowTitle('PhyloNetNEXGenerator')
         self.setWindowIcon(QIcon(resource_path("logo.png")))
 
-    def inverseMapping(self, map):
-        """
-        Convert a mapping from taxon to species to a mapping from species to a list of taxon.
-        """
-        o = {}
-        for k, v in map.items():
-            if v in o:
-                o[v].append(k)
-            else:
-                o[v] = [k]
-        return o
-
     def aboutMessage(self):
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Information)
@@ -568,9 +586,22 @@ class MCMCBiMarkersPage(QMainWindow):
                 self.dominantMarkerEdit.setDisabled(True)
             else:
                 self.dominantMarkerEdit.setDisabled(False)
+        elif self.sender().objectName() == "shards":
+            if self.shardsEdit.isEnabled():
+                self.shardStrategyEdit.setDisabled(True)
+                self.shardsEdit.setDisabled(True)
+            else:
+                self.shardStrategyEdit.setDisabled(False)
+                self.shardsEdit.setDisabled(False)
         else:
             pass
 
+    def showShardsHint(self):
+        """
+        Show what to enter for the selected way of splitting the output.
+        """
+        self.shardsEdit.setPlaceholderText(shards.HINTS[str(self.shardStrategyEdit.currentText())])
+
     def link(self, linkStr):
         """
         Open the website of PhyloNet if user clicks on the hyperlink.
@@ -583,53 +614,37 @@ class MCMCBiMarkersPage(QMainWindow):
         Execute when user changes input data format or successfully generates a file.
         """
         self.data = None
+        self.conversion = None
+        # A file still being read is dropped once read.
+        self.reading = None
         self.taxaList = []
         self.sequenceFileEdit.clear()
         self.taxamap = {}
 
     def selectFile(self):
         """
-        Once user uploads a file, read it in as a DNA character matrix.
+        Once user uploads a file, read it in as a DNA character matrix, in a worker thread with its own progress bar.
+        The data of the page are replaced by finishRead() once the file has been read.
         Execute when file selection button is clicked
         """
         try:
             fname = QFileDialog.getOpenFileName(self, 'Open file', '/')
             if fname:
-                extension = os.path.splitext(str(fname))[1]
+                extension = compression.formatExtension(str(fname))
                 if str(self.dataFormatEdit.currentText()) == ".nexus":
                     if extension != ".nexus" and extension != ".nex":
                         QMessageBox.warning(self, "Warning", "Please upload only .nexus files!", QMessageBox.Ok)
-                    else:
-                        # Bi-allelic marker data should be read in as Standard Character Matrix
-                        if str(self.dataTypeEdit.currentText()) == "bi-allelic markers data":
-                            self.data = dendropy.StandardCharacterMatrix.get(path=str(fname), schema="nexus",
-                                                                             preserve_underscores=True)
-                            self.sequenceFileEdit.setText(fname)
-                            self.taxaList = []
-                            self.taxamap = {}
-                        # Other data are DNA Character Matrix
-                        else:
-                            self.data = dendropy.DnaCharacterMatrix.get(path=str(fname), schema="nexus",
-                                                                        preserve_underscores=True)
-                            self.sequenceFileEdit.setText(fname)
-                            self.taxaList = []
-                            self.taxamap = {}
+                        return
+                    schema = "nexus"
                 else:
                     if extension != ".fasta":
                         QMessageBox.warning(self, "Warning", "Please upload only .fasta files!", QMessageBox.Ok)
-                    else:
-                        # Bi-allelic marker data should be read in as Standard Character Matrix
-                        if str(self.dataTypeEdit.currentText()) == "bi-allelic markers data":
-                            self.data = dendropy.StandardCharacterMatrix.get(path=str(fname), schema="fasta")
-                            self.sequenceFileEdit.setText(fname)
-                            self.taxaList = []
-                            self.taxamap = {}
-                        # Other data are DNA Character Matrix
-                        else:
-                            self.data = dendropy.DnaCharacterMatrix.get(path=str(fname), schema="fasta")
-                            self.sequenceFileEdit.setText(fname)
-                            self.taxaList = []
-                            self.taxamap = {}
+                        return
+                    schema = "fasta"
+                # Bi-allelic marker data is kept packed, other data are encoded into a memory-mapped file.
+                self.reading = biMarkersWorker.ReadJob(str(fname), schema, str(self.dataTypeEdit.currentText()))
+                self.startWorker(biMarkersWorker.Reader(self.reading), "Reading data...",
+                                 compression.baseName(str(fname)), self.finishRead, self.failRead)
         except Exception as e:
             QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
             return
@@ -643,6 +658,12 @@ class MCMCBiMarkersPage(QMainWindow):
         if directory:
             self.outDestEdit.setText(directory)
 
+    def taxonNamespace(self):
+        """
+        Taxa of the uploaded data as a dendropy TaxonNamespace.
+        """
+        return self.data.taxonNamespace()
+
     def getTaxaList(self):
         """
         When user clicks "Select", open up taxaList dialog for user to select taxa used for inference.
@@ -656,10 +677,10 @@ class MCMCBiMarkersPage(QMainWindow):
                 raise emptyFileError
 
             # For unphased data, the number of taxa should double because of phasing.
-            if str(self.dataTypeEdit.currentText()) == "unphased data":
+            if str(self.dataTypeEdit.currentText()) == biMarkers.UNPHASED:
                 taxa = dendropy.TaxonNamespace()
                 # Turn each taxon into two.
-                for taxon in self.data.taxon_namespace:
+                for taxon in self.taxonNamespace():
                     taxa.add_taxon(dendropy.Taxon(taxon.label + "_0"))
                     taxa.add_taxon(dendropy.Taxon(taxon.label + "_1"))
                 # Default is all taxa are used for inference.
@@ -673,10 +694,10 @@ class MCMCBiMarkersPage(QMainWindow):
             else:
                 # Default is all taxa are used for inference.
                 if len(self.taxaList) == 0:
-                    for taxon in self.data.taxon_namespace:
+                    for taxon in self.taxonNamespace():
                         self.taxaList.append(taxon.label)
 
-                dialog = taxaList.TaxaListDlg(self.data.taxon_namespace, self.taxaList, self)
+                dialog = taxaList.TaxaListDlg(self.taxonNamespace(), self.taxaList, self)
                 if dialog.exec_():
                     self.taxaList = dialog.getTaxaList()
         except emptyFileError:
@@ -696,10 +717,10 @@ class MCMCBiMarkersPage(QMainWindow):
                 raise emptyFileError
 
             # For unphased data, the number of taxa should double because of phasing.
-            if str(self.dataTypeEdit.currentText()) == "unphased data":
+            if str(self.dataTypeEdit.currentText()) == biMarkers.UNPHASED:
                 taxa = dendropy.TaxonNamespace()
                 # Turn each taxon into two.
-                for taxon in self.data.taxon_namespace:
+                for taxon in self.taxonNamespace():
                     taxa.add_taxon(dendropy.Taxon(taxon.label + "_0"))
                     taxa.add_taxon(dendropy.Taxon(taxon.label + "_1"))
                 # Default is only one individual for each species.
@@ -713,10 +734,10 @@ class MCMCBiMarkersPage(QMainWindow):
             else:
                 # Default is only one individual for each species.
                 if len(self.taxamap) == 0:
-                    for taxon in self.data.taxon_namespace:
+                    for taxon in self.taxonNamespace():
                         self.taxamap[taxon.label] = taxon.label
 
-                dialog = TaxamapDlg.TaxamapDlg(self.data.taxon_namespace, self.taxamap, self)
+                dialog = TaxamapDlg.TaxamapDlg(self.taxonNamespace(), self.taxamap, self)
                 if dialog.exec_():
                     self.taxamap = dialog.getTaxamap()
 
@@ -724,80 +745,84 @@ class MCMCBiMarkersPage(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please upload data first!", QMessageBox.Ok)
             return
 
-    def phasing(self, dnaMatrix):
+    def phylonetCommand(self):
         """
-        Convert unphased data into phased data.
-        :param dnaMatrix: a DnaCharacterMatrix object for unphased data
-        :return: phased, a dictionary from taxon to sequence for phased data
+        The command of the PHYLONET block based on user input, assembled in memory. Executed on the GUI thread by
+        createJob().
+        :return: a nexusWriter.Command
         """
-        ambiguity_code = {
-            "M": ["A", "C"],
-            "R": ["A", "G"],
-            "W": ["A", "T"],
-            "S": ["C", "G"],
-            "Y": ["C", "T"],
-            "K": ["G", "T"]
-        }
-
-        # Ignore the entire column if the column contains these symbols.
-        ignore_code = ["V", "H", "D", "B", "N", "-"]
-
-        phased = {}
-        # Split each taxon into two.
-        for taxon in dnaMatrix.taxon_namespace:
-            phased[taxon.label + "_0"] = ""
-            phased[taxon.label + "_1"] = ""
-
-        # Iterate through each column.
-        for i in range(len(dnaMatrix[0])):
-            nucleotides = set([])
-            for taxon in dnaMatrix:
-                nucleotides.add(str(dnaMatrix[taxon][i]))
-            # If column contains any symbol that should be ignored, continue to next iteration
-            if any(x in ignore_code for x in nucleotides):
-                continue
-            else:
-                # Assign a value to this site of each taxon.
-                for taxon in dnaMatrix:
-                    # If no ambiguity code, copy the original nucleotide.
-                    if str(dnaMatrix[taxon][i]) not in ambiguity_code:
-                        phased[taxon.label + "_0"] += str(dnaMatrix[taxon][i])
-                        phased[taxon.label + "_1"] += str(dnaMatrix[taxon][i])
-                    else:
-                        # If there is an ambiguity symbol, randomly assign one nucleotide belonging to that ambiguity
-                        # code to each taxon.
-                        phased[taxon.label + "_0"] += ambiguity_code[str(dnaMatrix[taxon][i])][0]
-                        phased[taxon.label + "_1"] += ambiguity_code[str(dnaMatrix[taxon][i])][1]
-
-        return phased
-
-    def phasedToBi(self, dnaMatrix):
+        command = nexusWriter.Command("MCMC_BiMarkers")
+        # Write taxa list used for inference.
+        command.option("-taxa", "(" + nexusWriter.nameList(self.taxaList) + ")")
+
+        # Write optional commands based on user selection.
+        if self.chainLengthLbl.isChecked() and not self.chainLengthEdit.text().isEmpty():
+            command.option("-cl", str(self.chainLengthEdit.text()))
+
+        if self.burnInLbl.isChecked() and not self.burnInEdit.text().isEmpty():
+            command.option("-bl", str(self.burnInEdit.text()))
+
+        if self.sampleFrequencyLbl.isChecked() and not self.sampleFrequencyEdit.text().isEmpty():
+            command.option("-sf", str(self.sampleFrequencyEdit.text()))
+
+        if self.parThreadLbl.isChecked() and not self.parThreadEdit.text().isEmpty():
+            command.option("-pl", str(self.parThreadEdit.text()))
+
+        if self.tempListLbl.isChecked() and not self.tempListEdit.text().isEmpty():
+            command.option("-mc3", str(self.tempListEdit.text()))
+
+        if self.maxRetLbl.isChecked() and not self.maxRetEdit.text().isEmpty():
+            command.option("-mr", str(self.maxRetEdit.text()))
+
+        if self.taxamapLbl.isChecked() and len(self.taxamap) != 0:
+            command.taxaMap("-tm", self.taxamap)
+
+        if self.thetaLbl.isChecked() and not self.thetaEdit.text().isEmpty():
+            command.option("-fixtheta", str(self.thetaEdit.text()))
+
+        if self.varyThetaLbl.isChecked():
+            command.option("-varytheta")
+
+        if self.espThetaLbl.isChecked():
+            command.option("-esptheta")
+
+        if self.ppLbl.isChecked() and not self.ppEdit.text().isEmpty():
+            command.option("-pp", str(self.ppEdit.text()))
+
+        if self.ddLbl.isChecked():
+            command.option("-dd")
+
+        if self.eeLbl.isChecked() and not self.eeEdit.text().isEmpty():
+            command.option("-ee", str(self.eeEdit.text()))
+
+        if self.sNetLbl.isChecked() and not self.sNetEdit.text().isEmpty():
+            command.option("-snet", str(self.sNetEdit.text()))
+
+        if self.startingThetaPriorLbl.isChecked() and not self.startingThetaPriorEdit.text().isEmpty():
+            command.option("-ptheta", str(self.startingThetaPriorEdit.text()))
+
+        if self.diploidLbl.isChecked():
+            command.option("-diploid")
+
+        if self.dominantMarkerLbl.isChecked():
+            command.option("-dominant", str(self.dominantMarkerEdit.currentText()))
+
+        if self.opLbl.isChecked():
+            command.option("-op")
+
+        return command
+
+    def createJob(self, directory):
         """
-        Convert phased data into bi-allelic markers.
-        :param dnaMatrix: a DnaCharacterMatrix object for phased data
-        :return: bimarkers, a dictionary from taxon to bi-allelic markers
+        Take a snapshot of the data and options of the page for a worker thread writing into directory.
+        :return: a biMarkersWorker.Job
+        :raise shards.PlanError: if the shards entered do not fit their strategy
         """
-        bimarkers = {}
-        # Initialie each taxon to empty sequence.
-        for taxon in dnaMatrix.taxon_namespace:
-            bimarkers[taxon.label] = ""
-        # Iterate through each column.
-        for i in range(len(dnaMatrix[0])):
-            nucleotides = set([])
-            for taxon in dnaMatrix:
-                nucleotides.add(str(dnaMatrix[taxon][i]))
-            # If there are only two kinds of nucleotides in this column, an indication of bi-allelic marker.
-            if len(nucleotides) == 2 and "-" not in nucleotides:
-                uniqueNucleotides = list(nucleotides)
-                # Randomly assign 0 or 1 to each of the nucleotides.
-                zero = uniqueNucleotides[0]
-                for taxon in dnaMatrix:
-                    if str(dnaMatrix[taxon][i]) == zero:
-                        bimarkers[taxon.label] += "0"
-                    else:
-                        bimarkers[taxon.label] += "1"
-
-        return bimarkers
+        plan = None
+        if self.shardsLbl.isChecked():
+            plan = shards.Plan(str(self.shardStrategyEdit.currentText()), str(self.shardsEdit.text()))
+        return biMarkersWorker.Job(directory, self.data, str(self.dataTypeEdit.currentText()), self.taxaList,
+                                   self.taxamap, self.phylonetCommand(), self.conversion, plan)
 
     def generate(self):
         """
@@ -822,16 +847,10 @@ class MCMCBiMarkersPage(QMainWindow):
             if self.outDestEdit.text().isEmpty():
                 raise emptyDesinationError
 
-            self.path = str(self.outDestEdit.text()) + "/" + \
-                        str(datetime.datetime.now().strftime('%H-%M-%S')) + ".nexus"
-
-            # Create worker thread.
-            self.worker = Worker(self, self.path)
-            self.worker.finished.connect(self.finishWork)
-            self.worker.exception.connect(self.failWork)
-            self.worker.start()
-            # Main thread displays progress bar.
-            self.progress.show()
+            # Create worker thread. It only reads the job, so the page stays usable while it runs.
+            job = self.createJob(str(self.outDestEdit.text()))
+            self.startWorker(biMarkersWorker.Worker(job), "Generating NEXUS file...", job.name, self.finishWork,
+                             self.failWork)
 
         except emptyFileError:
             QMessageBox.warning(self, "Warning", "Please upload data first!", QMessageBox.Ok)
@@ -843,255 +862,105 @@ class MCMCBiMarkersPage(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please specify destination for generated NEXUS file.", QMessageBox.Ok)
             return
         except Exception as e:
-            os.remove(self.path)
             QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
             return
 
-    def validateFile(self, filePath):
+    def startWorker(self, worker, text, title, finished, failed):
         """
-        After the .nexus file is generated, validate the file by feeding it to PhyloNet.
-        Specify -checkParams on command line to make sure PhyloNet checks input without executing the command.
+        Start a worker thread with its own progress bar.
+        :param finished: slot called as finished(worker) when the thread ends, which closes its progress bar
+        :param failed: slot called as failed(worker, e) when the thread raises an exception
         """
-        try:
-            subprocess.check_output(
-                ["java", "-jar", resource_path("testphylonet.jar"),
-                 filePath, "checkParams"], stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            # If an error is encountered, delete the generated file and display the error to user.
-            os.remove(filePath)
-            QMessageBox.warning(self, "Warning", e.output, QMessageBox.Ok)
-
-    def finishWork(self):
+        # Main thread displays one progress bar per worker thread.
+        progress = QProgressDialog(text, "Cancel", 0, 0, self)
+        progress.setWindowTitle(title)
+        # The dialog is closed when the thread ends, not when the bar of a stage is full.
+        progress.setAutoReset(False)
+        progress.setAutoClose(False)
+        progress.canceled.connect(functools.partial(self.cancelWork, worker))
+        self.workers[worker] = progress
+        worker.finished.connect(functools.partial(finished, worker))
+        worker.exception.connect(functools.partial(failed, worker))
+        worker.progressChanged.connect(functools.partial(self.showProgress, worker))
+        worker.start()
+        progress.show()
+
+    def closeProgress(self, worker):
         """
-        When worker thread finishes writing, it will emit a finished() signal.
-        This method catches this signal to validate the generated file and close the progress bar.
+        Close the progress bar of a worker thread that has ended.
         """
-        self.validateFile(self.path)
-        self.progress.cancel()
+        progress = self.workers.pop(worker)
+        progress.reset()
+        progress.hide()
 
-    def failWork(self, e):
+    def finishRead(self, worker):
         """
-        When worker thread encounters an exception, it will emit an exception(e) signal.
-        This method catches this signal to display the error message on GUI.
+        When a worker thread reading a file finishes, take its data unless another file has been selected or the
+        data type or format has changed since, and close its progress bar.
+        """
+        job = worker.job
+        if worker.succeeded and job is self.reading:
+            self.reading = None
+            self.data = job.data
+            self.conversion = None
+            self.sequenceFileEdit.setText(job.path)
+            self.taxaList = []
+            self.taxamap = {}
+        self.closeProgress(worker)
+
+    def failRead(self, worker, e):
         """
-        self.cleanData()
+        When a worker thread reading a file encounters an exception, display the error message. The data of the
+        page are kept.
+        """
+        if worker.job is self.reading:
+            self.reading = None
         QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
 
+    def showProgress(self, worker, stage, done, total):
+        """
+        Catch the progressChanged(stage, done, total) signal of a worker thread to update its progress bar.
+        """
+        progress = self.workers[worker]
+        progress.setLabelText(str(stage) + "...")
+        progress.setMaximum(total)
+        progress.setValue(done)
 
-class Worker(QtCore.QThread):
-    """
-    Worker thread for writing output file. Take in the entire gui class and a path to write.
-    """
-    # Signal to emit when encounters an exception.
-    exception = QtCore.pyqtSignal(Exception)
+    def cancelWork(self, worker):
+        """
+        Stop a worker thread when the Cancel button of its progress bar is clicked. The thread stops at the next
+        row or column block and removes the partial file.
+        """
+        if worker.isRunning():
+            self.workers[worker].setLabelText("Cancelling...")
+            self.workers[worker].show()
+            worker.cancel()
 
-    def __init__(self, gui, path):
-        QtCore.QThread.__init__(self)
-        self.gui = gui
-        self.path = path
+    def finishWork(self, worker):
+        """
+        When a worker thread finishes writing, it will emit a finished() signal.
+        This method catches this signal to close its progress bar and display the error of a file that failed
+        validation.
+        The conversion done by the worker is kept if the page still shows the same data.
+        """
+        job = worker.job
+        if job.data is self.data and job.dataType == str(self.dataTypeEdit.currentText()) and \
+                self.conversion is None:
+            self.conversion = job.conversion
+        self.closeProgress(worker)
+        if worker.succeeded and job.validationError is not None:
+            # The worker has removed the files that failed validation.
+            QMessageBox.warning(self, "Warning", job.validationError, QMessageBox.Ok)
 
-    def run(self):
+    def failWork(self, worker, e):
         """
-        Execute the thread. Generate NEXUS file based on user input in GUI.
+        When a worker thread encounters an exception, it will emit an exception(e) signal.
+        This method catches this signal to display the error message on GUI.
+        The data of the page are cleaned unless other data have been uploaded since the job started.
         """
-        try:
-            with open(self.path, "a") as outputFile:
-                outputFile.write("#NEXUS\n")
-                outputFile.write("Begin data;\n")
-                outputFile.write("Dimensions ntax=")
-
-                # If data is unphased, number of taxa should double because of phasing.
-                if str(self.gui.dataTypeEdit.currentText()) == "unphased data":
-                    outputFile.write(str(2 * len(self.gui.data.taxon_namespace)))
-                else:
-                    outputFile.write(str(len(self.gui.data.taxon_namespace)))
-
-                outputFile.write(" nchar=")
-
-                # number of characters depends on data type
-                if str(self.gui.dataTypeEdit.currentText()) == "bi-allelic markers data":
-                    # If data is bi-alelic, number of characters should equal the original length of sequences.
-                    length = len(self.gui.data[0])
-                elif str(self.gui.dataTypeEdit.currentText()) == "phased data":
-                    bimarkers = self.gui.phasedToBi(self.gui.data)
-                    length = len(bimarkers.values()[0])
-                elif str(self.gui.dataTypeEdit.currentText()) == "unphased data":
-                    phased = self.gui.phasing(self.gui.data)
-                    bimarkers = self.gui.phasedToBi(dendropy.DnaCharacterMatrix.from_dict(phased))
-                    length = len(bimarkers.values()[0])
-
-                outputFile.write(str(length))
-                outputFile.write(";\n")
-                outputFile.write('Format datatype=dna symbols="012" missing=? gap=-;\n')
-                outputFile.write("Matrix\n\n")
-
-                # If data is bi-allelic markers, simply write out the data.
-                if str(self.gui.dataTypeEdit.currentText()) == "bi-allelic markers data":
-                    for taxon in self.gui.data:
-                        outputFile.write(taxon.label)
-                        outputFile.write(" ")
-                        outputFile.write(str(self.gui.data[taxon]))
-                        outputFile.write("\n")
-                # If data is phased, convert into bi-allelic markers, and then write out.
-                elif str(self.gui.dataTypeEdit.currentText()) == "phased data":
-                    for taxon in bimarkers:
-                        outputFile.write(taxon)
-                        outputFile.write(" ")
-                        outputFile.write(bimarkers[taxon])
-                        outputFile.write("\n")
-                # If data is unphased, convert into phased data first, then convert the phased data into
-                # bi-allelic markers, and then write out.
-                elif str(self.gui.dataTypeEdit.currentText()) == "unphased data":
-                    for taxon in bimarkers:
-                        outputFile.write(taxon)
-                        outputFile.write(" ")
-                        outputFile.write(bimarkers[taxon])
-                        outputFile.write("\n")
-
-                outputFile.write(";End;\n\n")
-
-                # Write PHYLONET block.
-                outputFile.write("BEGIN PHYLONET;\n")
-                outputFile.write("MCMC_BiMarkers")
-                # Write taxa list used for inference.
-                outputFile.write(" -taxa (")
-                outputFile.write(self.gui.taxaList[0])
-                for taxon in self.gui.taxaList[1:]:
-                    outputFile.write(",")
-                    outputFile.write(taxon)
-                outputFile.write(")")
-
-                # Write optional commands based on user selection.
-                if self.gui.chainLengthLbl.isChecked():
-                    if self.gui.chainLengthEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -cl ")
-                        outputFile.write(str(self.gui.chainLengthEdit.text()))
-
-                if self.gui.burnInLbl.isChecked():
-                    if self.gui.burnInEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -bl ")
-                        outputFile.write(str(self.gui.burnInEdit.text()))
-
-                if self.gui.sampleFrequencyLbl.isChecked():
-                    if self.gui.sampleFrequencyEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -sf ")
-                        outputFile.write(str(self.gui.sampleFrequencyEdit.text()))
-
-                if self.gui.parThreadLbl.isChecked():
-                    if self.gui.parThreadEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -pl ")
-                        outputFile.write(str(self.gui.parThreadEdit.text()))
-
-                if self.gui.tempListLbl.isChecked():
-                    if self.gui.tempListEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -mc3 ")
-                        outputFile.write(str(self.gui.tempListEdit.text()))
-
-                if self.gui.maxRetLbl.isChecked():
-                    if self.gui.maxRetEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -mr ")
-                        outputFile.write(str(self.gui.maxRetEdit.text()))
-
-                if self.gui.taxamapLbl.isChecked():
-                    if len(self.gui.taxamap) == 0:
-                        pass
-                    else:
-                        # Get a mapping from species to taxon.
-                        speciesToTaxonMap = self.gui.inverseMapping(self.gui.taxamap)
-                        # Write taxa map.
-                        outputFile.write(" -tm <")
-                        for firstSpecies in speciesToTaxonMap:
-                            outputFile.write(firstSpecies)
-                            outputFile.write(":")
-                            outputFile.write(speciesToTaxonMap[firstSpecies][0])
-                            for taxon in speciesToTaxonMap[firstSpecies][1:]:
-                                outputFile.write(",")
-                                outputFile.write(taxon)
-                            speciesToTaxonMap.pop(firstSpecies)
-                            break
-                        for species in speciesToTaxonMap:
-                            outputFile.write("; ")
-                            outputFile.write(species)
-                            outputFile.write(":")
-                            outputFile.write(speciesToTaxonMap[species][0])
-                            for taxon in speciesToTaxonMap[species][1:]:
-                                outputFile.write(",")
-                                outputFile.write(taxon)
-                        outputFile.write(">")
-
-                if self.gui.thetaLbl.isChecked():
-                    if self.gui.thetaEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -fixtheta ")
-                        outputFile.write(str(self.gui.thetaEdit.text()))
-
-                if self.gui.varyThetaLbl.isChecked():
-                    outputFile.write(" -varytheta")
-
-                if self.gui.espThetaLbl.isChecked():
-                    outputFile.write(" -esptheta")
-
-                if self.gui.ppLbl.isChecked():
-                    if self.gui.ppEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -pp ")
-                        outputFile.write(str(self.gui.ppEdit.text()))
-
-                if self.gui.ddLbl.isChecked():
-                    outputFile.write(" -dd")
-
-                if self.gui.eeLbl.isChecked():
-                    if self.gui.eeEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -ee ")
-                        outputFile.write(str(self.gui.eeEdit.text()))
-
-                if self.gui.sNetLbl.isChecked():
-                    if self.gui.sNetEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -snet ")
-                        outputFile.write(str(self.gui.sNetEdit.text()))
-
-                if self.gui.startingThetaPriorLbl.isChecked():
-                    if self.gui.startingThetaPriorEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -ptheta ")
-                        outputFile.write(str(self.gui.startingThetaPriorEdit.text()))
-
-                if self.gui.diploidLbl.isChecked():
-                    outputFile.write(" -diploid")
-
-                if self.gui.dominantMarkerLbl.isChecked():
-                    outputFile.write(" -dominant ")
-                    outputFile.write(str(self.gui.dominantMarkerEdit.currentText()))
-
-                if self.gui.opLbl.isChecked():
-                    outputFile.write(" -op")
-
-                outputFile.write(";\n")
-                outputFile.write("END;")
-
-            # Clear all data after one write.
-            self.gui.cleanData()
-        except Exception as e:
-            self.exception.emit(e)
+        if worker.job.data is self.data:
+            self.cleanData()
+        QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
 
 
 if __name__ == '__main__':
@@ -3,13 +3,17 @@ import os
 from PyQt4.QtGui import *
 from PyQt4 import QtCore
 import dendropy
-import datetime
-import subprocess
 import shutil
 
 import TaxamapDlg
+import compression
 import diploidList
 import paramList
+import locusStore
+import nexusWriter
+import shards
+import validation
+import treeIO
 
 
 def resource_path(relative_path):
@@ -23,7 +27,7 @@ class MCMCSEQPage(QMainWindow):
         super(MCMCSEQPage, self).__init__()
 
         self.inputFiles = []
-        self.loci = {}
+        self.loci = locusStore.LocusStore()
         self.nchar = 0
         self.taxa_names = set([])
 
@@ -32,6 +36,8 @@ class MCMCSEQPage(QMainWindow):
         self.diploidList = []
         self.GTR = {"A": "0.25", "C": "0.25", "G": "0.25", "T": "0.25", "AC": "1", "AG": "1", "AT": "1", "CG": "1",
                     "CT": "1", "GT": "1"}
+        # Generated files are validated in background, each run with its own progress bar.
+        self.validations = validation.Validations(self)
 
         self.initUI()
 
@@ -277,6 +283,21 @@ class MCMCSEQPage(QMainWindow):
         self.diploidEdit.setDisabled(True)
         self.diploidEdit.clicked.connect(self.getDiploid)
 
+        # Inputs for splitting the output into independent runs.
+        self.shardsLbl = QCheckBox("Split into independent runs, one file each:", self)
+        self.shardsLbl.setObjectName("shards")
+        self.shardsLbl.stateChanged.connect(self.onChecked)
+
+        self.shardStrategyEdit = QComboBox(self)
+        self.shardStrategyEdit.addItem(shards.SEEDS)
+        self.shardStrategyEdit.addItem(shards.GRID)
+        self.shardStrategyEdit.setDisabled(True)
+
+        self.shardsEdit = QLineEdit()
+        self.shardsEdit.setDisabled(True)
+        self.shardsEdit.setPlaceholderText(shards.HINTS[shards.SEEDS])
+        self.shardStrategyEdit.currentIndexChanged.connect(self.showShardsHint)
+
         # Inputs for where the NEXUS file should be generated.
         outDestLbl = QLabel("Please specify destination for generated nexus file:")
         self.outDestEdit = QLineEdit()
@@ -400,6 +421,12 @@ class MCMCSEQPage(QMainWindow):
         diploidLayout.addStretch(1)
         diploidLayout.addWidget(self.diploidEdit)
 
+        shardsLayout = QHBoxLayout()
+        shardsLayout.addWidget(self.shardsLbl)
+        shardsLayout.addStretch(1)
+        shardsLayout.addWidget(self.shardStrategyEdit)
+        shardsLayout.addWidget(self.shardsEdit)
+
         outDestLayout = QHBoxLayout()
         outDestLayout.addWidget(outDestLbl)
         outDestLayout.addWidget(self.outDestEdit)
@@ -439,6 +466,7 @@ class MCMCSEQPage(QMainWindow):
         topLevelLayout.addLayout(preLayout)
         topLevelLayout.addLayout(gtrLayout)
         topLevelLayout.addLayout(diploidLayout)
+        topLevelLayout.addLayout(shardsLayout)
 
         topLevelLayout.addWidget(line3)
         topLevelLayout.addLayout(outDestLayout)
@@ -455,18 +483,6 @@ class MCMCSEQPage(QMainWindow):
         self.setWindowTitle('PhyloNetNEXGenerator')
         self.setWindowIcon(QIcon(resource_path("logo.png")))
 
-    def __inverseMapping(self, map):
-        """
-        Convert a mapping from taxon to species to a mapping from species to a list of taxon.
-        """
-        o = {}
-        for k, v in map.items():
-            if v in o:
-                o[v].append(k)
-            else:
-                o[v] = [k]
-        return o
-
     def selectDest(self):
         """
         Select and display the absolute path to store PhyloNet output files in QLineEdit.
@@ -601,9 +617,22 @@ class MCMCSEQPage(QMainWindow):
                 self.diploidEdit.setDisabled(True)
             else:
                 self.diploidEdit.setDisabled(False)
+        elif self.sender().objectName() == "shards":
+            if self.shardsEdit.isEnabled():
+                self.shardStrategyEdit.setDisabled(True)
+                self.shardsEdit.setDisabled(True)
+            else:
+                self.shardStrategyEdit.setDisabled(False)
+                self.shardsEdit.setDisabled(False)
         else:
             pass
 
+    def showShardsHint(self):
+        """
+        Show what to enter for the selected way of splitting the output.
+        """
+        self.shardsEdit.setPlaceholderText(shards.HINTS[str(self.shardStrategyEdit.currentText())])
+
     def link(self, linkStr):
         """
         Open the website of PhyloNet if user clicks on the hyperlink.
@@ -624,7 +653,7 @@ class MCMCSEQPage(QMainWindow):
                 self.sequenceFileEdit.clear()
                 self.inputFiles = []
                 self.taxamap = {}
-                self.loci = {}
+                self.loci = locusStore.LocusStore()
                 self.nchar = 0
                 self.taxa_names = set([])
                 self.diploidList = []
@@ -637,7 +666,7 @@ class MCMCSEQPage(QMainWindow):
                 self.sequenceFileEdit.clear()
                 self.inputFiles = []
                 self.taxamap = {}
-                self.loci = {}
+                self.loci = locusStore.LocusStore()
                 self.nchar = 0
                 self.taxa_names = set([])
                 self.diploidList = []
@@ -667,8 +696,8 @@ class MCMCSEQPage(QMainWindow):
     def selectFile(self):
         """
         Read and store all the user uploaded sequence files. Read a file as soon as user uploads it.
-        Store information in a dictionary, where keys are file names(loci names), and values are tuples
-        containing the length of sequences in each file and the dna character matrix.
+        Store information in a LocusStore, where keys are file names(loci names), and each locus keeps
+        the taxon labels and the position of each sequence in its file.
         Execute when file selection button is clicked.
         """
         try:
@@ -677,25 +706,18 @@ class MCMCSEQPage(QMainWindow):
             else:
                 fname = QFileDialog.getOpenFileName(self, 'Open file', '/')
                 if fname:
-                    extension = os.path.splitext(str(fname))[1]
+                    extension = compression.formatExtension(str(fname))
                     if self.nexus.isChecked():
                         if extension != ".nexus" and extension != ".nex":
                             QMessageBox.warning(self, "Warning", "Please upload only .nexus files!", QMessageBox.Ok)
                         else:
-                            # Read in sequences from one file.
-                            dna = dendropy.DnaCharacterMatrix.get(path=str(fname), schema="nexus"
-                                                                  , preserve_underscores=True)
-                            # Get the length of sequences in this file, and accumulate lengths of sequences in
-                            # all input files
-                            for seq in dna.values():
-                                seqLen = len(seq)
-                                self.nchar += seqLen
-                                break
+                            # Index the sequences of this file; they are read again only when generating output.
+                            locus = self.loci.addFile(compression.baseName(str(fname)), str(fname), "nexus",
+                                                      preserve_underscores=True)
+                            # Accumulate lengths of sequences in all input files.
+                            self.nchar += len(locus)
                             # Store all taxa encountered so far in a global set.
-                            for taxon in dna:
-                                self.taxa_names.add(taxon.label)
-                            # Store data from this file in loci dictionary
-                            self.loci[os.path.splitext(os.path.basename(str(fname)))[0]] = [seqLen, dna]
+                            self.taxa_names.update(locus.labels())
 
                             self.sequenceFileEdit.append(fname)
                             self.inputFiles.append(str(fname))
@@ -703,19 +725,12 @@ class MCMCSEQPage(QMainWindow):
                         if extension != ".fasta":
                             QMessageBox.warning(self, "Warning", "Please upload only .fasta files!", QMessageBox.Ok)
                         else:
-                            # Read in sequences from one file.
-                            dna = dendropy.DnaCharacterMatrix.get(path=str(fname), schema="fasta")
-                            # Get the length of sequences in this file, and accumulate lengths of sequences in
-                            # all input files
-                            for seq in dna.values():
-                                seqLen = len(seq)
-                                self.nchar += seqLen
-                                break
+                            # Index the sequences of this file; they are read again only when generating output.
+                            locus = self.loci.addFile(compression.baseName(str(fname)), str(fname), "fasta")
+                            # Accumulate lengths of sequences in all input files.
+                            self.nchar += len(locus)
                             # Store all taxa encountered so far in a global set.
-                            for taxon in dna:
-                                self.taxa_names.add(taxon.label)
-                            # Store data from this file in loci dictionary
-                            self.loci[os.path.splitext(os.path.basename(str(fname)))[0]] = [seqLen, dna]
+                            self.taxa_names.update(locus.labels())
 
                             self.sequenceFileEdit.append(fname)
                             self.inputFiles.append(str(fname))
@@ -736,7 +751,7 @@ class MCMCSEQPage(QMainWindow):
         else:
             fname = QFileDialog.getOpenFileName(self, 'Open file', '/')
             if fname:
-                extension = os.path.splitext(str(fname))[1]
+                extension = compression.formatExtension(str(fname))
                 if self.sgtNexus.isChecked():
                     if extension != ".nexus" and extension != ".nex":
                         QMessageBox.warning(self, "Warning", "Please upload only .nexus files!", QMessageBox.Ok)
@@ -829,6 +844,123 @@ class MCMCSEQPage(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please select a file type and upload data!", QMessageBox.Ok)
             return
 
+    def phylonetCommand(self, geneTreeNames):
+        """
+        The command of the PHYLONET block based on user input, assembled in memory. It is written after the DATA
+        block.
+        :param geneTreeNames: names of the starting gene trees written in the TREES block, or None
+        :return: a nexusWriter.Command
+        """
+        command = nexusWriter.Command("MCMC_SEQ")
+
+        # Write optional commands based on user selection.
+        if self.chainLengthLbl.isChecked() and not self.chainLengthEdit.text().isEmpty():
+            command.option("-cl", str(self.chainLengthEdit.text()))
+
+        if self.burnInLengthLbl.isChecked() and not self.burnInLengthEdit.text().isEmpty():
+            command.option("-bl", str(self.burnInLengthEdit.text()))
+
+        if self.sampleFrequencyLbl.isChecked() and not self.sampleFrequencyEdit.text().isEmpty():
+            command.option("-sf", str(self.sampleFrequencyEdit.text()))
+
+        if self.seedLbl.isChecked() and not self.seedEdit.text().isEmpty():
+            command.option("-sd", str(self.seedEdit.text()))
+
+        if self.numProcLbl.isChecked() and not self.numProcEdit.text().isEmpty():
+            command.option("-pl", str(self.numProcEdit.text()))
+
+        if self.outDirLbl.isChecked() and not self.outDirEdit.text().isEmpty():
+            command.option("-dir", '"' + str(self.outDirEdit.text()) + '"')
+
+        if self.tempListLbl.isChecked() and not self.tempListEdit.text().isEmpty():
+            command.option("-mc3", str(self.tempListEdit.text()))
+
+        if self.maxRetLbl.isChecked() and not self.maxRetEdit.text().isEmpty():
+            command.option("-mr", str(self.maxRetEdit.text()))
+
+        if self.taxamapLbl.isChecked() and len(self.taxamap) != 0:
+            command.taxaMap("-tm", self.taxamap)
+
+        if self.popSizeLbl.isChecked() and not self.popSizeEdit.text().isEmpty():
+            command.option("-fixps", str(self.popSizeEdit.text()))
+
+        if self.varypsLbl.isChecked():
+            command.option("-varyps")
+
+        if self.ppLbl.isChecked() and not self.ppEdit.text().isEmpty():
+            command.option("-pp", str(self.ppEdit.text()))
+
+        if self.ddLbl.isChecked():
+            command.option("-dd")
+
+        if self.eeLbl.isChecked():
+            command.option("-ee")
+
+        if geneTreeNames is not None:
+            # Write out all the gene tree names.
+            command.option("-sgt", "(" + nexusWriter.nameList(geneTreeNames) + ")")
+
+        if self.sNetLbl.isChecked() and not self.sNetEdit.text().isEmpty():
+            command.option("-snet", str(self.sNetEdit.text()))
+
+        if self.sPopLbl.isChecked() and not self.sPopEdit.text().isEmpty():
+            command.option("-sps", str(self.sPopEdit.text()))
+
+        if self.preLbl.isChecked() and not self.preEdit.text().isEmpty():
+            command.option("-pre", str(self.preEdit.text()))
+
+        if self.gtrLbl.isChecked():
+            rates = [self.GTR[key] for key in ("A", "C", "G", "T", "AC", "AG", "AT", "CG", "CT", "GT")]
+            command.option("-gtr", "(" + nexusWriter.nameList(rates) + ")")
+
+        if self.diploidLbl.isChecked() and len(self.diploidList) != 0:
+            command.option("-diploid", "(" + nexusWriter.nameList(self.diploidList) + ")")
+
+        return command
+
+    def writeData(self, path):
+        """
+        Write the TREES block of the starting gene trees, if any, and the DATA block of the loci.
+        :param path: path of the NEXUS file, created empty
+        :return: the command of the PHYLONET block for the data written, see phylonetCommand()
+        """
+        geneTreeNames = None
+        # If user specifies starting gene trees, read gene tree files and write them to output NEXUS first.
+        if self.sgtFileLbl.isChecked() and (self.sgtNexus.isChecked() or self.sgtNewick.isChecked()):
+            if self.sgtNexus.isChecked():
+                schema = "nexus"
+            else:
+                schema = "newick"
+
+            # Write out TREES block. Gene trees are streamed from each uploaded file and renamed on the fly.
+            geneTreeNames = treeIO.writeGeneTrees(path, self.sgtFiles, schema, requireTrees=True)
+
+        with nexusWriter.openOutput(path, "a") as outputFile:
+            # Write #NEXUS or not depends on the existence of TREES block.
+            if self.sgtFileLbl.isChecked() and (self.sgtNexus.isChecked() or self.sgtNewick.isChecked()):
+                outputFile.write("\n")
+            else:
+                outputFile.write("#NEXUS\n")
+            # Write DATA block.
+            writer = nexusWriter.DataBlockWriter(outputFile, "    ")
+            writer.begin(len(self.taxa_names), self.nchar,
+                         'Format datatype=dna symbols="ACGTMRWSYK" missing=? gap=-;')
+
+            # Write loci. Each locus is formatted as one chunk, in parallel for large data, and the chunks
+            # are written in locus order.
+            for chunk in self.loci.formatLoci():
+                writer.writeText(chunk)
+            writer.end(";END;\n")
+
+        return self.phylonetCommand(geneTreeNames)
+
+    def writePhylonetBlock(self, path, command):
+        """
+        Append the PHYLONET block to the NEXUS file at path, at once.
+        """
+        with nexusWriter.openOutput(path, "a") as outputFile:
+            outputFile.write("BEGIN PHYLONET;\n" + command.text() + ";\nEND;")
+
     def generate(self):
         """
         Generate NEXUS file based on user input.
@@ -839,6 +971,7 @@ class MCMCSEQPage(QMainWindow):
         class emptyDesinationError(Exception):
             pass
 
+        output = None
         try:
             if (not self.nexus.isChecked()) and (not self.fasta.isChecked()):
                 raise emptyFileError
@@ -847,264 +980,37 @@ class MCMCSEQPage(QMainWindow):
             if self.outDestEdit.text().isEmpty():
                 raise emptyDesinationError
 
-            # If user specifies starting gene trees, read gene tree files and write them to output NEXUS first.
-            if self.sgtFileLbl.isChecked() and (self.sgtNexus.isChecked() or self.sgtNewick.isChecked()):
-                if self.sgtNexus.isChecked():
-                    schema = "nexus"
-                else:
-                    schema = "newick"
-
-                # a TreeList that stores all the uploaded gene trees
-                data = dendropy.TreeList()
-                # All uploaded gene tree names
-                geneTreeNames = []
-                # read each uploaded file
-                for file in self.sgtFiles:
-                    fileName = os.path.splitext(os.path.basename(file))[0]
-                    currentFile = dendropy.TreeList()
-                    # read in gene trees
-                    currentFile.read(path=file, schema=schema, preserve_underscores=True)
-                    if len(currentFile) == 0:
-                        raise Exception("No tree data found in gene tree file")
-                    counter = 0
-                    for tree in currentFile:
-                        # rename gene trees
-                        tree.label = fileName + str(counter)
-                        geneTreeNames.append(tree.label)
-                        counter += 1
-                    data.extend(currentFile)
-
-                # Write out TREES block.
-                path = str(self.outDestEdit.text()) + "/" + str(datetime.datetime.now().strftime('%H-%M-%S')) + ".nexus"
-                data.write(path=path, schema="nexus", suppress_taxa_blocks=True, unquoted_underscores=True)
-            else:
-                # If not, just create a file to write.
-                path = str(self.outDestEdit.text()) + "/" + str(datetime.datetime.now().strftime('%H-%M-%S')) + ".nexus"
-
-            with open(path, "a") as outputFile:
-                # Write #NEXUS or not depends on the existence of TREES block.
-                if self.sgtFileLbl.isChecked() and (self.sgtNexus.isChecked() or self.sgtNewick.isChecked()):
-                    outputFile.write("\n")
-                else:
-                    outputFile.write("#NEXUS\n")
-                # Write headers of DATA block
-                outputFile.write("Begin data;\n")
-                outputFile.write("    Dimensions ntax=")
-                outputFile.write(str(len(self.taxa_names)))
-                outputFile.write(" nchar=")
-                outputFile.write(str(self.nchar))
-                outputFile.write(";\n")
-                outputFile.write('    Format datatype=dna symbols="ACGTMRWSYK" missing=? gap=-;\n')
-                outputFile.write("    Matrix\n")
-
-                # Write loci.
-                for locus in self.loci:
-                    outputFile.write("[")
-                    outputFile.write(locus)
-                    outputFile.write(", ")
-                    outputFile.write(str(self.loci[locus][0]))
-                    outputFile.write("]\n")
-
-                    for taxon, seq in self.loci[locus][1].items():
-                        outputFile.write(taxon.label)
-                        outputFile.write(" ")
-                        outputFile.write(seq.symbols_as_string())
-                        outputFile.write("\n")
-                outputFile.write(";END;\n")
-
-                # Write PHYLONET block.
-                outputFile.write("BEGIN PHYLONET;\n")
-                outputFile.write("MCMC_SEQ")
-
-                # Write optional commands based on user selection.
-                if self.chainLengthLbl.isChecked():
-                    if self.chainLengthEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -cl ")
-                        outputFile.write(str(self.chainLengthEdit.text()))
-
-                if self.burnInLengthLbl.isChecked():
-                    if self.burnInLengthEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -bl ")
-                        outputFile.write(str(self.burnInLengthEdit.text()))
-
-                if self.sampleFrequencyLbl.isChecked():
-                    if self.sampleFrequencyEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -sf ")
-                        outputFile.write(str(self.sampleFrequencyEdit.text()))
-
-                if self.seedLbl.isChecked():
-                    if self.seedEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -sd ")
-                        outputFile.write(str(self.seedEdit.text()))
-
-                if self.numProcLbl.isChecked():
-                    if self.numProcEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -pl ")
-                        outputFile.write(str(self.numProcEdit.text()))
-
-                if self.outDirLbl.isChecked():
-                    if self.outDirEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -dir ")
-                        outputFile.write('"')
-                        outputFile.write(str(self.outDirEdit.text()))
-                        outputFile.write('"')
-
-                if self.tempListLbl.isChecked():
-                    if self.tempListEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -mc3 ")
-                        outputFile.write(str(self.tempListEdit.text()))
-
-                if self.maxRetLbl.isChecked():
-                    if self.maxRetEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -mr ")
-                        outputFile.write(str(self.maxRetEdit.text()))
-
-                if self.taxamapLbl.isChecked():
-                    if len(self.taxamap) == 0:
-                        pass
-                    else:
-                        # Get a mapping from species to taxon.
-                        speciesToTaxonMap = self.__inverseMapping(self.taxamap)
-                        # Write taxa map.
-                        outputFile.write(" -tm <")
-                        for firstSpecies in speciesToTaxonMap:
-                            outputFile.write(firstSpecies)
-                            outputFile.write(":")
-                            outputFile.write(speciesToTaxonMap[firstSpecies][0])
-                            for taxon in speciesToTaxonMap[firstSpecies][1:]:
-                                outputFile.write(",")
-                                outputFile.write(taxon)
-                            speciesToTaxonMap.pop(firstSpecies)
-                            break
-                        for species in speciesToTaxonMap:
-                            outputFile.write("; ")
-                            outputFile.write(species)
-                            outputFile.write(":")
-                            outputFile.write(speciesToTaxonMap[species][0])
-                            for taxon in speciesToTaxonMap[species][1:]:
-                                outputFile.write(",")
-                                outputFile.write(taxon)
-                        outputFile.write(">")
-
-                if self.popSizeLbl.isChecked():
-                    if self.popSizeEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -fixps ")
-                        outputFile.write(str(self.popSizeEdit.text()))
-
-                if self.varypsLbl.isChecked():
-                    outputFile.write(" -varyps")
-
-                if self.ppLbl.isChecked():
-                    if self.ppEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -pp ")
-                        outputFile.write(str(self.ppEdit.text()))
-
-                if self.ddLbl.isChecked():
-                    outputFile.write(" -dd")
-
-                if self.eeLbl.isChecked():
-                    outputFile.write(" -ee")
-
-                if self.sgtFileLbl.isChecked() and (self.sgtNexus.isChecked() or self.sgtNewick.isChecked()):
-                    # Write out all the gene tree names.
-                    outputFile.write(" -sgt (")
-                    outputFile.write(geneTreeNames[0])
-                    for genetree in geneTreeNames[1:]:
-                        outputFile.write(",")
-                        outputFile.write(genetree)
-                    outputFile.write(")")
-
-                if self.sNetLbl.isChecked():
-                    if self.sNetEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -snet ")
-                        outputFile.write(str(self.sNetEdit.text()))
-
-                if self.sPopLbl.isChecked():
-                    if self.sPopEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -sps ")
-                        outputFile.write(str(self.sPopEdit.text()))
-
-                if self.preLbl.isChecked():
-                    if self.preEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -pre ")
-                        outputFile.write(str(self.preEdit.text()))
-
-                if self.gtrLbl.isChecked():
-                    outputFile.write(" -gtr (")
-                    outputFile.write(self.GTR["A"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["C"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["G"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["T"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["AC"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["AG"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["AT"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["CG"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["CT"])
-                    outputFile.write(",")
-                    outputFile.write(self.GTR["GT"])
-                    outputFile.write(")")
-
-                if self.diploidLbl.isChecked():
-                    if len(self.diploidList) == 0:
-                        pass
-                    else:
-                        outputFile.write(" -diploid (")
-                        outputFile.write(self.diploidList[0])
-                        for species in self.diploidList[1:]:
-                            outputFile.write(",")
-                            outputFile.write(species)
-                        outputFile.write(")")
+            plan = None
+            if self.shardsLbl.isChecked():
+                plan = shards.Plan(str(self.shardStrategyEdit.currentText()), str(self.shardsEdit.text()))
 
-                outputFile.write(";\n")
-                outputFile.write("END;")
+            manifest = None
+            if plan is None:
+                # The file is written under a temporary name, and only published once it is complete.
+                output = nexusWriter.OutputFile(str(self.outDestEdit.text()))
+                self.writePhylonetBlock(output.tempPath, self.writeData(output.tempPath))
+                paths = [output.publish()]
+            else:
+                # The TREES and DATA blocks are written once and copied into the file of every shard.
+                manifest, paths = shards.writeSweep(str(self.outDestEdit.text()), plan, self.writeData,
+                                                    self.writePhylonetBlock)
 
             # Clear all data after one write.
             self.inputFiles = []
             self.taxamap = {}
             self.sequenceFileEdit.clear()
-            self.loci = {}
+            self.loci = locusStore.LocusStore()
             self.nchar = 0
             self.taxa_names = set([])
             self.diploidList = []
             self.sgtFiles = []
             self.sgtFileEdit.clear()
 
-            # Validate the generated file.
-            self.validateFile(path)
+            # Validate the generated files in a worker thread.
+            self.validations.start(paths, manifest)
+        except shards.PlanError as e:
+            QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
+            return
         except emptyFileError:
             QMessageBox.warning(self, "Warning", "Please select a file type and upload data!", QMessageBox.Ok)
             return
@@ -1112,11 +1018,14 @@ class MCMCSEQPage(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please specify destination for generated NEXUS file.", QMessageBox.Ok)
             return
         except Exception as e:
+            if output is not None:
+                # Never leave a partial file behind.
+                output.discard()
             # Clear all data when encounters an exception.
             self.inputFiles = []
             self.taxamap = {}
             self.sequenceFileEdit.clear()
-            self.loci = {}
+            self.loci = locusStore.LocusStore()
             self.nchar = 0
             self.taxa_names = set([])
             self.diploidList = []
@@ -1125,20 +1034,6 @@ class MCMCSEQPage(QMainWindow):
             QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
             return
 
-    def validateFile(self, filePath):
-        """
-        After the .nexus file is generated, validate the file by feeding it to PhyloNet.
-        Specify -checkParams on command line to make sure PhyloNet checks input without executing the command.
-        """
-        try:
-            subprocess.check_output(
-                ["java", "-jar", resource_path("testphylonet.jar"),
-                 filePath, "checkParams"], stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            # If an error is encountered, delete the generated file and display the error to user.
-            os.remove(filePath)
-            QMessageBox.warning(self, "Warning", e.output, QMessageBox.Ok)
-
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
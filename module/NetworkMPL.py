@@ -3,11 +3,16 @@ import os
 from PyQt4.QtGui import *
 from PyQt4 import QtCore
 import dendropy
-import datetime
-import subprocess
 import shutil
 
 import TaxamapDlg
+import compression
+import inputCache
+import ingestion
+import treeIO
+import nexusWriter
+import shards
+import validation
 
 
 def resource_path(relative_path):
@@ -29,9 +34,19 @@ class NetworkMPLPage(QMainWindow):
         self.inputFiles = []
         self.geneTreeNames = []
         self.taxamap = {}
+        self.treeCache = inputCache.GeneTreeCache()
+        # Gene tree files are parsed in background as soon as they are selected.
+        self.ingestWorker = ingestion.IngestWorker(self.treeCache)
+        self.ingestWorker.statusChanged.connect(self.showFileStatus)
+        # Whether generate() waits for the ingestion worker to finish.
+        self.generateWhenIngested = False
+        self.ingestWorker.finished.connect(self.generateIfWaiting)
+        # Generated files are validated in background, each run with its own progress bar.
+        self.validations = validation.Validations(self)
         self.multiTreesPerLocus = False
 
         self.initUI()
+        self.fileStatus = ingestion.FileStatusView(self.geneTreesEdit)
 
     def initUI(self):
         """
@@ -274,6 +289,22 @@ class NetworkMPLPage(QMainWindow):
         self.fileDestBtn.setDisabled(True)
         self.fileDestBtn.clicked.connect(self.selectDest)
 
+        # Inputs for splitting the output into independent runs.
+        self.shardsLbl = QCheckBox("Split into independent runs, one file each:", self)
+        self.shardsLbl.setObjectName("shards")
+        self.shardsLbl.stateChanged.connect(self.onChecked)
+
+        self.shardStrategyEdit = QComboBox(self)
+        self.shardStrategyEdit.addItem(shards.BOOTSTRAP)
+        self.shardStrategyEdit.addItem(shards.SUBSETS)
+        self.shardStrategyEdit.addItem(shards.GRID)
+        self.shardStrategyEdit.setDisabled(True)
+
+        self.shardsEdit = QLineEdit()
+        self.shardsEdit.setDisabled(True)
+        self.shardsEdit.setPlaceholderText(shards.HINTS[shards.BOOTSTRAP])
+        self.shardStrategyEdit.currentIndexChanged.connect(self.showShardsHint)
+
         # Input for where the NEXUS file should be generated.
         outDestLbl = QLabel("Please specify destination for generated nexus file:")
         self.outDestEdit = QLineEdit()
@@ -283,8 +314,8 @@ class NetworkMPLPage(QMainWindow):
         self.outDestBtn.clicked.connect(self.selectNEXDest)
 
         # Launch button
-        launchBtn = QPushButton("Generate", self)
-        launchBtn.clicked.connect(self.generate)
+        self.launchBtn = QPushButton("Generate", self)
+        self.launchBtn.clicked.connect(self.generate)
 
         # Layouts
         # Layout of each parameter (label and input)
@@ -398,6 +429,12 @@ class NetworkMPLPage(QMainWindow):
         fileDestLayout.addWidget(self.fileDestEdit)
         fileDestLayout.addWidget(self.fileDestBtn)
 
+        shardsLayout = QHBoxLayout()
+        shardsLayout.addWidget(self.shardsLbl)
+        shardsLayout.addStretch(1)
+        shardsLayout.addWidget(self.shardStrategyEdit)
+        shardsLayout.addWidget(self.shardsEdit)
+
         outDestLayout = QHBoxLayout()
         outDestLayout.addWidget(outDestLbl)
         outDestLayout.addWidget(self.outDestEdit)
@@ -405,7 +442,7 @@ class NetworkMPLPage(QMainWindow):
 
         btnLayout = QHBoxLayout()
         btnLayout.addStretch(1)
-        btnLayout.addWidget(launchBtn)
+        btnLayout.addWidget(self.launchBtn)
 
         # Main layout
         topLevelLayout = QVBoxLayout()
@@ -439,6 +476,7 @@ class NetworkMPLPage(QMainWindow):
         topLevelLayout.addLayout(numProcLayout)
         topLevelLayout.addLayout(diLayout)
         topLevelLayout.addLayout(fileDestLayout)
+        topLevelLayout.addLayout(shardsLayout)
 
         topLevelLayout.addWidget(line3)
         topLevelLayout.addLayout(outDestLayout)
@@ -455,18 +493,6 @@ class NetworkMPLPage(QMainWindow):
         self.setWindowTitle('PhyloNetNEXGenerator')
         self.setWindowIcon(QIcon(resource_path("logo.png")))
 
-    def __inverseMapping(self, map):
-        """
-        Convert a mapping from taxon to species to a mapping from species to a list of taxon.
-        """
-        o = {}
-        for k, v in map.items():
-            if v in o:
-                o[v].append(k)
-            else:
-                o[v] = [k]
-        return o
-
     def aboutMessage(self):
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Information)
@@ -589,9 +615,22 @@ class NetworkMPLPage(QMainWindow):
             else:
                 self.fileDestEdit.setDisabled(False)
                 self.fileDestBtn.setDisabled(False)
+        elif self.sender().objectName() == "shards":
+            if self.shardsEdit.isEnabled():
+                self.shardStrategyEdit.setDisabled(True)
+                self.shardsEdit.setDisabled(True)
+            else:
+                self.shardStrategyEdit.setDisabled(False)
+                self.shardsEdit.setDisabled(False)
         else:
             pass
 
+    def showShardsHint(self):
+        """
+        Show what to enter for the selected way of splitting the output.
+        """
+        self.shardsEdit.setPlaceholderText(shards.HINTS[str(self.shardStrategyEdit.currentText())])
+
     def link(self, linkStr):
         """
         Open the website of PhyloNet if user clicks on the hyperlink.
@@ -607,20 +646,20 @@ class NetworkMPLPage(QMainWindow):
                 pass
             else:
                 self.newick.setChecked(False)
-                self.geneTreesEdit.clear()
                 self.inputFiles = []
                 self.geneTreeNames = []
                 self.taxamap = {}
+                self.fileStatus.clear()
         elif self.sender().objectName() == "newick":
             if not self.newick.isChecked():
                 pass
             else:
                 self.nexus.setChecked(False)
                 self.newick.setChecked(True)
-                self.geneTreesEdit.clear()
                 self.inputFiles = []
                 self.geneTreeNames = []
                 self.taxamap = {}
+                self.fileStatus.clear()
 
     def selectFile(self):
         """
@@ -632,19 +671,48 @@ class NetworkMPLPage(QMainWindow):
         else:
             fname = QFileDialog.getOpenFileName(self, 'Open file', '/')
             if fname:
-                extension = os.path.splitext(str(fname))[1]
+                extension = compression.formatExtension(str(fname))
                 if self.nexus.isChecked():
                     if extension != ".nexus" and extension != ".nex":
                         QMessageBox.warning(self, "Warning", "Please upload only .nexus files!", QMessageBox.Ok)
                     else:
-                        self.geneTreesEdit.append(fname)
                         self.inputFiles.append(str(fname))
+                        self.ingestWorker.add(str(fname), "nexus")
                 else:
                     if extension != ".newick":
                         QMessageBox.warning(self, "Warning", "Please upload only .newick files!", QMessageBox.Ok)
                     else:
-                        self.geneTreesEdit.append(fname)
                         self.inputFiles.append(str(fname))
+                        self.ingestWorker.add(str(fname), "newick")
+
+    def showFileStatus(self, path, status, numTrees, numTaxa, message):
+        """
+        Display each uploaded file with its background parsing status (queued, parsing, ok or error).
+        Execute when the ingestion worker reports a status change.
+        """
+        self.fileStatus.show(self.inputFiles, str(path),
+                             ingestion.describeStatus(str(status), numTrees, numTaxa, str(message)))
+        if self.generateWhenIngested:
+            self.showWaiting()
+
+    def generateIfWaiting(self):
+        """
+        Generate the NEXUS file asked for while gene tree files were still being parsed.
+        Execute when the ingestion worker finishes.
+        """
+        if self.generateWhenIngested:
+            self.generateWhenIngested = False
+            self.launchBtn.setEnabled(True)
+            self.launchBtn.setText("Generate")
+            self.generate()
+
+    def showWaiting(self):
+        """
+        Disable the Generate button while generation waits for the ingestion worker, and show on it how many
+        files are still to be parsed.
+        """
+        self.launchBtn.setEnabled(False)
+        self.launchBtn.setText(ingestion.describeWaiting(len(self.ingestWorker.waiting)))
 
     def selectDest(self):
         """
@@ -681,29 +749,31 @@ class NetworkMPLPage(QMainWindow):
             else:
                 schema = "newick"
 
-            data = dendropy.TreeList()
-            for file in self.inputFiles:
-                data.read(path=file, schema=schema, preserve_underscores=True)
-
             # Raise exception is found no tree data.
-            if len(data) == 0:
+            # Files are only scanned for taxon labels, and unchanged files are taken from the cache.
+            if self.treeCache.numTrees(self.inputFiles, schema) == 0:
                 raise Exception("No tree data found in data file")
 
+            # Create a taxon_namespace object based on the taxa found in all files.
+            taxa = dendropy.TaxonNamespace()
+            for label in self.treeCache.taxonLabels(self.inputFiles, schema):
+                taxa.add_taxon(dendropy.Taxon(label))
+
             # If it's the first time being clicked, set up the inital mapping,
             # which assumes only one individual for each species.
             if len(self.taxamap) == 0:
-                for taxon in data.taxon_namespace:
+                for taxon in taxa:
                     self.taxamap[taxon.label] = taxon.label
             else:
                 # If it's not the first time being clicked, check if user has changed input files.
-                for taxon in data.taxon_namespace:
+                for taxon in taxa:
                     if taxon.label not in self.taxamap:
-                        for taxon in data.taxon_namespace:
+                        for taxon in taxa:
                             self.taxamap[taxon.label] = taxon.label
                         break
 
             # Execute TaxamapDlg
-            dialog = TaxamapDlg.TaxamapDlg(data.taxon_namespace, self.taxamap, self)
+            dialog = TaxamapDlg.TaxamapDlg(taxa, self.taxamap, self)
             if dialog.exec_():
                 self.taxamap = dialog.getTaxamap()
 
@@ -714,6 +784,115 @@ class NetworkMPLPage(QMainWindow):
             QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
             return
 
+    def phylonetCommand(self, geneTreeNames, multiTreesPerLocus):
+        """
+        The command of the PHYLONET block based on user input, assembled in memory, for the gene trees written in
+        the TREES block.
+        :param geneTreeNames, multiTreesPerLocus: as returned by treeIO.writeLocusGeneTrees()
+        :return: a nexusWriter.Command
+        """
+        # Write out all the gene tree names, as a list of sets of gene tree identifiers if there are multiple trees
+        # per locus.
+        command = nexusWriter.Command("InferNetwork_MPL (" +
+                                      nexusWriter.geneTreeList(geneTreeNames, multiTreesPerLocus) + ") ")
+
+        # Write out maximum number of reticulation to add.
+        numReticulations = str(self.numReticulationsEdit.text())
+        command.append(numReticulations)
+
+        # -a taxa map command
+        if self.taxamapLbl.isChecked() and len(self.taxamap) != 0:
+            command.taxaMap("-a", self.taxamap)
+
+        # -b threshold command
+        if self.thresholdLbl.isChecked() and not self.thresholdEdit.text().isEmpty():
+            command.option("-b", str(self.thresholdEdit.text()))
+
+        # -s startingNetwork command
+        if self.sNetLbl.isChecked() and not self.sNetEdit.text().isEmpty():
+            command.option("-s", str(self.sNetEdit.text()))
+
+        # -n numNetReturned command
+        if self.nNetRetLbl.isChecked() and not self.nNetRetEdit.text().isEmpty():
+            command.option("-n", str(self.nNetRetEdit.text()))
+
+        # -h {s1 [, s2...]} command
+        if self.hybridLbl.isChecked() and not self.hybridEdit.text().isEmpty():
+            command.option("-h", str(self.hybridEdit.text()))
+
+        # -w (w1, ..., w6) command
+        if self.wetOpLbl.isChecked() and not self.wetOpEdit.text().isEmpty():
+            command.option("-w", str(self.wetOpEdit.text()))
+
+        # -x numRuns command
+        if self.numRunLbl.isChecked() and not self.numRunEdit.text().isEmpty():
+            command.option("-x", str(self.numRunEdit.text()))
+
+        # -m maxNetExamined command
+        if self.nNetExamLbl.isChecked() and not self.nNetExamEdit.text().isEmpty():
+            command.option("-m", str(self.nNetExamEdit.text()))
+
+        # -md maxDiameter command
+        if self.maxDiaLbl.isChecked() and not self.maxDiaEdit.text().isEmpty():
+            command.option("-md", str(self.maxDiaEdit.text()))
+
+        # -rd reticulationDiameter command
+        if self.retDiaLbl.isChecked() and not self.retDiaEdit.text().isEmpty():
+            command.option("-rd", str(self.retDiaEdit.text()))
+
+        # -f maxFailure command
+        if self.maxFLbl.isChecked() and not self.maxFEdit.text().isEmpty():
+            command.option("-f", str(self.maxFEdit.text()))
+
+        # -o command
+        if self.oLabel.isChecked():
+            command.option("-o")
+
+        # -po command
+        if self.poLabel.isChecked():
+            command.option("-po")
+
+        # -p command
+        if self.stopCriterionLbl.isChecked() and not self.stopCriterionEdit.text().isEmpty():
+            command.option("-p", str(self.stopCriterionEdit.text()))
+
+        # -r command
+        if self.maxRoundLbl.isChecked() and not self.maxRoundEdit.text().isEmpty():
+            command.option("-r", str(self.maxRoundEdit.text()))
+
+        # -t command
+        if self.maxTryPerBrLbl.isChecked() and not self.maxTryPerBrEdit.text().isEmpty():
+            command.option("-t", str(self.maxTryPerBrEdit.text()))
+
+        # -i command
+        if self.improveThresLbl.isChecked() and not self.maxTryPerBrEdit.text().isEmpty():
+            command.option("-i", str(self.improveThresEdit.text()))
+
+        # -l command
+        if self.maxBlLbl.isChecked() and not self.maxBlEdit.text().isEmpty():
+            command.option("-l", str(self.maxBlEdit.text()))
+
+        # -pl numProcessors command
+        if self.numProcLbl.isChecked() and not self.numProcEdit.text().isEmpty():
+            command.option("-pl", str(self.numProcEdit.text()))
+
+        # -di command
+        if self.diLbl.isChecked():
+            command.option("-di")
+
+        # resultOutputFile command
+        if self.fileDestLbl.isChecked() and not self.fileDestEdit.text().isEmpty():
+            command.argument(' "' + str(self.fileDestEdit.text()) + '"')
+
+        return command
+
+    def writePhylonetBlock(self, path, command):
+        """
+        Append the PHYLONET block to the NEXUS file at path, at once.
+        """
+        with nexusWriter.openOutput(path, "a") as outputFile:
+            outputFile.write("\nBEGIN PHYLONET;\n\n" + command.text() + ";\n\nEND;")
+
     def generate(self):
         """
         Generate NEXUS file based on user input.
@@ -727,6 +906,7 @@ class NetworkMPLPage(QMainWindow):
         class emptyDesinationError(Exception):
             pass
 
+        output = None
         try:
             if (not self.nexus.isChecked()) and (not self.newick.isChecked()):
                 raise emptyFileError
@@ -742,279 +922,61 @@ class NetworkMPLPage(QMainWindow):
                 schema = "nexus"
             else:
                 schema = "newick"
-            # a TreeList that stores all the uploaded gene trees
-            data = dendropy.TreeList()
-            # read each uploaded file
-            for file in self.inputFiles:
-                fileName = os.path.splitext(os.path.basename(file))[0]
-                currentFile = dendropy.TreeList()
-                # read in gene trees
-                currentFile.read(path=file, schema=schema, preserve_underscores=True)
-                if len(currentFile) > 1:
-                    # If a file contains multiple trees, assume those trees come from one locus
-                    self.multiTreesPerLocus = True
-                    counter = 0
-                    currentLocus = []
-                    for tree in currentFile:
-                        # rename gene trees
-                        tree.label = fileName + str(counter)
-                        currentLocus.append(tree.label)
-                        counter += 1
-                    self.geneTreeNames.append(currentLocus)
-                    data.extend(currentFile)
-                else:
-                    # If a file contains only one tree, assume only that tree comes from that locus
-                    for tree in currentFile:
-                        tree.label = fileName
-                        self.geneTreeNames.append(tree.label)
-                    data.extend(currentFile)
-
-            # Raise exception is found no tree data.
-            if len(data) == 0:
-                raise Exception("No tree data found in data file")
-
-            # Write out TREES block.
-            path = str(self.outDestEdit.text()) + "/" + str(datetime.datetime.now().strftime('%H-%M-%S')) + ".nexus"
-            data.write(path=path, schema="nexus", suppress_taxa_blocks=True, unquoted_underscores=True)
-
-            # Ready to write PHYLONET block.
-            with open(path, "a") as outputFile:
-                outputFile.write("\nBEGIN PHYLONET;\n\n")
-                outputFile.write("InferNetwork_MPL (")
-                # Write out all the gene tree names.
-                if not self.multiTreesPerLocus:
-                    # If there's only one tree per locus, write a comma delimited list of gene tree identifiers.
-                    outputFile.write(self.geneTreeNames[0])
-                    for genetree in self.geneTreeNames[1:]:
-                        outputFile.write(",")
-                        outputFile.write(genetree)
-                    outputFile.write(") ")
-                else:
-                    # If there are multiple trees per locus, write a comma delimited list of sets of gene tree
-                    # identifiers.
-                    if type(self.geneTreeNames[0]) is list:
-                        outputFile.write("{")
-                        outputFile.write(self.geneTreeNames[0][0])
-                        for genetree in self.geneTreeNames[0][1:]:
-                            outputFile.write(",")
-                            outputFile.write(genetree)
-                        outputFile.write("}")
-                    else:
-                        outputFile.write("{")
-                        outputFile.write(self.geneTreeNames[0])
-                        outputFile.write("}")
-
-                    for locus in self.geneTreeNames[1:]:
-                        outputFile.write(",")
-                        if type(locus) is list:
-                            outputFile.write("{")
-                            outputFile.write(locus[0])
-                            for genetree in locus[1:]:
-                                outputFile.write(",")
-                                outputFile.write(genetree)
-                            outputFile.write("}")
-                        else:
-                            outputFile.write("{")
-                            outputFile.write(locus)
-                            outputFile.write("}")
-                    outputFile.write(") ")
-
-                # Write out maximum number of reticulation to add.
-                numReticulations = str(self.numReticulationsEdit.text())
-                outputFile.write(numReticulations)
-
-                # -a taxa map command
-                if self.taxamapLbl.isChecked():
-                    if len(self.taxamap) == 0:
-                        pass
-                    else:
-                        # Get a mapping from species to taxon.
-                        speciesToTaxonMap = self.__inverseMapping(self.taxamap)
-                        # Write taxa map.
-                        outputFile.write(" -a <")
-                        for firstSpecies in speciesToTaxonMap:
-                            outputFile.write(firstSpecies)
-                            outputFile.write(":")
-                            outputFile.write(speciesToTaxonMap[firstSpecies][0])
-                            for taxon in speciesToTaxonMap[firstSpecies][1:]:
-                                outputFile.write(",")
-                                outputFile.write(taxon)
-                            speciesToTaxonMap.pop(firstSpecies)
-                            break
-                        for species in speciesToTaxonMap:
-                            outputFile.write("; ")
-                            outputFile.write(species)
-                            outputFile.write(":")
-                            outputFile.write(speciesToTaxonMap[species][0])
-                            for taxon in speciesToTaxonMap[species][1:]:
-                                outputFile.write(",")
-                                outputFile.write(taxon)
-
-                        outputFile.write(">")
-
-                # -b threshold command
-                if self.thresholdLbl.isChecked():
-                    if self.thresholdEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -b ")
-                        outputFile.write(str(self.thresholdEdit.text()))
-
-                # -s startingNetwork command
-                if self.sNetLbl.isChecked():
-                    if self.sNetEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -s ")
-                        outputFile.write(str(self.sNetEdit.text()))
-
-                # -n numNetReturned command
-                if self.nNetRetLbl.isChecked():
-                    if self.nNetRetEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -n ")
-                        outputFile.write(str(self.nNetRetEdit.text()))
-
-                # -h {s1 [, s2...]} command
-                if self.hybridLbl.isChecked():
-                    if self.hybridEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -h ")
-                        outputFile.write(str(self.hybridEdit.text()))
-
-                # -w (w1, ..., w6) command
-                if self.wetOpLbl.isChecked():
-                    if self.wetOpEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -w ")
-                        outputFile.write(str(self.wetOpEdit.text()))
-
-                # -x numRuns command
-                if self.numRunLbl.isChecked():
-                    if self.numRunEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -x ")
-                        outputFile.write(str(self.numRunEdit.text()))
-
-                # -m maxNetExamined command
-                if self.nNetExamLbl.isChecked():
-                    if self.nNetExamEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -m ")
-                        outputFile.write(str(self.nNetExamEdit.text()))
-
-                # -md maxDiameter command
-                if self.maxDiaLbl.isChecked():
-                    if self.maxDiaEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -md ")
-                        outputFile.write(str(self.maxDiaEdit.text()))
-
-                # -rd reticulationDiameter command
-                if self.retDiaLbl.isChecked():
-                    if self.retDiaEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -rd ")
-                        outputFile.write(str(self.retDiaEdit.text()))
-
-                # -f maxFailure command
-                if self.maxFLbl.isChecked():
-                    if self.maxFEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -f ")
-                        outputFile.write(str(self.maxFEdit.text()))
-
-                # -o command
-                if self.oLabel.isChecked():
-                    outputFile.write(" -o")
-
-                # -po command
-                if self.poLabel.isChecked():
-                    outputFile.write(" -po")
-
-                # -p command
-                if self.stopCriterionLbl.isChecked():
-                    if self.stopCriterionEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -p ")
-                        outputFile.write(str(self.stopCriterionEdit.text()))
-
-                # -r command
-                if self.maxRoundLbl.isChecked():
-                    if self.maxRoundEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -r ")
-                        outputFile.write(str(self.maxRoundEdit.text()))
-
-                # -t command
-                if self.maxTryPerBrLbl.isChecked():
-                    if self.maxTryPerBrEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -t ")
-                        outputFile.write(str(self.maxTryPerBrEdit.text()))
-
-                # -i command
-                if self.improveThresLbl.isChecked():
-                    if self.maxTryPerBrEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -i ")
-                        outputFile.write(str(self.improveThresEdit.text()))
-
-                # -l command
-                if self.maxBlLbl.isChecked():
-                    if self.maxBlEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -l ")
-                        outputFile.write(str(self.maxBlEdit.text()))
-
-                # -pl numProcessors command
-                if self.numProcLbl.isChecked():
-                    if self.numProcEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" -pl ")
-                        outputFile.write(str(self.numProcEdit.text()))
-
-                # -di command
-                if self.diLbl.isChecked():
-                    outputFile.write(" -di")
+            plan = None
+            if self.shardsLbl.isChecked():
+                plan = shards.Plan(str(self.shardStrategyEdit.currentText()), str(self.shardsEdit.text()))
+            # Files still being parsed in background will be in the cache once the worker is done, so generation
+            # starts again when it finishes rather than blocking the page meanwhile.
+            if self.ingestWorker.isRunning():
+                self.generateWhenIngested = True
+                self.showWaiting()
+                return
+
+            manifest = None
+            if plan is None:
+                # Write out TREES block. Gene trees are streamed from each uploaded file and renamed on the fly.
+                # The file is written under a temporary name, and only published once it is complete.
+                output = nexusWriter.OutputFile(str(self.outDestEdit.text()))
+                self.geneTreeNames, self.multiTreesPerLocus = treeIO.writeLocusGeneTrees(output.tempPath,
+                                                                                           self.inputFiles, schema,
+                                                                                           self.treeCache)
+                self.writePhylonetBlock(output.tempPath,
+                                        self.phylonetCommand(self.geneTreeNames, self.multiTreesPerLocus))
+                paths = [output.publish()]
+            elif plan.sharesData:
+                # The TREES block is written once and copied into the file of every shard.
+                def writeData(path):
+                    self.geneTreeNames, self.multiTreesPerLocus = treeIO.writeLocusGeneTrees(path, self.inputFiles,
+                                                                                               schema, self.treeCache)
+                    return self.phylonetCommand(self.geneTreeNames, self.multiTreesPerLocus)
+
+                manifest, paths = shards.writeSweep(str(self.outDestEdit.text()), plan, writeData,
+                                                    self.writePhylonetBlock)
+            else:
+                # Gene trees are read once, then each shard is written with its own loci and options.
+                loci = treeIO.readLoci(self.inputFiles, schema, self.treeCache)
 
-                # resultOutputFile command
-                if self.fileDestLbl.isChecked():
-                    if self.fileDestEdit.text().isEmpty():
-                        pass
-                    else:
-                        outputFile.write(" ")
-                        outputFile.write('"')
-                        outputFile.write(self.fileDestEdit.text())
-                        outputFile.write('"')
+                def writeShard(shard, path):
+                    geneTreeNames, multiTreesPerLocus = treeIO.writeLoci(path, loci, shard.indices)
+                    self.writePhylonetBlock(path, shard.command(self.phylonetCommand(geneTreeNames,
+                                                                                     multiTreesPerLocus)))
 
-                # End of NEXUS
-                outputFile.write(";\n\n")
-                outputFile.write("END;")
+                manifest, paths = shards.writeShards(str(self.outDestEdit.text()), plan, plan.shards(len(loci)),
+                                                     writeShard)
 
             self.geneTreeNames = []
             self.inputFiles = []
             self.taxamap = {}
-            self.geneTreesEdit.clear()
+            self.treeCache.clear()
+            self.fileStatus.clear()
             self.multiTreesPerLocus = False
 
-            # Validate the generated file.
-            self.validateFile(path)
+            # Validate the generated files in a worker thread.
+            self.validations.start(paths, manifest)
 
+        except shards.PlanError as e:
+            QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
+            return
         except emptyFileError:
             QMessageBox.warning(self, "Warning", "Please select a file type and upload data!", QMessageBox.Ok)
             return
@@ -1025,28 +987,18 @@ class NetworkMPLPage(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please specify destination for generated NEXUS file.", QMessageBox.Ok)
             return
         except Exception as e:
+            if output is not None:
+                # Never leave a partial file behind.
+                output.discard()
             self.geneTreeNames = []
             self.inputFiles = []
             self.taxamap = {}
-            self.geneTreesEdit.clear()
+            self.treeCache.clear()
+            self.fileStatus.clear()
             self.multiTreesPerLocus = False
             QMessageBox.warning(self, "Warning", str(e), QMessageBox.Ok)
             return
 
-    def validateFile(self, filePath):
-        """
-        After the .nexus file is generated, validate the file by feeding it to PhyloNet.
-        Specify -checkParams on command line to make sure PhyloNet checks input without executing the command.
-        """
-        try:
-            subprocess.check_output(
-                ["java", "-jar", resource_path("testphylonet.jar"),
-                 filePath, "checkParams"], stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            # If an error is encountered, delete the generated file and display the error to user.
-            os.remove(filePath)
-            QMessageBox.warning(self, "Warning", e.output, QMessageBox.Ok)
-
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -0,0 +1,523 @@
+import os
+import tempfile
+import numpy
+import dendropy
+
+import codeMatrix
+import diskCache
+import markerMatrix
+import nexusWriter
+import workerPool
+
+# Data types of the input, as shown on the bi-marker pages.
+BIALLELIC = "bi-allelic markers data"
+PHASED = "phased data"
+UNPHASED = "unphased data"
+
+# Stages of a conversion, reported to progress callbacks as progress(stage, done, total).
+READ = "Reading data"
+PHASE = "Phasing"
+EXTRACT = "Extracting bi-allelic markers"
+WRITE = "Writing"
+VALIDATE = "Validating"
+
+# Each ambiguity code is split into the two nucleotides of the haplotypes _0 and _1.
+AMBIGUITY_CODE = {
+    "M": ("A", "C"),
+    "R": ("A", "G"),
+    "W": ("A", "T"),
+    "S": ("C", "G"),
+    "Y": ("C", "T"),
+    "K": ("G", "T")
+}
+
+# Ignore the entire column if the column contains these symbols.
+IGNORE_CODE = "VHDBN-"
+
+# Columns containing a gap are never bi-allelic markers.
+GAP = ord("-")
+
+# Number of columns converted at a time. Temporary arrays of the conversion are bounded by this many columns.
+BLOCK_SIZE = 1 << 16
+
+# Matrices with fewer symbols than this are converted in the calling process, as starting a pool costs more.
+PARALLEL_MIN_SIZE = 1 << 24
+
+
+def _lookupTables():
+    """
+    Lookup tables indexed by symbol code: whether a symbol makes its column ignored, and the symbol written
+    for it in haplotype _0 and _1.
+    """
+    ignore = numpy.zeros(256, dtype=bool)
+    ignore[[ord(symbol) for symbol in IGNORE_CODE]] = True
+    first = numpy.arange(256, dtype=numpy.uint8)
+    second = numpy.arange(256, dtype=numpy.uint8)
+    for code, (nucleotide0, nucleotide1) in AMBIGUITY_CODE.items():
+        first[ord(code)] = ord(nucleotide0)
+        second[ord(code)] = ord(nucleotide1)
+    return ignore, first, second
+
+
+_IGNORE, _FIRST, _SECOND = _lookupTables()
+
+
+def _symbolTables():
+    """
+    Lookup tables to find the phased symbols of a column without phasing it: a bit for each symbol that can be
+    left after phasing, the bits of both haplotype symbols of each unphased symbol, the symbol of a single bit
+    and the number of bits set.
+    """
+    bit = numpy.zeros(256, dtype=numpy.uint8)
+    for i, symbol in enumerate("ACGT?"):
+        bit[ord(symbol)] = 1 << i
+    haplotypeBits = bit[_FIRST] | bit[_SECOND]
+    bitSymbol = numpy.zeros(256, dtype=numpy.uint8)
+    for i, symbol in enumerate("ACGT?"):
+        bitSymbol[1 << i] = ord(symbol)
+    bitCount = numpy.array([bin(value).count("1") for value in range(256)], dtype=numpy.uint8)
+    return bit, haplotypeBits, bitSymbol, bitCount
+
+
+_BIT, _HAPLOTYPE_BITS, _BIT_SYMBOL, _BIT_COUNT = _symbolTables()
+_IDENTITY = numpy.arange(256, dtype=numpy.uint8)
+# Lookup table of each phased row, by haplotype: None for phased data, 0 for _0 and 1 for _1.
+_HAPLOTYPES = {None: _IDENTITY, 0: _FIRST, 1: _SECOND}
+
+
+class Cancelled(Exception):
+    """
+    Raised by a progress callback to stop a conversion. Tasks already given to workerPool finish in the background
+    and their results are dropped.
+    """
+    pass
+
+
+def _noProgress(stage, done, total):
+    pass
+
+
+def _decode(row):
+    return str(row.tobytes().decode("ascii"))
+
+
+def _blocks(nchar, blockSize):
+    """
+    Yield slices of consecutive column blocks.
+    """
+    for start in range(0, nchar, blockSize):
+        yield slice(start, min(start + blockSize, nchar))
+
+
+def _zeroSymbols(first, other):
+    """
+    For each pair of symbols of a bi-allelic column, the symbol encoded as 0.
+    The original conversion took the first element of the set of the column's symbols, so the same set is built
+    here, in the same insertion order, for each distinct pair. The order of a set depends on string hashes, which
+    differ between processes on Python 3, so this only runs in the process converting, never in a worker.
+    :param first: 1D uint8 array, symbol of the first taxon in each column
+    :param other: 1D uint8 array, the other symbol in each column
+    :return: 1D uint8 array
+    """
+    pairs = first.astype(numpy.int32) * 256 + other
+    zero = numpy.empty(len(pairs), dtype=numpy.uint8)
+    for pair in numpy.unique(pairs):
+        symbols = list(set([chr(pair // 256), chr(pair % 256)]))
+        zero[pairs == pair] = ord(symbols[0])
+    return zero
+
+
+def _phasedColumns(block, firstRow):
+    """
+    Find the bi-allelic columns of a block of phased data: exactly two distinct symbols and no gap.
+    :return: (mask of kept columns, symbol of firstRow and the other symbol in each kept column)
+    """
+    first = block[firstRow]
+    differs = block != first
+    # The other symbol of a column, if there is one. A third symbol is any symbol differing from both.
+    other = numpy.where(differs, block, 0).max(axis=0)
+    third = (differs & (block != other)).any(axis=0)
+    kept = differs.any(axis=0) & ~third & (first != GAP) & (other != GAP)
+    return kept, first[kept], other[kept]
+
+
+def _unphasedColumns(block, firstRow, firstHaplotype):
+    """
+    Find the columns of a block of unphased data that are bi-allelic once phased, without phasing them.
+    Each unphased symbol is mapped to the bits of both of its haplotype symbols.
+    :param firstHaplotype: _FIRST or _SECOND, the haplotype of the first phased row
+    :return: (mask of kept columns, symbol of the first phased row and the other symbol in each kept column)
+    """
+    # Gaps never get this far, since columns with a gap are ignored.
+    symbols = numpy.bitwise_or.reduce(_HAPLOTYPE_BITS[block], axis=0)
+    kept = ~_IGNORE[block].any(axis=0) & (_BIT_COUNT[symbols] == 2)
+    first = firstHaplotype[block[firstRow, kept]]
+    return kept, first, _BIT_SYMBOL[symbols[kept] & ~_BIT[first]]
+
+
+def _scanColumns(block, firstRow, firstHaplotype):
+    """
+    First pass over one column block: find its bi-allelic columns and their two symbols.
+    :param firstHaplotype: haplotype of the first phased row, None for phased data
+    :return: (mask of kept columns, symbol of the first phased row and the other symbol in each kept column)
+    """
+    if firstHaplotype is None:
+        return _phasedColumns(block, firstRow)
+    return _unphasedColumns(block, firstRow, _HAPLOTYPES[firstHaplotype])
+
+
+def _markerBlocks(row, haplotype, kept, zero, blockSize):
+    """
+    Second pass over the column blocks of one row: yield its bi-allelic markers block by block.
+    :param haplotype: haplotype of the row, None for phased data
+    """
+    table = _HAPLOTYPES[haplotype]
+    for block in _blocks(len(row), blockSize):
+        keptInBlock = kept[block]
+        markers = table[row[block][keptInBlock]] != zero[block][keptInBlock]
+        yield _decode(markers.view(numpy.uint8) + numpy.uint8(ord("0")))
+
+
+def _scanShard(args):
+    """
+    Scan one column shard, args = (path and shape of the encoded matrix, start, stop, firstRow, firstHaplotype).
+    Runs in a worker process. The 0 symbols are left to the calling process, see _zeroSymbols().
+    :return: (start, mask of kept columns, symbol of the first phased row and the other symbol in each kept
+             column) of the shard
+    """
+    path, shape, start, stop, firstRow, firstHaplotype = args
+    codes = numpy.memmap(path, dtype=numpy.uint8, mode="r", shape=shape)
+    return (start,) + _scanColumns(codes[:, start:stop], firstRow, firstHaplotype)
+
+
+def _rowMarkers(args):
+    """
+    Bi-allelic markers of one output row, args = (path and shape of the encoded matrix, row, haplotype, path of
+    the kept columns and 0 symbols, blockSize). Runs in a worker process.
+    """
+    path, shape, row, haplotype, columnsPath, blockSize = args
+    codes = numpy.memmap(path, dtype=numpy.uint8, mode="r", shape=shape)
+    columns = numpy.memmap(columnsPath, dtype=numpy.uint8, mode="r", shape=(2, shape[1]))
+    return "".join(_markerBlocks(codes[row], haplotype, columns[0].view(numpy.bool_), columns[1], blockSize))
+
+
+def _writeColumns(kept, zero):
+    """
+    Write the kept columns and their 0 symbols to a temporary file, which the workers converting rows map.
+    :return: its path
+    """
+    descriptor, path = tempfile.mkstemp(".columns")
+    with os.fdopen(descriptor, "wb") as columnsFile:
+        columnsFile.write(kept.view(numpy.uint8).tobytes())
+        columnsFile.write(zero.tobytes())
+    return path
+
+
+class ConvertedMarkers(object):
+    """
+    Bi-allelic markers of phased or unphased data, kept as what is needed to convert the rows again rather than as
+    the rows themselves: the encoded input matrix, which stays in its mapped file, and a mask of the kept columns
+    with their 0 symbols, two bytes per input column. Rows are converted block by block each time they are
+    written, so memory does not grow with the number of rows, or once for all by pack(), which Conversion.packed()
+    keeps for the files written later.
+    Written out like a markerMatrix.MarkerMatrix.
+    """
+    def __init__(self, matrix, outputRows, kept, zero, blockSize, processes, columns=None):
+        """
+        :param matrix: the codeMatrix.CodeMatrix of the input data
+        :param outputRows: list of (label, row of matrix, haplotype), in output order. Haplotype is None for phased
+                           data, 0 or 1 for the phased rows of unphased data.
+        :param kept: 1D bool array, the columns of matrix that are bi-allelic markers
+        :param zero: 1D uint8 array, the symbol encoded as 0 in each kept column
+        :param processes: 1 to convert in the calling process, otherwise large matrices are converted in workerPool
+        :param columns: the markers written, as indices of kept columns, all of them in order if None
+        """
+        self.matrix = matrix
+        self.outputRows = outputRows
+        self.kept = kept
+        self.zero = zero
+        self.blockSize = blockSize
+        self.processes = processes
+        self.columns = columns
+        self.labels = [label for label, row, haplotype in outputRows]
+        # Number of markers.
+        self.nchar = int(kept.sum()) if columns is None else len(columns)
+
+    def __len__(self):
+        """
+        Number of taxa.
+        """
+        return len(self.outputRows)
+
+    def subset(self, labels):
+        """
+        The markers of the given taxa only, in the given order.
+        """
+        rowOf = dict((outputRow[0], outputRow) for outputRow in self.outputRows)
+        return ConvertedMarkers(self.matrix, [rowOf[label] for label in labels], self.kept, self.zero,
+                                self.blockSize, self.processes, self.columns)
+
+    def selectColumns(self, columns):
+        """
+        The markers made of the given columns, in the given order. A column may be taken more than once, e.g. by a
+        bootstrap replicate.
+        :param columns: 1D array of marker indices
+        """
+        columns = numpy.asarray(columns, dtype=numpy.int64)
+        if self.columns is not None:
+            columns = self.columns[columns]
+        return ConvertedMarkers(self.matrix, self.outputRows, self.kept, self.zero, self.blockSize, self.processes,
+                                columns)
+
+    def rows(self):
+        """
+        Yield (taxon label, iterator of marker strings) in output order. Large matrices are converted in the shared
+        workerPool, whose workers map the file of the matrix, and rows are returned in order.
+        """
+        if self.processes == 1 or len(self.matrix) * self.matrix.nchar < PARALLEL_MIN_SIZE:
+            codes = self.matrix.codes()
+            for label, row, haplotype in self.outputRows:
+                yield label, self._select(_markerBlocks(codes[row], haplotype, self.kept, self.zero, self.blockSize))
+            return
+
+        shape = (len(self.matrix), self.matrix.nchar)
+        columnsPath = _writeColumns(self.kept, self.zero)
+        try:
+            markers = workerPool.imap(_rowMarkers, ((self.matrix.path, shape, row, haplotype, columnsPath,
+                                                     self.blockSize) for label, row, haplotype in self.outputRows))
+            for (label, row, haplotype), rowMarkers in zip(self.outputRows, markers):
+                yield label, self._select([rowMarkers])
+        finally:
+            try:
+                os.remove(columnsPath)
+            except OSError:
+                # Still mapped by a worker of a cancelled conversion on Windows.
+                pass
+
+    def _select(self, blocks):
+        if self.columns is None:
+            return blocks
+        symbols = numpy.frombuffer("".join(blocks).encode("ascii"), dtype=numpy.uint8)
+        return [_decode(symbols[self.columns])]
+
+    def pack(self, progress=None):
+        """
+        Convert every row once into a markerMatrix.MarkerMatrix, two bits per marker, from which files can be
+        written again without converting any row.
+        :param progress: if given, called as progress(rows converted, number of rows) after each row
+        """
+        def rows():
+            for i, (label, blocks) in enumerate(self.rows()):
+                yield label, "".join(blocks)
+                if progress is not None:
+                    progress(i + 1, len(self.outputRows))
+
+        return markerMatrix.MarkerMatrix.fromRows(rows(), "?")
+
+    def writeMatrix(self, outputFile, progress=None):
+        """
+        Write the rows of a NEXUS Matrix section, "label markers" on each line, converting each row as it is
+        written.
+        :param progress: if given, called as progress(rows written, number of rows) after each row
+        """
+        for i, (label, blocks) in enumerate(self.rows()):
+            outputFile.write(label + " ")
+            for block in blocks:
+                outputFile.write(block)
+            outputFile.write("\n")
+            if progress is not None:
+                progress(i + 1, len(self.outputRows))
+
+
+def _convert(matrix, phasedRows, blockSize, processes, progress):
+    """
+    Find the bi-allelic markers of a matrix. Columns are scanned block by block for the kept columns and their 0
+    symbols; rows are only converted when the markers are written. Large matrices are scanned in the shared
+    workerPool, whose workers map the file of the matrix, with the scan split into column shards.
+    :param matrix: a codeMatrix.CodeMatrix
+    :param phasedRows: function from the taxon labels in matrix order to (list of (label, row, haplotype) in output
+                       order, (row, haplotype) of the first row of the phased matrix)
+    :param processes: 1 to convert in the calling process, otherwise large matrices are converted in workerPool
+    :param progress: called as progress(stage, done, total) after each column block scanned. The scan is reported
+                     as PHASE for unphased data and as EXTRACT for phased data.
+    :return: a ConvertedMarkers
+    """
+    outputRows, (firstRow, firstHaplotype) = phasedRows(matrix.labels)
+    scanStage = EXTRACT if firstHaplotype is None else PHASE
+    kept = numpy.zeros(matrix.nchar, dtype=bool)
+    zero = numpy.zeros(matrix.nchar, dtype=numpy.uint8)
+    blocks = list(_blocks(matrix.nchar, blockSize))
+    if processes == 1 or len(matrix) * matrix.nchar < PARALLEL_MIN_SIZE:
+        codes = matrix.codes()
+        scans = ((block.start,) + _scanColumns(codes[:, block], firstRow, firstHaplotype) for block in blocks)
+    else:
+        shape = (len(matrix), matrix.nchar)
+        shards = ((matrix.path, shape, block.start, block.stop, firstRow, firstHaplotype) for block in blocks)
+        scans = workerPool.imap(_scanShard, shards)
+    for i, (start, keptInBlock, first, other) in enumerate(scans):
+        block = slice(start, start + len(keptInBlock))
+        kept[block] = keptInBlock
+        zero[block][keptInBlock] = _zeroSymbols(first, other)
+        progress(scanStage, i + 1, len(blocks))
+    return ConvertedMarkers(matrix, outputRows, kept, zero, blockSize, processes)
+
+
+def phasedToBiMarkers(matrix, blockSize=BLOCK_SIZE, processes=None, progress=_noProgress):
+    """
+    Convert phased data into bi-allelic markers, block of columns by block of columns.
+    :param matrix: a codeMatrix.CodeMatrix of phased data
+    :param blockSize: number of columns converted at a time
+    :param processes: 1 to convert in the calling process, otherwise large matrices are converted in workerPool
+    :param progress: called as progress(stage, done, total) while converting, see _convert()
+    :return: a ConvertedMarkers
+    """
+    def phasedRows(labels):
+        rowOf = dict((label, row) for row, label in enumerate(labels))
+        # The original conversion wrote the markers in the order of a dictionary filled in taxon namespace order.
+        outputRows = {}
+        for label in matrix.namespace:
+            outputRows[label] = rowOf[label]
+        return [(label, outputRows[label], None) for label in outputRows], (0, None)
+
+    return _convert(matrix, phasedRows, blockSize, processes, progress)
+
+
+def unphasedToBiMarkers(matrix, blockSize=BLOCK_SIZE, processes=None, progress=_noProgress):
+    """
+    Convert unphased data straight into bi-allelic markers, like the original conversion did from the phased
+    matrix, without building the phased sequences. Rows are phased block by block while they are written out.
+    :param matrix: a codeMatrix.CodeMatrix of unphased data
+    :param blockSize: number of columns converted at a time
+    :param processes: 1 to convert in the calling process, otherwise large matrices are converted in workerPool
+    :param progress: called as progress(stage, done, total) while converting, see _convert()
+    :return: a ConvertedMarkers
+    """
+    def phasedRows(labels):
+        rowOf = dict((label, row) for row, label in enumerate(labels))
+        # The original phased matrix had its rows in the order of a dictionary filled in taxon namespace order,
+        # and the markers were written in the order of a dictionary filled in that row order. Only labels go
+        # through these dictionaries.
+        phased = {}
+        for label in matrix.namespace:
+            phased[label + "_0"] = (rowOf[label], 0)
+            phased[label + "_1"] = (rowOf[label], 1)
+        rowOrder = list(phased)
+        outputRows = {}
+        for label in rowOrder:
+            outputRows[label] = phased[label]
+        return [(label,) + outputRows[label] for label in outputRows], phased[rowOrder[0]]
+
+    return _convert(matrix, phasedRows, blockSize, processes, progress)
+
+
+def readData(path, schema, dataType, progress=None):
+    """
+    Read an input file of a bi-marker conversion. Compressed files are decompressed while read, and files read
+    before are taken from diskCache.
+    :param schema: "nexus" or "fasta"
+    :param dataType: BIALLELIC, PHASED or UNPHASED
+    :param progress: called as progress(READ, done, total) while reading, see codeMatrix.readMatrix(). The total
+                     is 0 while bi-allelic marker data is read by dendropy. It may raise Cancelled to stop.
+    :return: a MarkerMatrix for bi-allelic marker data, a codeMatrix.CodeMatrix otherwise
+    """
+    if progress is None:
+        progress = _noProgress
+    kwargs = {"preserve_underscores": True} if schema == "nexus" else {}
+    if dataType == BIALLELIC:
+        # Bi-allelic marker data is read in as Standard Character Matrix and kept packed.
+        progress(READ, 0, 0)
+        rows = diskCache.readSequences(dendropy.StandardCharacterMatrix, path, schema, **kwargs)
+        progress(READ, 0, 0)
+        return markerMatrix.MarkerMatrix.fromRows(rows)
+    # DNA data is encoded into a memory-mapped file as it is read.
+    return codeMatrix.readMatrix(path, schema, lambda done, total: progress(READ, done, total), **kwargs)
+
+
+class Conversion(object):
+    """
+    Result of convert(): the bi-allelic markers and statistics of the conversion.
+    A page keeps the conversion of its data, so that files written later from the same data, data type and taxa
+    only take a subset or select columns of its packed markers.
+    """
+    def __init__(self, markers, dataType, numTaxa, numSites, data=None, taxa=None):
+        # MarkerMatrix of bi-allelic marker data, ConvertedMarkers of phased and unphased data
+        self.markers = markers
+        self.dataType = dataType
+        # Number of taxa and sites of the input data
+        self.numTaxa = numTaxa
+        self.numSites = numSites
+        # The input data and the taxa kept, as given to convert()
+        self.data = data
+        self.taxa = taxa
+        # MarkerMatrix of markers, once packed
+        self._packed = markers if isinstance(markers, markerMatrix.MarkerMatrix) else None
+
+    @property
+    def numMarkers(self):
+        return self.markers.nchar
+
+    def matches(self, data, dataType, taxa=None):
+        """
+        Whether this is the conversion of the same data object, read as dataType, for the same taxa.
+        """
+        return self.data is data and self.dataType == dataType and \
+            self.taxa == (None if taxa is None else list(taxa))
+
+    def packed(self, progress=None):
+        """
+        The markers as a MarkerMatrix. Rows of phased and unphased data are converted the first time only, and the
+        packed matrix is kept with the conversion. Jobs sharing a conversion may both pack it, which gives the
+        same matrix.
+        :param progress: called as progress(EXTRACT, rows converted, number of rows) while rows are converted. It
+                         may raise Cancelled to stop.
+        """
+        if self._packed is None:
+            if progress is None:
+                progress = _noProgress
+            self._packed = self.markers.pack(lambda done, total: progress(EXTRACT, done, total))
+        return self._packed
+
+
+def convert(data, dataType, taxa=None, blockSize=BLOCK_SIZE, processes=None, progress=None):
+    """
+    Convert input data into bi-allelic markers. Used by the bi-marker pages, and usable without any GUI, e.g.
+    convert(readData("data.nexus", "nexus", UNPHASED), UNPHASED).markers.writeMatrix(outputFile).
+    :param data: input data as returned by readData()
+    :param dataType: BIALLELIC, PHASED or UNPHASED
+    :param taxa: labels of the rows to keep, in the order to keep them. For unphased data, rows are the phased
+                 taxa, e.g. "A_0" and "A_1". All rows, in the order the pages write them, if None.
+    :param blockSize: number of columns converted at a time
+    :param processes: 1 to convert in the calling process, otherwise large matrices are converted in workerPool
+    :param progress: called as progress(stage, done, total) while converting. It may raise Cancelled to stop.
+    :return: a Conversion. Phased and unphased data are only scanned here; their rows are converted when the
+             markers are written, or once for all when they are packed by Conversion.packed().
+    """
+    if progress is None:
+        progress = _noProgress
+    if dataType == BIALLELIC:
+        markers = data
+        numSites = data.nchar
+    else:
+        numSites = data.nchar
+        if dataType == PHASED:
+            markers = phasedToBiMarkers(data, blockSize, processes, progress)
+        else:
+            markers = unphasedToBiMarkers(data, blockSize, processes, progress)
+    if taxa is not None:
+        taxa = list(taxa)
+        markers = markers.subset(taxa)
+    return Conversion(markers, dataType, len(data), numSites, data, taxa)
+
+
+def writeData(outputFile, markers, progress=_noProgress):
+    """
+    Start a NEXUS file with the DATA block of converted bi-allelic markers.
+    :param markers: a MarkerMatrix or ConvertedMarkers
+    :param progress: called as progress(WRITE, rows done, number of rows) after each row
+    """
+    outputFile.write("#NEXUS\n")
+    writer = nexusWriter.DataBlockWriter(outputFile)
+    writer.begin(len(markers), markers.nchar, 'Format datatype=dna symbols="012" missing=? gap=-;')
+    outputFile.write("\n")
+    markers.writeMatrix(outputFile, lambda done, total: progress(WRITE, done, total))
+    writer.end(";End;\n\n")
@@ -0,0 +1,200 @@
+from PyQt4 import QtCore
+
+import biMarkers
+import nexusWriter
+import shards
+import validation
+
+# Largest total of the progress reported through progressChanged.
+MAX_PROGRESS = 1 << 20
+
+
+def phylonetBlock(command):
+    """
+    The PHYLONET block of a bi-marker page, written after the DATA block.
+    :param command: a nexusWriter.Command
+    """
+    return "BEGIN PHYLONET;\n" + command.text() + ";\nEND;"
+
+
+class Job(object):
+    """
+    Everything needed to write the output file of a bi-marker page, captured on the GUI thread when Generate is
+    clicked. A worker thread only reads its job, never the widgets of the page, so the form can be edited and
+    several jobs can run at the same time.
+    """
+    def __init__(self, directory, data, dataType, taxaList, taxamap, command, conversion=None, plan=None):
+        """
+        :param directory: where to write the output file, named after the time the job was created
+        :param data: input data as returned by biMarkers.readData(). It is never modified, so it is shared with
+                     the page instead of copied.
+        :param dataType: biMarkers.BIALLELIC, PHASED or UNPHASED
+        :param taxaList: taxa used for inference
+        :param taxamap: taxon -> species
+        :param command: the nexusWriter.Command of the PHYLONET block, built from the options of the page
+        :param conversion: the last biMarkers.Conversion of data, if any
+        :param plan: a shards.Plan to write one file per shard and a manifest instead of a single file
+        """
+        self.directory = directory
+        self.name = nexusWriter.timeName()
+        # The output file, once it has been published, or the first shard. See nexusWriter.OutputFile.
+        self.path = None
+        # The manifest, if the job has a plan, and the files published: the output file or the files of the shards.
+        self.manifest = None
+        self.paths = []
+        self.data = data
+        self.dataType = dataType
+        self.taxaList = list(taxaList)
+        self.taxamap = dict(taxamap)
+        self.command = command
+        self.conversion = conversion
+        self.plan = plan
+        # Output of PhyloNet for the file that failed validation, in which case the run has been removed.
+        self.validationError = None
+
+    def bimarkers(self, progress=None):
+        """
+        Bi-allelic markers of the data, converted and packed unless the job was given a conversion of the same data
+        and data type. The page takes the conversion back once the job is done, so that the next job only writes
+        the packed markers out.
+        :return: a markerMatrix.MarkerMatrix
+        """
+        if self.conversion is None or not self.conversion.matches(self.data, self.dataType):
+            self.conversion = biMarkers.convert(self.data, self.dataType, progress=progress)
+        return self.conversion.packed(progress)
+
+
+class ReadJob(object):
+    """
+    An input file of a bi-marker page to read, captured on the GUI thread when the file is selected.
+    """
+    def __init__(self, path, schema, dataType):
+        """
+        :param schema: "nexus" or "fasta"
+        :param dataType: biMarkers.BIALLELIC, PHASED or UNPHASED
+        """
+        self.path = path
+        self.schema = schema
+        self.dataType = dataType
+        # The data read, as returned by biMarkers.readData(), once the job is done.
+        self.data = None
+
+
+class Worker(QtCore.QThread):
+    """
+    Worker thread for writing the output file of a bi-marker page from a Job.
+    Progress of every stage is reported through progressChanged, and cancel() stops the work at the next row or
+    column block. The file is written under a temporary name and published when complete, then every file of the
+    run is validated by PhyloNet, so a cancelled, failed or invalid run leaves no output file behind.
+    """
+    # Signal to emit when encounters an exception.
+    exception = QtCore.pyqtSignal(Exception)
+    # Signal to emit when the stage or its percentage changes: (stage, done, total).
+    progressChanged = QtCore.pyqtSignal(str, int, int)
+
+    def __init__(self, job):
+        QtCore.QThread.__init__(self)
+        self.job = job
+        self.cancelRequested = False
+        # True once the whole file has been written.
+        self.succeeded = False
+        self.lastProgress = None
+
+    def cancel(self):
+        """
+        Ask the thread to stop. Called from the main thread.
+        """
+        self.cancelRequested = True
+
+    def report(self, stage, done, total):
+        """
+        Progress callback passed to the conversion and the writer. Only emits when the percentage changes, so that
+        the main thread is not flooded with signals on large inputs.
+        :raise biMarkers.Cancelled: if cancel() has been called
+        """
+        if self.cancelRequested:
+            raise biMarkers.Cancelled()
+        if total > MAX_PROGRESS:
+            # Progress bars count in ints, so large totals, e.g. bytes of a file read, are scaled down.
+            done, total = done * MAX_PROGRESS // total, MAX_PROGRESS
+        current = (stage, 100 * done // max(total, 1))
+        if current != self.lastProgress:
+            self.lastProgress = current
+            self.progressChanged.emit(stage, done, total)
+
+    def run(self):
+        """
+        Execute the thread. Generate NEXUS file from the job and validate it.
+        """
+        try:
+            if self.job.plan is None:
+                with nexusWriter.OutputFile(self.job.directory, self.job.name) as output:
+                    with nexusWriter.openOutput(output.tempPath) as outputFile:
+                        # Phased and unphased data are converted into bi-allelic markers, or taken from the last
+                        # conversion.
+                        biMarkers.writeData(outputFile, self.job.bimarkers(self.report), self.report)
+                        outputFile.write(phylonetBlock(self.job.command))
+                self.job.path = output.path
+                self.job.paths = [output.path]
+            else:
+                self.writeShards()
+            self.job.validationError = shards.validate(
+                self.job.paths, self.job.manifest, validation.checkFile,
+                lambda done, total: self.report(biMarkers.VALIDATE, done, total))
+            self.succeeded = True
+        except biMarkers.Cancelled:
+            pass
+        except Exception as e:
+            self.exception.emit(e)
+
+    def writeShards(self):
+        """
+        Write one file per shard of the job plan from a single conversion, then the manifest listing them.
+        Bootstrap replicates resample the sites of the converted markers. Seed lists and option grids write the
+        DATA block once and copy it into every shard.
+        """
+        job = self.job
+        if job.plan.sharesData:
+            def writeData(path):
+                with nexusWriter.openOutput(path) as outputFile:
+                    biMarkers.writeData(outputFile, job.bimarkers(self.report), self.report)
+                return job.command
+
+            def writeCommand(path, command):
+                with nexusWriter.openOutput(path, "a") as outputFile:
+                    outputFile.write(phylonetBlock(command))
+
+            job.manifest, job.paths = shards.writeSweep(job.directory, job.plan, writeData, writeCommand, job.name)
+        else:
+            markers = job.bimarkers(self.report)
+
+            def writeShard(shard, path):
+                shardMarkers = markers if shard.indices is None else markers.selectColumns(shard.indices)
+                with nexusWriter.openOutput(path) as outputFile:
+                    biMarkers.writeData(outputFile, shardMarkers,
+                                        lambda stage, done, total: self.report(stage + " " + shard.description,
+                                                                               done, total))
+                    outputFile.write(phylonetBlock(shard.command(job.command)))
+
+            job.manifest, job.paths = shards.writeShards(job.directory, job.plan, job.plan.shards(markers.nchar),
+                                                         writeShard, job.name)
+        job.path = job.paths[0]
+
+
+class Reader(Worker):
+    """
+    Worker thread for reading the input file of a bi-marker page from a ReadJob, so that a large file never
+    blocks the page. Progress is reported as the READ stage, and cancel() stops reading at the next chunk or row
+    without caching a partial matrix.
+    """
+    def run(self):
+        """
+        Execute the thread. Read the data of the job.
+        """
+        try:
+            self.job.data = biMarkers.readData(self.job.path, self.job.schema, self.job.dataType, self.report)
+            self.succeeded = True
+        except biMarkers.Cancelled:
+            pass
+        except Exception as e:
+            self.exception.emit(e)
@@ -0,0 +1,411 @@
+import os
+import re
+import numpy
+import dendropy
+
+import compression
+import diskCache
+import locusStore
+
+# Bytes read from the input file at a time. Reading never holds more than about this much of the file.
+CHUNK_SIZE = 1 << 20
+
+# Codes of the encoding table for white space and for symbols that DnaCharacterMatrix would not read as they are.
+BLANK = 0
+INVALID = 255
+
+_FASTA_HEADER = re.compile(br"^[ \t]*>(.*)$", re.M)
+_BLANKS = re.compile(br"\s*")
+# A row label of a NEXUS matrix. A quoted label ending at the end of the read data may still go on in the next
+# chunk, so it is only taken once the character after it has been read.
+_NEXUS_LABEL = re.compile(br"'(?:[^']|'')*'(?!')|[^\s']\S*")
+
+
+def _text(label):
+    if isinstance(label, str):
+        return label
+    return label.decode("utf-8")
+
+
+def _encodeTable():
+    """
+    Lookup table from a byte of the input to the symbol stored for it: the symbol as
+    DnaCharacterMatrix.symbols_as_string() returns it, i.e. in upper case, BLANK for white space and INVALID for
+    anything else.
+    """
+    table = numpy.full(256, INVALID, dtype=numpy.uint8)
+    for symbol in "ACGTNMRWSYKVHDB":
+        table[ord(symbol)] = table[ord(symbol.lower())] = ord(symbol)
+    for symbol in "?-":
+        table[ord(symbol)] = ord(symbol)
+    for symbol in " \t\r\n\v\f":
+        table[ord(symbol)] = BLANK
+    return table
+
+
+_ENCODE = _encodeTable()
+
+
+class CodeMatrix(object):
+    """
+    A DNA character matrix encoded one byte per symbol, row after row, in a file that is memory-mapped when it is
+    read. Converting it touches a block of columns at a time, so the matrix never has to fit in memory, and
+    worker processes open the same file instead of receiving a copy.
+    Symbols are stored as DnaCharacterMatrix.symbols_as_string() returns them.
+    """
+    def __init__(self, labels, namespace, path, nchar, temporary=False):
+        """
+        :param labels: taxon labels, one per row, in the order dendropy iterates over the matrix
+        :param namespace: taxon labels in taxon namespace order
+        :param path: file holding len(labels) rows of nchar bytes
+        :param temporary: whether the file is removed with this object, when it could not be kept in diskCache.
+                          Otherwise the file is an array held in diskCache, released with this object.
+        """
+        self.labels = labels
+        self.namespace = namespace
+        self.path = path
+        self.nchar = nchar
+        self.temporary = temporary
+        self.held = not temporary
+        self._codes = None
+
+    def __len__(self):
+        """
+        Number of taxa.
+        """
+        return len(self.labels)
+
+    def __getstate__(self):
+        # Copies sent to worker processes map the file themselves and never remove or release it.
+        state = dict(self.__dict__)
+        state["_codes"] = None
+        state["temporary"] = False
+        state["held"] = False
+        return state
+
+    def __del__(self):
+        if self.held:
+            diskCache.release(self.path)
+        if self.temporary:
+            self._codes = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def codes(self):
+        """
+        The matrix as a read-only 2D uint8 array, one row per taxon.
+        """
+        if self._codes is None:
+            self._codes = numpy.memmap(self.path, dtype=numpy.uint8, mode="r", shape=(len(self.labels), self.nchar))
+        return self._codes
+
+    def taxonNamespace(self):
+        """
+        Taxa of the matrix as a dendropy TaxonNamespace, for the taxa list and taxa map dialogs.
+        """
+        return dendropy.TaxonNamespace(self.namespace)
+
+
+class _Spill(object):
+    """
+    Rows of a matrix encoded into a file as they are read. The first row sets the number of columns; longer
+    rows are cut to it, as the column loops of the original conversion ignored the extra symbols.
+    """
+    def __init__(self, outputFile, strict):
+        """
+        :param strict: if True, rows that dendropy would report, e.g. a repeated label, raise UnsupportedLayout
+                       so that the file is read again by dendropy
+        """
+        self.outputFile = outputFile
+        self.strict = strict
+        self.labels = []
+        self.seen = set([])
+        self.nchar = None
+        # Number of symbols of the current row.
+        self.length = 0
+
+    def startRow(self, label):
+        self.finishRow()
+        if self.strict and label.lower() in self.seen:
+            raise locusStore.UnsupportedLayout()
+        self.seen.add(label.lower())
+        self.labels.append(label)
+        self.length = 0
+
+    def write(self, raw):
+        """
+        Append symbols to the current row. White space is dropped and lower case symbols are turned to upper case.
+        :raise UnsupportedLayout: if raw holds a symbol that DnaCharacterMatrix would not read as it is
+        """
+        codes = _ENCODE[numpy.frombuffer(raw, dtype=numpy.uint8)]
+        if (codes == INVALID).any():
+            raise locusStore.UnsupportedLayout()
+        self.writeCodes(codes[codes != BLANK])
+
+    def writeCodes(self, codes):
+        """
+        Append symbols that are already encoded to the current row.
+        """
+        if not self.labels:
+            if len(codes) > 0:
+                raise locusStore.UnsupportedLayout()
+            return
+        if self.nchar is not None:
+            self.outputFile.write(codes[:max(0, self.nchar - self.length)].tobytes())
+        else:
+            self.outputFile.write(codes.tobytes())
+        self.length += len(codes)
+
+    def finishRow(self):
+        if not self.labels:
+            return
+        if self.length == 0 and self.strict:
+            raise locusStore.UnsupportedLayout()
+        if self.nchar is None:
+            self.nchar = self.length
+        elif self.length < self.nchar:
+            raise Exception("Sequence of " + self.labels[-1] + " is shorter than the first sequence.")
+
+    def finish(self):
+        """
+        :return: the number of columns
+        """
+        self.finishRow()
+        if not self.labels or not self.nchar:
+            if self.strict:
+                raise locusStore.UnsupportedLayout()
+            raise Exception("No sequence data found in data file")
+        return self.nchar
+
+
+def _fastaLines(data, spill):
+    """
+    Read complete lines of a FASTA file: a header starts a row, other lines go on with the current row.
+    """
+    position = 0
+    for header in _FASTA_HEADER.finditer(data):
+        spill.write(data[position:header.start()])
+        spill.startRow(_text(header.group(1).strip()))
+        position = header.end()
+    spill.write(data[position:])
+
+
+def _readFasta(inputFile, spill):
+    """
+    Encode a FASTA file chunk by chunk. Headers are only read as whole lines, but a sequence line is written as
+    it is read, however long it is.
+    """
+    pending = b""
+    # True while the input goes on with a sequence line that has been partly written.
+    midLine = False
+    while True:
+        chunk = inputFile.read(CHUNK_SIZE)
+        data = pending + chunk
+        pending = b""
+        if midLine:
+            newline = data.find(b"\n")
+            midLine = newline < 0
+            spill.write(data if midLine else data[:newline])
+            data = b"" if midLine else data[newline + 1:]
+        if chunk:
+            cut = data.rfind(b"\n") + 1
+            data, pending = data[:cut], data[cut:]
+        _fastaLines(data, spill)
+        if not chunk:
+            return
+        # A line that cannot become a header is written at once.
+        start = pending.lstrip(b" \t")
+        if start and not start.startswith(b">"):
+            spill.write(pending)
+            pending = b""
+            midLine = True
+
+
+class _Input(object):
+    """
+    A window on a binary file read CHUNK_SIZE bytes at a time: data[position:] has been read but not consumed.
+    """
+    def __init__(self, inputFile):
+        self.inputFile = inputFile
+        self.data = b""
+        self.position = 0
+
+    def more(self):
+        """
+        Read the next chunk, dropping what has been consumed.
+        :return: False at the end of the file
+        """
+        chunk = self.inputFile.read(CHUNK_SIZE)
+        self.data = self.data[self.position:] + chunk
+        self.position = 0
+        return len(chunk) > 0
+
+    def available(self):
+        return len(self.data) - self.position
+
+
+def _nexusSequence(text, spill, nchar):
+    """
+    Read the nchar symbols of a row, which may be split into tokens and wrapped over several lines.
+    :raise UnsupportedLayout: if the last token of the row does not end after exactly nchar symbols
+    """
+    need = nchar
+    while need > 0:
+        if text.available() == 0 and not text.more():
+            raise locusStore.UnsupportedLayout()
+        # Look a little beyond the symbols still needed, to allow for white space between tokens.
+        end = min(len(text.data), text.position + need + 1024)
+        window = text.data[text.position:end]
+        codes = _ENCODE[numpy.frombuffer(window, dtype=numpy.uint8)]
+        symbols = numpy.flatnonzero(codes != BLANK)
+        if len(symbols) >= need:
+            window = window[:symbols[need - 1] + 1]
+            codes = codes[:len(window)]
+        if (codes == INVALID).any():
+            raise locusStore.UnsupportedLayout()
+        spill.writeCodes(codes[codes != BLANK])
+        need -= min(need, len(symbols))
+        text.position += len(window)
+    if text.available() == 0:
+        text.more()
+    if text.available() > 0 and _ENCODE[ord(text.data[text.position:text.position + 1])] != BLANK and \
+            text.data[text.position:text.position + 1] != b";":
+        raise locusStore.UnsupportedLayout()
+
+
+def _readNexus(inputFile, spill):
+    """
+    Encode the matrix of a NEXUS file chunk by chunk. Only the layouts indexed by locusStore are read this way.
+    """
+    text = _Input(inputFile)
+    while True:
+        more = text.more()
+        start = locusStore.matrixStart(text.data)
+        # The MATRIX command must not be cut by the end of the chunk.
+        if start is not None and (start[0] < len(text.data) or not more):
+            break
+        if not more:
+            raise locusStore.UnsupportedLayout()
+    text.position, nchar = start
+
+    while True:
+        text.position = _BLANKS.match(text.data, text.position).end()
+        if text.available() == 0:
+            if not text.more():
+                raise locusStore.UnsupportedLayout()
+            continue
+        if text.data[text.position:text.position + 1] == b";":
+            break
+        label = _NEXUS_LABEL.match(text.data, text.position)
+        if label is None or label.end() == len(text.data):
+            if not text.more():
+                raise locusStore.UnsupportedLayout()
+            continue
+        spill.startRow(locusStore.nexusLabel(label.group()))
+        text.position = label.end()
+        _nexusSequence(text, spill, nchar)
+
+    # Whatever follows the matrix must not reorder its taxa or add another matrix.
+    tail = text.data[text.position + 1:]
+    while True:
+        locusStore.checkTrailer(tail)
+        chunk = inputFile.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        # Keep the end of the previous chunk, so that a command cut in two is still found.
+        tail = tail[-64:] + chunk
+
+
+class _Progress(object):
+    """
+    A binary input stream calling progress(bytes of the file read, size of the file) after each read. Both are 0
+    when the position in a compressed file is not known.
+    """
+    def __init__(self, path, inputFile, progress):
+        self.path = path
+        self.inputFile = inputFile
+        self.progress = progress
+        self.size = os.path.getsize(path)
+
+    def read(self, size):
+        data = self.inputFile.read(size)
+        position = compression.rawPosition(self.path, self.inputFile)
+        if position is None:
+            self.progress(0, 0)
+        else:
+            self.progress(min(position, self.size), self.size)
+        return data
+
+
+def _readDendropy(path, schema, spill, progress, **kwargs):
+    """
+    Read a file with dendropy, then encode its rows. Used for the layouts that are not read chunk by chunk.
+    :param progress: called as progress(0, 0) before dendropy reads the file, then progress(rows encoded, rows)
+    :return: the taxon labels in taxon namespace order
+    """
+    progress(0, 0)
+    with compression.openInput(path) as inputFile:
+        matrix = dendropy.DnaCharacterMatrix.get(file=inputFile, schema=schema, **kwargs)
+    for i, taxon in enumerate(matrix):
+        spill.startRow(taxon.label)
+        spill.writeCodes(numpy.frombuffer(matrix[taxon].symbols_as_string().encode("ascii"), dtype=numpy.uint8))
+        progress(i + 1, len(matrix))
+    return [taxon.label for taxon in matrix.taxon_namespace]
+
+
+def _noProgress(done, total):
+    pass
+
+
+def readMatrix(path, schema, progress=None, **kwargs):
+    """
+    Read a DNA character matrix file, possibly compressed, into a CodeMatrix holding the same rows as
+    DnaCharacterMatrix.get(path=path, schema=schema, **kwargs).
+    FASTA files and NEXUS files indexed by locusStore are encoded chunk by chunk, without building any dendropy
+    object; other layouts are read with dendropy. The encoded matrix is kept in diskCache, so a file with the
+    same content is never read again.
+    :param schema: "nexus" or "fasta"
+    :param progress: called as progress(done, total) while the file is read, in bytes of the file read chunk by
+                     chunk, in rows for a file read by dendropy, and with a total of 0 when it is not known. It may
+                     raise an exception to stop reading.
+    :param kwargs: passed to dendropy; only preserve_underscores=True for NEXUS and no option for FASTA are
+                   supported without dendropy
+    :return: a CodeMatrix
+    """
+    if progress is None:
+        progress = _noProgress
+    key = diskCache.makeKey("CodeMatrix", path, schema, kwargs)
+    stored = diskCache.loadArray(key)
+    if stored is not None:
+        (labels, namespace, nchar), arrayPath = stored
+        return CodeMatrix(labels, namespace, arrayPath, nchar)
+
+    outputFile, temp = diskCache.createArrayFile()
+    try:
+        with outputFile:
+            spill = _Spill(outputFile, True)
+            try:
+                if kwargs != ({"preserve_underscores": True} if schema == "nexus" else {}):
+                    raise locusStore.UnsupportedLayout()
+                with compression.openBinary(path) as binaryFile:
+                    inputFile = _Progress(path, binaryFile, progress)
+                    if schema == "nexus":
+                        _readNexus(inputFile, spill)
+                    else:
+                        _readFasta(inputFile, spill)
+                nchar = spill.finish()
+                namespace = spill.labels
+            except locusStore.UnsupportedLayout:
+                outputFile.seek(0)
+                outputFile.truncate()
+                spill = _Spill(outputFile, False)
+                namespace = _readDendropy(path, schema, spill, progress, **kwargs)
+                nchar = spill.finish()
+    except Exception:
+        os.remove(temp)
+        raise
+
+    arrayPath = diskCache.storeArray(key, temp, (spill.labels, namespace, nchar))
+    return CodeMatrix(spill.labels, namespace, arrayPath, nchar, arrayPath == temp)
@@ -0,0 +1,95 @@
+import os
+import sys
+import io
+import gzip
+import bz2
+
+try:
+    import lzma
+except ImportError:
+    # Python 2 has no lzma module unless backports.lzma is installed; .xz files are then rejected on open.
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".xz")
+
+
+def splitCompression(path):
+    """
+    Split a compression suffix off a path, e.g. "locus1.newick.gz" -> ("locus1.newick", ".gz").
+    The suffix is "" for uncompressed files.
+    """
+    root, extension = os.path.splitext(path)
+    if extension.lower() in COMPRESSED_EXTENSIONS:
+        return root, extension.lower()
+    return path, ""
+
+
+def formatExtension(path):
+    """
+    Extension of the data format of a possibly compressed file, e.g. "locus1.newick.gz" -> ".newick".
+    """
+    return os.path.splitext(splitCompression(path)[0])[1]
+
+
+def baseName(path):
+    """
+    File name without directory, compression suffix and format extension, e.g. "/data/locus1.newick.gz" -> "locus1".
+    Used to name loci and gene trees after their file.
+    """
+    return os.path.splitext(os.path.basename(splitCompression(path)[0]))[0]
+
+
+def openBinary(path):
+    """
+    Open a possibly compressed input file for reading bytes. Offsets and seek() refer to the decompressed content.
+    """
+    compression = splitCompression(path)[1]
+    if compression == "":
+        return open(path, "rb")
+    if compression == ".gz":
+        return gzip.GzipFile(path, "rb")
+    if compression == ".bz2":
+        return bz2.BZ2File(path, "rb")
+    if lzma is None:
+        raise Exception("Reading .xz files requires the lzma module (backports.lzma on Python 2).")
+    return lzma.LZMAFile(path, "rb")
+
+
+def rawPosition(path, stream):
+    """
+    Number of bytes of the file itself read so far by a stream returned by openBinary(path), i.e. compressed bytes
+    for a compressed file, to report reading progress against os.path.getsize(path).
+    :return: the position, or None if the decompressor does not tell it, e.g. for .bz2 files on Python 2
+    """
+    compression = splitCompression(path)[1]
+    if compression == "":
+        raw = stream
+    elif compression == ".gz":
+        raw = stream.fileobj
+    else:
+        # BZ2File and LZMAFile of Python 3 read the file through _fp.
+        raw = getattr(stream, "_fp", None)
+    if raw is None:
+        return None
+    try:
+        return raw.tell()
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def openInput(path):
+    """
+    Open a possibly compressed input file for reading text. Compressed files are decompressed on the fly
+    while they are read, never to a temporary file.
+    """
+    if splitCompression(path)[1] == "":
+        return open(path)
+    stream = openBinary(path)
+
+    # Python 2 readers expect byte strings, Python 3 readers expect text.
+    if sys.version_info[0] >= 3:
+        return io.TextIOWrapper(stream)
+    return stream
@@ -0,0 +1,236 @@
+import os
+import hashlib
+import pickle
+import tempfile
+import threading
+import zlib
+
+import compression
+
+# Parsed inputs are kept here across sessions, keyed by the content hash of the input file.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".PhyloNetCompanion", "cache")
+# Least recently used entries are evicted once the cache grows beyond this size.
+MAX_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+# Bump when the layout of stored entries changes, so that old entries are never read back.
+FORMAT_VERSION = 1
+# Suffixes of the files of the cache: pickled entries, and raw arrays that are memory-mapped instead of loaded.
+ENTRY_SUFFIX = ".pkl.z"
+ARRAY_SUFFIX = ".u8"
+
+# Arrays of the cache still mapped by this process, with the number of their users. They are never evicted.
+_held = {}
+_heldLock = threading.Lock()
+
+
+def contentHash(path):
+    """
+    SHA-1 of the content of a file, read in blocks.
+    """
+    sha = hashlib.sha1()
+    with open(path, "rb") as inputFile:
+        block = inputFile.read(1 << 20)
+        while block:
+            sha.update(block)
+            block = inputFile.read(1 << 20)
+    return sha.hexdigest()
+
+
+def makeKey(kind, path, schema, options=None):
+    """
+    Cache key of a file: what it was parsed into, how it was read and the hash of its content.
+    :param options: keyword arguments of the reader, e.g. {"preserve_underscores": True}. They are hashed with
+                    the content, so a file read with other options is not taken from the cache.
+    """
+    digest = contentHash(path)
+    if options:
+        digest = hashlib.sha1((digest + repr(sorted(options.items()))).encode("utf-8")).hexdigest()
+    return "%s-%s-%s-v%d" % (kind, schema, digest, FORMAT_VERSION)
+
+
+def _entryPath(key):
+    return os.path.join(CACHE_DIR, key + ENTRY_SUFFIX)
+
+
+def _arrayPath(key):
+    return os.path.join(CACHE_DIR, key + ARRAY_SUFFIX)
+
+
+def load(key):
+    """
+    Return the data stored under key, or None if there is none.
+    A corrupt or unreadable entry is treated as missing.
+    """
+    entry = _entryPath(key)
+    try:
+        with open(entry, "rb") as cacheFile:
+            data = pickle.loads(zlib.decompress(cacheFile.read()))
+        # Mark the entry as recently used.
+        os.utime(entry, None)
+        return data
+    except Exception:
+        return None
+
+
+def store(key, data):
+    """
+    Store data under key as a compressed pickle, then evict least recently used entries if the cache is too big.
+    The cache is best effort: failing to write it never fails the caller.
+    """
+    if _write(key, data):
+        _evictSafely((_entryPath(key),))
+
+
+def _write(key, data):
+    """
+    Write the entry of key, without evicting anything.
+    :return: whether it was written
+    """
+    entry = _entryPath(key)
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        # Write to a temporary file first so that a concurrent reader never sees a partial entry. Its name is
+        # unique, as several threads of one process may store the same entry at the same time.
+        descriptor, temp = tempfile.mkstemp(".tmp", "", CACHE_DIR)
+        try:
+            with os.fdopen(descriptor, "wb") as cacheFile:
+                cacheFile.write(zlib.compress(pickle.dumps(data, 2), 1))
+            os.rename(temp, entry)
+        except Exception:
+            os.remove(temp)
+            raise
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _evictSafely(keep):
+    try:
+        evict(keep=keep)
+    except (IOError, OSError):
+        pass
+
+
+def createArrayFile():
+    """
+    Create a uniquely named file to write a large array into, e.g. an encoded sequence matrix. It is created in
+    the cache directory when possible, so that storeArray() only has to rename it.
+    :return: (the file, open for writing bytes, its path)
+    """
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        descriptor, path = tempfile.mkstemp(".tmp", "", CACHE_DIR)
+    except (IOError, OSError):
+        descriptor, path = tempfile.mkstemp(".tmp")
+    return os.fdopen(descriptor, "wb"), path
+
+
+def storeArray(key, temp, data):
+    """
+    Store the complete array file temp under key, with data describing it, e.g. its shape. An array larger than
+    the whole cache is not stored, as evicting it would remove it while it is used.
+    The stored array is held for the caller, who must release() it once it is no longer mapped.
+    :param temp: a file created by createArrayFile() and closed
+    :return: the path of the stored array, or temp if it could not be stored
+    """
+    path = _arrayPath(key)
+    try:
+        if os.path.getsize(temp) > MAX_CACHE_BYTES:
+            return temp
+        os.rename(temp, path)
+    except OSError:
+        return temp
+    hold(path)
+    _write(key, data)
+    _evictSafely((_entryPath(key), path))
+    return path
+
+
+def loadArray(key):
+    """
+    Return (data, path of the array) stored under key with storeArray(), or None if there are none.
+    The array is held for the caller, who must release() it once it is no longer mapped.
+    """
+    data = load(key)
+    path = _arrayPath(key)
+    if data is None or not os.path.isfile(path):
+        return None
+    hold(path)
+    try:
+        # Mark the array as recently used.
+        os.utime(path, None)
+    except OSError:
+        # Evicted by another process in the meantime.
+        release(path)
+        return None
+    return data, path
+
+
+def hold(path):
+    """
+    Keep the array at path from being evicted until it is released as many times as it was held.
+    """
+    with _heldLock:
+        _held[path] = _held.get(path, 0) + 1
+
+
+def release(path):
+    """
+    Let the array at path be evicted again, once every holder has released it.
+    """
+    with _heldLock:
+        if _held.get(path, 0) > 1:
+            _held[path] -= 1
+        else:
+            _held.pop(path, None)
+
+
+def evict(maxBytes=None, keep=()):
+    """
+    Remove least recently used entries until the cache fits in maxBytes, MAX_CACHE_BYTES by default.
+    Arrays still held and the files in keep, e.g. the entry being stored, are never removed.
+    """
+    if maxBytes is None:
+        maxBytes = MAX_CACHE_BYTES
+    with _heldLock:
+        kept = set(_held)
+    kept.update(keep)
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(ENTRY_SUFFIX) and not name.endswith(ARRAY_SUFFIX):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= maxBytes:
+            break
+        if path in kept:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def readSequences(matrixClass, path, schema, **kwargs):
+    """
+    Read the (taxon label, sequence string) pairs of a character matrix file, in taxon order, without keeping
+    the dendropy matrix. The pairs are stored on disk, so a file with the same content is never parsed again.
+    :param matrixClass: dendropy.DnaCharacterMatrix or dendropy.StandardCharacterMatrix
+    :return: a list of (taxon label, sequence string) pairs
+    """
+    key = makeKey(matrixClass.__name__, path, schema, kwargs)
+    sequences = load(key)
+    if sequences is None:
+        with compression.openInput(path) as inputFile:
+            matrix = matrixClass.get(file=inputFile, schema=schema, **kwargs)
+        sequences = [(taxon.label, matrix[taxon].symbols_as_string()) for taxon in matrix]
+        store(key, sequences)
+    return sequences
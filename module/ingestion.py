@@ -0,0 +1,135 @@
+import collections
+from PyQt4.QtGui import QTextCursor
+from PyQt4 import QtCore
+
+import inputCache
+import workerPool
+
+QUEUED = "queued"
+PARSING = "parsing"
+OK = "ok"
+ERROR = "error"
+
+
+def describeStatus(status, numTrees, numTaxa, message):
+    """
+    Text displayed next to an uploaded file for its ingestion status.
+    """
+    if status == OK:
+        return "[ok: %d trees, %d taxa]" % (numTrees, numTaxa)
+    if status == ERROR:
+        return "[error: %s]" % message
+    return "[%s]" % status
+
+
+def describeWaiting(numFiles):
+    """
+    Text of the Generate button while generation waits for files to be parsed.
+    """
+    return "Waiting for %d file%s to finish parsing..." % (numFiles, "" if numFiles == 1 else "s")
+
+
+class FileStatusView(object):
+    """
+    The uploaded files in a QTextEdit, one line per upload in upload order, each followed by its ingestion status.
+    A status change only rewrites the lines of its file, so showing it takes no longer as more files are uploaded.
+    """
+    def __init__(self, textEdit):
+        self.textEdit = textEdit
+        # path -> status text
+        self.status = {}
+        # path -> numbers of its lines
+        self.lines = {}
+        self.numLines = 0
+
+    def show(self, inputFiles, path, text):
+        """
+        Show the status of a file.
+        :param inputFiles: the uploaded files, in upload order. Files uploaded since the last call get their line.
+        """
+        self.status[path] = text
+        for file in inputFiles[self.numLines:]:
+            self.textEdit.append(file + "  " + self.status.get(file, ""))
+            self.lines.setdefault(file, []).append(self.numLines)
+            self.numLines += 1
+        document = self.textEdit.document()
+        for line in self.lines.get(path, []):
+            cursor = QTextCursor(document.findBlockByNumber(line))
+            cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+            cursor.insertText(path + "  " + text)
+
+    def clear(self):
+        self.textEdit.clear()
+        self.status = {}
+        self.lines = {}
+        self.numLines = 0
+
+
+class IngestWorker(QtCore.QThread):
+    """
+    Worker thread that parses uploaded gene tree files into a GeneTreeCache as soon as they are selected,
+    so that generate() only has to write them out.
+    """
+    # Signal to emit when the status of a file changes: path, status, number of trees, number of taxa, message.
+    statusChanged = QtCore.pyqtSignal(str, str, int, int, str)
+
+    def __init__(self, cache):
+        QtCore.QThread.__init__(self)
+        self.cache = cache
+        # (path, schema) waiting to be parsed. deque appends and pops are thread safe.
+        self.pending = collections.deque()
+        # Paths queued or being parsed. Only updated on the GUI thread, by add() and trackStatus().
+        self.waiting = set([])
+        self.statusChanged.connect(self.trackStatus)
+        # A file may be added just as the thread is about to finish, so check again once it has finished.
+        self.finished.connect(self.startIfPending)
+
+    def add(self, path, schema):
+        """
+        Queue a file for parsing. Execute on the GUI thread when a file is selected.
+        """
+        self.waiting.add(path)
+        self.pending.append((path, schema))
+        self.statusChanged.emit(path, QUEUED, 0, 0, "")
+        self.startIfPending()
+
+    def trackStatus(self, path, status, numTrees, numTaxa, message):
+        """
+        Keep track of the files still waiting to be parsed. Connected before the pages connect to statusChanged,
+        so that waiting is up to date when they are told.
+        """
+        if str(status) in (OK, ERROR):
+            self.waiting.discard(str(path))
+
+    def startIfPending(self):
+        if self.pending and not self.isRunning():
+            self.start()
+
+    def run(self):
+        """
+        Execute the thread. Parse all files queued so far in the shared workerPool, several of them at a time,
+        then the files queued meanwhile.
+        """
+        while self.pending:
+            # (path, schema, fileKey) of the files to parse
+            toParse = []
+            queued = set([])
+            while self.pending:
+                path, schema = self.pending.popleft()
+                try:
+                    parsed = self.cache.lookup(path, schema)
+                    if parsed is not None:
+                        self.statusChanged.emit(path, OK, len(parsed.newicks), len(parsed.taxa), "")
+                    elif path not in queued:
+                        queued.add(path)
+                        toParse.append((path, schema, inputCache.fileKey(path, schema)))
+                        self.statusChanged.emit(path, PARSING, 0, 0, "")
+                except Exception as e:
+                    self.statusChanged.emit(path, ERROR, 0, 0, str(e))
+            results = workerPool.imap(inputCache.parseFile, [(path, schema) for path, schema, key in toParse])
+            for (path, schema, key), (parsed, message) in zip(toParse, results):
+                if parsed is None:
+                    self.statusChanged.emit(path, ERROR, 0, 0, message)
+                else:
+                    self.cache.put(path, key, parsed)
+                    self.statusChanged.emit(path, OK, len(parsed.newicks), len(parsed.taxa), "")
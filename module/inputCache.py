@@ -0,0 +1,133 @@
+import os
+import threading
+
+import diskCache
+import taxaScanner
+import treeIO
+
+
+def fileKey(path, schema):
+    """
+    Identify the current content of an input file by its path, size and modification time.
+    """
+    stat = os.stat(path)
+    return (path, schema, stat.st_size, stat.st_mtime)
+
+
+def parseFile(args):
+    """
+    Read one gene tree file for a GeneTreeCache: from diskCache if it was parsed in an earlier session, otherwise
+    parse it and store it there. Runs in a worker process of the IngestWorker.
+    :param args: (path, schema)
+    :return: (ParsedTrees, None), or (None, error message) if the file cannot be read
+    """
+    path, schema = args
+    try:
+        diskKey = diskCache.makeKey("trees", path, schema)
+        stored = diskCache.load(diskKey)
+        if stored is not None:
+            return treeIO.ParsedTrees(*stored), None
+        parsed = treeIO.parseTreeFile(path, schema)
+        diskCache.store(diskKey, (parsed.taxa, parsed.newicks))
+        return parsed, None
+    except Exception as e:
+        # Errors of dendropy do not all survive pickling on their way back.
+        return None, str(e)
+
+
+class GeneTreeCache(object):
+    """
+    Parsed gene tree files of one page, keyed by file path, size and modification time.
+    getTaxamap() and generate() share it, so an unchanged file is parsed only once.
+    Taxon labels are taken from the parsed trees when available, otherwise the file is only scanned
+    with taxaScanner and no tree is built.
+    Parsed files are also kept in diskCache, so a file parsed in an earlier session is not parsed again.
+    The IngestWorker of the page adds files with put() as they are parsed, while the page reads the cache.
+    """
+    def __init__(self):
+        # path -> (fileKey, ParsedTrees)
+        self.entries = {}
+        # path -> (fileKey, (taxon labels, number of trees))
+        self.summaries = {}
+        # Guards entries and summaries, which the IngestWorker and the page update from their own threads.
+        self.lock = threading.Lock()
+
+    def lookup(self, path, schema):
+        """
+        Return the cached ParsedTrees of a file, or None if the file is not cached or has changed on disk.
+        """
+        key = fileKey(path, schema)
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        return None
+
+    def put(self, path, key, parsed):
+        """
+        Keep the ParsedTrees of a file, parsed when its fileKey was key.
+        generate() then finds the file with lookup() unless it has changed since.
+        """
+        with self.lock:
+            self.entries[path] = (key, parsed)
+
+    def summary(self, path, schema):
+        """
+        Return (taxon labels, number of trees) of a file, scanning it only if it is not cached
+        or has changed on disk.
+        """
+        parsed = self.lookup(path, schema)
+        if parsed is not None:
+            return parsed.taxa, len(parsed.newicks)
+        key = fileKey(path, schema)
+        with self.lock:
+            entry = self.summaries.get(path)
+        if entry is None or entry[0] != key:
+            # A file parsed in an earlier session is read back from disk instead of being scanned.
+            stored = diskCache.load(diskCache.makeKey("trees", path, schema))
+            if stored is not None:
+                parsed = treeIO.ParsedTrees(*stored)
+                self.put(path, key, parsed)
+                return parsed.taxa, len(parsed.newicks)
+            entry = (key, taxaScanner.scanFile(path, schema))
+            with self.lock:
+                self.summaries[path] = entry
+        return entry[1]
+
+    def prune(self, inputFiles):
+        """
+        Drop files that are no longer uploaded.
+        """
+        inputFiles = set(inputFiles)
+        with self.lock:
+            for cached in (self.entries, self.summaries):
+                for path in list(cached):
+                    if path not in inputFiles:
+                        del cached[path]
+
+    def taxonLabels(self, inputFiles, schema):
+        """
+        Return all taxon labels of the uploaded files, in the order they are first seen.
+        Labels are compared case-insensitively, as dendropy does, and the first spelling is kept.
+        """
+        self.prune(inputFiles)
+        labels = []
+        seen = set([])
+        for path in inputFiles:
+            for label in self.summary(path, schema)[0]:
+                if label.lower() not in seen:
+                    seen.add(label.lower())
+                    labels.append(label)
+        return labels
+
+    def numTrees(self, inputFiles, schema):
+        """
+        Return the total number of trees in the uploaded files.
+        """
+        self.prune(inputFiles)
+        return sum(self.summary(path, schema)[1] for path in inputFiles)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.summaries = {}
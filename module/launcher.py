@@ -1,10 +1,12 @@
 import os
 import sys
+import multiprocessing
 from PyQt4 import QtGui
 from PyQt4 import QtCore
 
 import SecondPage
 import BiAllelicMethodsPage
+import workerPool
 
 
 def resource_path(relative_path):
@@ -168,6 +170,10 @@ class Launcher(QtGui.QMainWindow):
 
 
 if __name__ == '__main__':
+    # Gene tree files are parsed in worker processes, which must not start the GUI again in a frozen app.
+    multiprocessing.freeze_support()
+    # Start the worker processes before any Qt object or thread exists.
+    workerPool.start()
     app = QtGui.QApplication(sys.argv)
     ex = Launcher()
     ex.show()
@@ -0,0 +1,402 @@
+import os
+import re
+import copy
+import numpy
+import dendropy
+
+import compression
+import diskCache
+import nexusWriter
+import workerPool
+
+# Symbols DnaCharacterMatrix accepts, in either case. A file with any other symbol is left to dendropy.
+_INVALID_SYMBOL = re.compile(br"[^ACGTNMRWSYKVHDBacgtnmrwsykvhdb?\-\s]")
+_SPACE = re.compile(br"\s+")
+_FASTA_HEADER = re.compile(br"^[ \t]*>(.*)$", re.M)
+_NONSPACE = re.compile(br"\S+")
+_LABEL = re.compile(br"'(?:[^']|'')*'|\S+")
+_CHARACTERS_BLOCK = re.compile(br"\bbegin\s+(?:data|characters)\s*;", re.I)
+_NCHAR = re.compile(br"\bnchar\s*=\s*(\d+)", re.I)
+_FORMAT = re.compile(br"\bformat\b([^;]*);", re.I)
+_MATRIX = re.compile(br"\bmatrix\b", re.I)
+# FORMAT subcommands that change how rows are laid out; such files are read by dendropy instead.
+_UNSUPPORTED_FORMAT = re.compile(br"\b(?:interleave|matchchar|transpose|respectcase|equate|nolabels|tokens|items|"
+                                 br"statesformat)\b", re.I)
+_FORMAT_VALUE = re.compile(br"\b(datatype|missing|gap)\s*=\s*(\S+)", re.I)
+_PUNCTUATION = re.compile(br"[()\[\]{}/\\,;:=*\"`<>]")
+# Statements giving the taxa an order of their own, which dendropy follows for the rows instead of the matrix order.
+_TAXON_ORDER = re.compile(br"\bbegin\s+taxa\s*;|\b(?:taxlabels|newtaxa|link)\b", re.I)
+
+# Loci with fewer symbols than this in total are formatted in the calling process, as starting a pool costs more.
+PARALLEL_MIN_SIZE = 1 << 22
+
+
+def encode(sequence):
+    """
+    Encode a sequence string as a uint8 array, one byte per character.
+    """
+    if not isinstance(sequence, bytes):
+        sequence = sequence.encode("ascii")
+    return numpy.frombuffer(sequence, dtype=numpy.uint8)
+
+
+def decode(codes):
+    """
+    Decode a uint8 array back into a sequence string.
+    """
+    return str(codes.tobytes().decode("ascii"))
+
+
+def _text(label):
+    if isinstance(label, str):
+        return label
+    return label.decode("utf-8")
+
+
+def _normalize(raw):
+    """
+    Turn the raw bytes of a sequence into what DnaCharacterMatrix.symbols_as_string() returns for it.
+    """
+    return str(_SPACE.sub(b"", raw).upper().decode("ascii"))
+
+
+class UnsupportedLayout(Exception):
+    """
+    Raised when a file cannot be indexed without parsing it, e.g. an interleaved NEXUS matrix.
+    """
+    pass
+
+
+def _indexFasta(data):
+    """
+    :return: list of (taxon label, start, end, length), where data[start:end] holds the sequence of the taxon
+    """
+    rows = []
+    headers = list(_FASTA_HEADER.finditer(data))
+    if not headers or data[:headers[0].start()].strip():
+        raise UnsupportedLayout()
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(data)
+        tokens = list(_NONSPACE.finditer(data, header.end(), end))
+        if not tokens:
+            raise UnsupportedLayout()
+        start, end = tokens[0].start(), tokens[-1].end()
+        rows.append((_text(header.group(1).strip()), start, end, sum(len(token.group()) for token in tokens)))
+    return rows
+
+
+def matrixStart(data):
+    """
+    Check the beginning of a NEXUS file up to its MATRIX command. Only a single non-interleaved DNA matrix is
+    supported, in a file that does not order its taxa otherwise, e.g. with a TAXA block.
+    :param data: the beginning of the file, or all of it
+    :return: (offset just after MATRIX, nchar), or None if data does not reach the MATRIX command
+    :raise UnsupportedLayout: if the file has to be parsed by dendropy
+    """
+    block = _CHARACTERS_BLOCK.search(data)
+    matrix = _MATRIX.search(data, block.end()) if block is not None else None
+    if matrix is None:
+        return None
+    if _CHARACTERS_BLOCK.search(data, block.end(), matrix.start()) or _TAXON_ORDER.search(data, 0, matrix.start()):
+        raise UnsupportedLayout()
+    header = data[block.end():matrix.start()]
+    nchar = _NCHAR.search(header)
+    format = _FORMAT.search(header)
+    if nchar is None or format is None or _UNSUPPORTED_FORMAT.search(format.group(1)):
+        raise UnsupportedLayout()
+    for key, value in _FORMAT_VALUE.findall(format.group(1)):
+        if (key.lower(), value.lower()) not in ((b"datatype", b"dna"), (b"missing", b"?"), (b"gap", b"-")):
+            raise UnsupportedLayout()
+    nchar = int(nchar.group(1))
+    if nchar == 0:
+        raise UnsupportedLayout()
+    return matrix.end(), nchar
+
+
+def checkTrailer(data, start=0):
+    """
+    Check the part of a NEXUS file after its matrix: another matrix or a TAXA block is left to dendropy.
+    :raise UnsupportedLayout: if the file has to be parsed by dendropy
+    """
+    if _CHARACTERS_BLOCK.search(data, start) or _TAXON_ORDER.search(data, start):
+        raise UnsupportedLayout()
+
+
+def nexusLabel(token):
+    """
+    The taxon label of a row of a NEXUS matrix, read with preserve_underscores=True.
+    :raise UnsupportedLayout: if the label has to be parsed by dendropy
+    """
+    if token.startswith(b"'"):
+        # Quoted labels may contain blanks and punctuation; '' stands for a quote.
+        return _text(token[1:-1].replace(b"''", b"'"))
+    if _PUNCTUATION.search(token):
+        raise UnsupportedLayout()
+    return _text(token)
+
+
+def _indexNexus(data):
+    """
+    :return: list of (taxon label, start, end, length), where data[start:end] holds the sequence of the taxon
+    Only a matrix accepted by matrixStart() and without comments is indexed.
+    """
+    start = matrixStart(data)
+    if start is None:
+        raise UnsupportedLayout()
+    position, nchar = start
+    end = data.find(b";", position)
+    if end < 0 or b"[" in data[position:end]:
+        raise UnsupportedLayout()
+    checkTrailer(data, end)
+
+    rows = []
+    while True:
+        label = _LABEL.search(data, position, end)
+        if label is None:
+            break
+        text = nexusLabel(label.group())
+        # A sequence may be wrapped over several lines, so read tokens until nchar symbols have been seen.
+        position = label.end()
+        start = None
+        length = 0
+        while length < nchar:
+            sequence = _NONSPACE.search(data, position, end)
+            if sequence is None:
+                raise UnsupportedLayout()
+            if start is None:
+                start = sequence.start()
+            length += len(sequence.group())
+            position = sequence.end()
+        if length != nchar:
+            raise UnsupportedLayout()
+        rows.append((text, start, position, length))
+    return rows
+
+
+def indexFile(path, schema):
+    """
+    Find where the sequence of each taxon lies in a NEXUS or FASTA file, without building any dendropy object.
+    The file is read once; only labels, byte offsets and lengths are kept.
+    :return: list of (taxon label, start, end, length), offsets into the decompressed content
+    :raise UnsupportedLayout: if the file has to be parsed by dendropy
+    """
+    with compression.openBinary(path) as inputFile:
+        data = inputFile.read()
+    if schema == "nexus":
+        rows = _indexNexus(data)
+    else:
+        rows = _indexFasta(data)
+    labels = set([])
+    for label, start, end, length in rows:
+        # Leave repeated labels and unknown symbols to dendropy, which reports them properly.
+        if label in labels or _INVALID_SYMBOL.search(data, start, end):
+            raise UnsupportedLayout()
+        labels.add(label)
+    return rows
+
+
+class IndexedLocus(object):
+    """
+    A locus whose sequences stay in its file until they are written out.
+    Row i is the taxon taxa[taxonIndices[i]], with its sequence at bytes starts[i]:ends[i] of the decompressed file.
+    """
+    __slots__ = ("path", "fileKey", "taxa", "taxonIndices", "starts", "ends", "length")
+
+    def __init__(self, path, taxa, taxonIndices, starts, ends, length):
+        self.path = path
+        stat = os.stat(path)
+        self.fileKey = (stat.st_size, stat.st_mtime)
+        self.taxa = taxa
+        self.taxonIndices = taxonIndices
+        self.starts = starts
+        self.ends = ends
+        self.length = length
+
+    def __len__(self):
+        """
+        Length of the sequences of this locus, taken from its first sequence.
+        """
+        return self.length
+
+    def labels(self):
+        """
+        Taxon labels of this locus, in the order they appear in the file.
+        """
+        return [self.taxa[index] for index in self.taxonIndices]
+
+    def detached(self):
+        """
+        A copy holding only the taxon labels of this locus instead of those of the whole store, e.g. to send the
+        locus to a worker process.
+        """
+        locus = copy.copy(self)
+        locus.taxa = self.labels()
+        locus.taxonIndices = numpy.arange(len(self.taxonIndices), dtype=numpy.int32)
+        return locus
+
+    def items(self):
+        """
+        Yield (taxon label, sequence string) pairs in file order, reading each sequence from disk as it is needed.
+        The sequence string is what DnaCharacterMatrix.symbols_as_string() returns for it.
+        """
+        stat = os.stat(self.path)
+        if (stat.st_size, stat.st_mtime) != self.fileKey:
+            raise Exception(self.path + " has changed since it was uploaded. Please upload it again.")
+        with compression.openBinary(self.path) as inputFile:
+            for row in range(len(self.taxonIndices)):
+                inputFile.seek(int(self.starts[row]))
+                raw = inputFile.read(int(self.ends[row] - self.starts[row]))
+                yield self.taxa[self.taxonIndices[row]], _normalize(raw)
+
+
+class Locus(object):
+    """
+    Sequences of one locus stored in a single contiguous uint8 buffer.
+    Row i holds buffer[offsets[i]:offsets[i + 1]] for the taxon taxa[taxonIndices[i]], where taxa is the
+    list of taxon labels shared by all loci of a LocusStore.
+    """
+    __slots__ = ("taxa", "taxonIndices", "offsets", "buffer")
+
+    def __init__(self, taxa, taxonIndices, offsets, buffer):
+        self.taxa = taxa
+        self.taxonIndices = taxonIndices
+        self.offsets = offsets
+        self.buffer = buffer
+
+    def __len__(self):
+        """
+        Length of the sequences of this locus, taken from its first sequence.
+        """
+        if len(self.taxonIndices) == 0:
+            return 0
+        return int(self.offsets[1] - self.offsets[0])
+
+    def labels(self):
+        """
+        Taxon labels of this locus, in the order they were read.
+        """
+        return [self.taxa[index] for index in self.taxonIndices]
+
+    def detached(self):
+        """
+        A copy holding only the taxon labels of this locus instead of those of the whole store, e.g. to send the
+        locus to a worker process.
+        """
+        locus = copy.copy(self)
+        locus.taxa = self.labels()
+        locus.taxonIndices = numpy.arange(len(self.taxonIndices), dtype=numpy.int32)
+        return locus
+
+    def items(self):
+        """
+        Yield (taxon label, sequence string) pairs in the order they were read.
+        The sequence string is what DnaCharacterMatrix.symbols_as_string() returned for the original data.
+        """
+        for row in range(len(self.taxonIndices)):
+            yield self.taxa[self.taxonIndices[row]], decode(self.buffer[self.offsets[row]:self.offsets[row + 1]])
+
+
+class LocusStore(object):
+    """
+    All loci of an MCMC_SEQ page, keyed by locus name, either indexed in their files or held in memory.
+    Taxon labels are kept once in a list shared by every locus, so a locus only costs its sequence bytes
+    and one index per taxon instead of a dendropy object for every character.
+    """
+    def __init__(self):
+        self.taxa = []
+        self.taxonIndex = {}
+        self.loci = {}
+
+    def _taxonIndex(self, label):
+        if label not in self.taxonIndex:
+            self.taxonIndex[label] = len(self.taxa)
+            self.taxa.append(label)
+        return self.taxonIndex[label]
+
+    def add(self, name, sequences):
+        """
+        Store a locus.
+        :param name: locus name
+        :param sequences: list of (taxon label, sequence string) pairs
+        :return: the new Locus
+        """
+        taxonIndices = numpy.empty(len(sequences), dtype=numpy.int32)
+        offsets = numpy.zeros(len(sequences) + 1, dtype=numpy.int64)
+        for row, (label, sequence) in enumerate(sequences):
+            taxonIndices[row] = self._taxonIndex(label)
+            offsets[row + 1] = offsets[row] + len(sequence)
+        buffer = encode("".join(sequence for label, sequence in sequences))
+
+        locus = Locus(self.taxa, taxonIndices, offsets, buffer)
+        self.loci[name] = locus
+        return locus
+
+    def addFile(self, name, path, schema, **kwargs):
+        """
+        Store a locus from a sequence file. Only the taxon labels and the position of each sequence in the file
+        are kept; sequences are read again when the locus is written out.
+        Files that cannot be indexed this way are read with dendropy and kept in memory instead.
+        :param kwargs: passed to dendropy when the file has to be parsed
+        :return: the new IndexedLocus or Locus
+        """
+        try:
+            rows = indexFile(path, schema)
+        except UnsupportedLayout:
+            return self.add(name, diskCache.readSequences(dendropy.DnaCharacterMatrix, path, schema, **kwargs))
+
+        taxonIndices = numpy.empty(len(rows), dtype=numpy.int32)
+        starts = numpy.empty(len(rows), dtype=numpy.int64)
+        ends = numpy.empty(len(rows), dtype=numpy.int64)
+        for row, (label, start, end, length) in enumerate(rows):
+            taxonIndices[row] = self._taxonIndex(label)
+            starts[row] = start
+            ends[row] = end
+
+        locus = IndexedLocus(path, self.taxa, taxonIndices, starts, ends, rows[0][3])
+        self.loci[name] = locus
+        return locus
+
+    def __iter__(self):
+        return iter(self.loci)
+
+    def __getitem__(self, name):
+        return self.loci[name]
+
+    def __len__(self):
+        return len(self.loci)
+
+    def size(self):
+        """
+        Number of symbols of all loci, i.e. what formatLoci() has to write out.
+        """
+        return sum(len(locus) * len(locus.taxonIndices) for locus in self.loci.values())
+
+    def formatLoci(self, processes=None):
+        """
+        Format the loci of a DATA block, in the order the store iterates over them.
+        Each locus is formatted as one chunk of text: a "[name, length]" comment followed by its rows. Large
+        stores are formatted in the shared workerPool, whose workers read indexed loci from their files themselves,
+        and the chunks are returned in order.
+        :param processes: 1 to format in the calling process, otherwise large stores are formatted in workerPool
+        :return: iterator of text chunks, one per locus
+        """
+        names = list(self.loci)
+        if processes == 1 or len(names) <= 1 or self.size() < PARALLEL_MIN_SIZE:
+            return (formatLocus(name, self.loci[name]) for name in names)
+        # Each task carries its own locus, so that workers need nothing else from the store.
+        return workerPool.imap(_formatLocus, ((name, self.loci[name].detached()) for name in names))
+
+
+def formatLocus(name, locus):
+    """
+    A locus as written in a DATA block: a "[name, length]" comment followed by one row per taxon.
+    """
+    return nexusWriter.comment(name + ", " + str(len(locus))) + "".join(
+        nexusWriter.row(taxon, sequence) for taxon, sequence in locus.items())
+
+
+def _formatLocus(args):
+    """
+    Format one locus, args = (name, locus). Runs in a worker process of LocusStore.formatLoci.
+    """
+    return formatLocus(*args)
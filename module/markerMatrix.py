@@ -0,0 +1,186 @@
+import numpy
+import dendropy
+
+# Symbols of the 2-bit codes 0, 1 and 2. Code 3 stands for the missing symbol of the matrix.
+MARKERS = "012"
+
+
+def _unpackTable():
+    """
+    Lookup table from a packed byte to its four 2-bit codes, lowest bits first.
+    """
+    values = numpy.arange(256, dtype=numpy.uint8)
+    return numpy.stack([(values >> shift) & 3 for shift in (0, 2, 4, 6)], axis=1)
+
+
+_UNPACK = _unpackTable()
+
+
+def pack(codes):
+    """
+    Pack a 1D array of 2-bit codes, four per byte, lowest bits first. The last byte is padded with zeros.
+    """
+    padded = numpy.zeros(4 * ((len(codes) + 3) // 4), dtype=numpy.uint8)
+    padded[:len(codes)] = codes
+    padded = padded.reshape(-1, 4)
+    return padded[:, 0] | (padded[:, 1] << 2) | (padded[:, 2] << 4) | (padded[:, 3] << 6)
+
+
+class MarkerMatrix(object):
+    """
+    A bi-allelic marker matrix packed two bits per character, i.e. four characters per byte.
+    Characters 0, 1 and 2 are stored as themselves and every other symbol as code 3, written out as the missing
+    symbol of the matrix. Cells holding yet another symbol, e.g. "-" in a matrix that mostly uses "?", are kept
+    as exceptions so that rows are always written out exactly as they were read.
+    """
+    def __init__(self, labels, packed, lengths, missing="?", exceptions=None):
+        """
+        :param labels: taxon labels, one per row
+        :param packed: 2D uint8 array, one packed row per taxon
+        :param lengths: 1D array, number of characters of each row
+        :param missing: symbol written for code 3
+        :param exceptions: row -> (1D array of columns, symbols) of cells whose symbol is not missing
+        """
+        self.labels = labels
+        self.packed = packed
+        self.lengths = lengths
+        self.missing = missing
+        self.exceptions = exceptions if exceptions is not None else {}
+        self.rowIndex = dict((label, row) for row, label in enumerate(labels))
+        self.symbols = numpy.frombuffer((MARKERS + missing).encode("ascii"), dtype=numpy.uint8)
+
+    @classmethod
+    def fromRows(cls, rows, missing=None):
+        """
+        Pack a matrix.
+        :param rows: (taxon label, sequence string) pairs. A list, unless missing is given, in which case any
+                     iterable is read once.
+        :param missing: the missing symbol. If None, it is the most common symbol other than 0, 1 and 2.
+        :return: a MarkerMatrix
+        """
+        table = numpy.full(256, 3, dtype=numpy.uint8)
+        for code, symbol in enumerate(MARKERS):
+            table[ord(symbol)] = code
+        if missing is None:
+            counts = numpy.zeros(256, dtype=numpy.int64)
+            for label, sequence in rows:
+                counts += numpy.bincount(numpy.frombuffer(sequence.encode("ascii"), dtype=numpy.uint8),
+                                         minlength=256)
+            counts[[ord(symbol) for symbol in MARKERS]] = 0
+            missing = chr(int(counts.argmax())) if counts.any() else "?"
+
+        labels = []
+        lengths = []
+        packedRows = []
+        exceptions = {}
+        for row, (label, sequence) in enumerate(rows):
+            sequence = numpy.frombuffer(sequence.encode("ascii"), dtype=numpy.uint8)
+            codes = table[sequence]
+            labels.append(label)
+            lengths.append(len(codes))
+            packedRows.append(pack(codes))
+            other = numpy.flatnonzero((codes == 3) & (sequence != ord(missing)))
+            if len(other) > 0:
+                exceptions[row] = (other, sequence[other].tobytes())
+
+        packed = numpy.zeros((len(packedRows), max([0] + [len(row) for row in packedRows])), dtype=numpy.uint8)
+        for row, packedRow in enumerate(packedRows):
+            packed[row, :len(packedRow)] = packedRow
+        return cls(labels, packed, numpy.array(lengths, dtype=numpy.int64), missing, exceptions)
+
+    def __len__(self):
+        """
+        Number of taxa.
+        """
+        return len(self.labels)
+
+    @property
+    def nchar(self):
+        """
+        Number of characters, taken from the first row like len(matrix[0]) for a dendropy matrix.
+        """
+        return int(self.lengths[0]) if len(self.lengths) > 0 else 0
+
+    def taxonNamespace(self):
+        """
+        Taxa of the matrix as a dendropy TaxonNamespace, in row order, for the taxa list and taxa map dialogs.
+        """
+        return dendropy.TaxonNamespace(self.labels)
+
+    def codes(self, row):
+        """
+        2-bit codes of a row as a 1D uint8 array.
+        """
+        return _UNPACK[self.packed[row]].reshape(-1)[:self.lengths[row]]
+
+    def row(self, row):
+        """
+        A row as a string, exactly as it was read.
+        :param row: row index or taxon label
+        """
+        if isinstance(row, str):
+            row = self.rowIndex[row]
+        symbols = self.symbols[self.codes(row)]
+        if row in self.exceptions:
+            columns, other = self.exceptions[row]
+            symbols[columns] = numpy.frombuffer(other, dtype=numpy.uint8)
+        return str(symbols.tobytes().decode("ascii"))
+
+    def column(self, column):
+        """
+        2-bit codes of a column as a 1D uint8 array, one per taxon, read straight from the packed rows.
+        Rows shorter than the column are reported as missing.
+        """
+        codes = (self.packed[:, column // 4] >> (2 * (column % 4))) & 3
+        codes[self.lengths <= column] = 3
+        return codes
+
+    def columnCounts(self, blockSize=1 << 16):
+        """
+        Number of 0, 1, 2 and missing characters in each of the nchar columns, computed on blocks of blockSize
+        packed bytes, i.e. 4 * blockSize columns, so that the matrix is never unpacked as a whole. Characters
+        beyond the end of a shorter row are counted as missing, as column() reports them.
+        :return: 2D int array of shape (4, nchar)
+        """
+        nchar = self.nchar
+        counts = numpy.zeros((4, nchar), dtype=numpy.int64)
+        for start in range(0, (nchar + 3) // 4, blockSize):
+            first = 4 * start
+            codes = _UNPACK[self.packed[:, start:start + blockSize]].reshape(len(self), -1)[:, :nchar - first]
+            codes[numpy.arange(first, first + codes.shape[1]) >= self.lengths[:, None]] = 3
+            for code in range(4):
+                counts[code, first:first + codes.shape[1]] = (codes == code).sum(axis=0)
+        return counts
+
+    def subset(self, labels):
+        """
+        A new MarkerMatrix with only the rows of the given taxa, in the given order.
+        """
+        rows = [self.rowIndex[label] for label in labels]
+        exceptions = dict((i, self.exceptions[row]) for i, row in enumerate(rows) if row in self.exceptions)
+        return MarkerMatrix(list(labels), self.packed[rows], self.lengths[rows], self.missing, exceptions)
+
+    def selectColumns(self, columns):
+        """
+        A new MarkerMatrix made of the given columns, in the given order. A column may be taken more than once,
+        e.g. by a bootstrap replicate. Rows are expected to have nchar characters.
+        :param columns: 1D array of column indices
+        """
+        columns = numpy.asarray(columns, dtype=numpy.int64)
+
+        def rows():
+            for row, label in enumerate(self.labels):
+                symbols = numpy.frombuffer(self.row(row).encode("ascii"), dtype=numpy.uint8)
+                yield label, str(symbols[columns].tobytes().decode("ascii"))
+
+        return MarkerMatrix.fromRows(rows(), self.missing)
+
+    def writeMatrix(self, outputFile, progress=None):
+        """
+        Write the rows of a NEXUS Matrix section, "label sequence" on each line.
+        :param progress: if given, called as progress(rows written, number of rows) after each row
+        """
+        for row, label in enumerate(self.labels):
+            outputFile.write("".join([label, " ", self.row(row), "\n"]))
+            if progress is not None:
+                progress(row + 1, len(self.labels))
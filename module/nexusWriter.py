@@ -0,0 +1,304 @@
+import os
+import errno
+import datetime
+import itertools
+from dendropy.dataio import nexusprocessing
+
+# Output files are opened with a buffer of this size, so that even a command with 100k gene tree identifiers or a
+# long DATA block reaches the disk in a few large writes.
+BUFFER_SIZE = 1 << 20
+
+
+def openOutput(path, mode="w"):
+    """
+    Open an output NEXUS file with a large write buffer.
+    """
+    return open(path, mode, BUFFER_SIZE)
+
+
+def timeName():
+    """
+    Name of a file generated now, e.g. "14-03-59".
+    """
+    return datetime.datetime.now().strftime('%H-%M-%S')
+
+
+# Numbers the temporary files of this process.
+_tempCounter = itertools.count()
+
+
+def _createTemp(directory, name):
+    """
+    Create an empty, uniquely named hidden file next to where name will be published.
+    """
+    while True:
+        path = os.path.join(directory, ".%s.%d.%d.part" % (name, os.getpid(), next(_tempCounter)))
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            return path
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def _publishAs(tempPath, path):
+    """
+    Give tempPath the name path, unless a file already has that name.
+    :raise OSError: with errno EEXIST if path exists
+    """
+    if not hasattr(os, "link"):
+        # Windows: rename never replaces an existing file.
+        os.rename(tempPath, path)
+        return
+    try:
+        os.link(tempPath, path)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            raise
+        # The file system has no hard links, e.g. FAT. Renaming is still atomic, but only checked beforehand.
+        if os.path.exists(path):
+            raise OSError(errno.EEXIST, "File exists", path)
+        os.rename(tempPath, path)
+        return
+    os.remove(tempPath)
+
+
+class OutputFile(object):
+    """
+    A generated NEXUS file, written under a temporary name in its destination directory and published under its
+    final name only once it is complete. The final name is the time the file was started, e.g. "14-03-59.nexus",
+    followed by "-2", "-3", ... if that name is taken, so that concurrent generations into one directory never
+    write into the same file. If writing fails, the temporary file is removed and nothing is published.
+
+    with nexusWriter.OutputFile(directory) as output:
+        with nexusWriter.openOutput(output.tempPath) as outputFile:
+            ...
+    path = output.path
+    """
+    def __init__(self, directory, name=None, extension=".nexus"):
+        """
+        :param name: final name without extension, the current time by default
+        :param extension: extension of the final name, e.g. ".manifest" for the list of files of a sharded run
+        """
+        self.directory = directory
+        self.name = name if name is not None else timeName()
+        self.extension = extension
+        self.tempPath = _createTemp(directory, self.name)
+        # Final path, set by publish().
+        self.path = None
+
+    def publish(self):
+        """
+        Give the complete file its final name.
+        :return: the final path
+        """
+        root = os.path.join(self.directory, self.name)
+        for counter in itertools.count(1):
+            path = root + self.extension if counter == 1 else "%s-%d%s" % (root, counter, self.extension)
+            try:
+                _publishAs(self.tempPath, path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                continue
+            self.path = path
+            return path
+
+    def discard(self):
+        """
+        Remove the temporary file, if it is still there.
+        """
+        try:
+            os.remove(self.tempPath)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.publish()
+        else:
+            self.discard()
+        return False
+
+
+def inverseMapping(map):
+    """
+    Convert a mapping from taxon to species to a mapping from species to a list of taxon.
+    """
+    o = {}
+    for k, v in map.items():
+        if v in o:
+            o[v].append(k)
+        else:
+            o[v] = [k]
+    return o
+
+
+def nameList(names):
+    """
+    Comma delimited list of identifiers, e.g. gene tree names or taxa.
+    """
+    return ",".join(names)
+
+
+def locusList(geneTreeNames):
+    """
+    Comma delimited list of sets of gene tree identifiers, one set per locus, e.g. "{locus0},{locus10,locus11}".
+    :param geneTreeNames: a gene tree name for each single-tree locus and a list of names for each multi-tree locus
+    """
+    return ",".join("{" + (nameList(locus) if type(locus) is list else locus) + "}" for locus in geneTreeNames)
+
+
+def geneTreeList(geneTreeNames, multiTreesPerLocus):
+    """
+    Gene tree identifiers as written in the command of a page reading one locus per file.
+    """
+    if multiTreesPerLocus:
+        return locusList(geneTreeNames)
+    return nameList(geneTreeNames)
+
+
+def taxaMap(taxamap):
+    """
+    A taxa map as written after -a or -tm, e.g. "<A:a1,a2; B:b1>".
+    :param taxamap: taxon -> species
+    """
+    speciesToTaxonMap = inverseMapping(taxamap)
+    return "<" + "; ".join(species + ":" + nameList(speciesToTaxonMap[species])
+                           for species in speciesToTaxonMap) + ">"
+
+
+class Command(object):
+    """
+    A PHYLONET command assembled in memory and written out with a single write, however many tokens it has.
+    """
+    def __init__(self, text):
+        """
+        :param text: beginning of the command, e.g. the command name and its gene tree list
+        """
+        self.parts = [text]
+        # Flag -> index in parts of the option, so that set() can replace it.
+        self.options = {}
+        # Positional arguments written after all options.
+        self.arguments = []
+
+    def copy(self):
+        """
+        An independent copy, e.g. to give each shard of a run its own seed.
+        """
+        command = Command("")
+        command.parts = list(self.parts)
+        command.options = dict(self.options)
+        command.arguments = list(self.arguments)
+        return command
+
+    def append(self, text):
+        """
+        Append text as it is.
+        """
+        self.parts.append(text)
+
+    def option(self, flag, value=None):
+        """
+        Append " flag" or " flag value".
+        """
+        self.options[flag] = len(self.parts)
+        self.parts.append(" " + flag if value is None else " " + flag + " " + value)
+
+    def argument(self, text):
+        """
+        Append a positional argument, kept after every option even if options are set later, e.g. the result
+        output file of InferNetwork_MP.
+        """
+        self.arguments.append(text)
+
+    def set(self, flag, value=None):
+        """
+        Give an option a new value in place, or append it if the command does not have it yet.
+        """
+        if flag not in self.options:
+            self.option(flag, value)
+            return
+        self.parts[self.options[flag]] = " " + flag if value is None else " " + flag + " " + value
+
+    def taxaMap(self, flag, taxamap):
+        """
+        Append a taxa map option, e.g. " -a <A:a1,a2; B:b1>".
+        """
+        self.option(flag, taxaMap(taxamap))
+
+    def text(self):
+        return "".join(self.parts + self.arguments)
+
+
+def comment(text):
+    """
+    A comment line of a DATA block, e.g. "[locus0, 1000]".
+    """
+    return "[" + text + "]\n"
+
+
+def row(label, sequence):
+    """
+    A row of a DATA block, "label sequence".
+    """
+    return "".join([label, " ", sequence, "\n"])
+
+
+class DataBlockWriter(object):
+    """
+    Write a NEXUS DATA block: its header, then rows formatted with row() and comment(), then its end.
+    """
+    def __init__(self, outputFile, indent=""):
+        """
+        :param indent: written before the Dimensions, Format and Matrix lines
+        """
+        self.outputFile = outputFile
+        self.indent = indent
+
+    def begin(self, ntax, nchar, format):
+        """
+        Write the header of the block, up to the Matrix line.
+        :param format: the Format line, e.g. 'Format datatype=dna symbols="012" missing=? gap=-;'
+        """
+        self.outputFile.write("".join(["Begin data;\n",
+                                       self.indent, "Dimensions ntax=", str(ntax), " nchar=", str(nchar), ";\n",
+                                       self.indent, format, "\n",
+                                       self.indent, "Matrix\n"]))
+
+    def writeText(self, text):
+        """
+        Write comment lines and rows already formatted with comment() and row(), e.g. a whole locus.
+        """
+        self.outputFile.write(text)
+
+    def end(self, text=";END;\n"):
+        self.outputFile.write(text)
+
+
+class TreesBlockWriter(object):
+    """
+    Write a NEXUS TREES block one tree at a time, with a single write for each tree.
+    The output is the same as TreeList.write(schema="nexus", suppress_taxa_blocks=True, unquoted_underscores=True),
+    but no tree has to be kept in memory after it has been written.
+    """
+    def __init__(self, outputFile):
+        self.outputFile = outputFile
+        self.numTrees = 0
+
+    def begin(self):
+        self.outputFile.write("#NEXUS\n\nBEGIN TREES;\n")
+
+    def writeNewick(self, label, newick):
+        """
+        Write one tree, given as a Newick string, under the given label.
+        """
+        label = nexusprocessing.escape_nexus_token(label, preserve_spaces=False, quote_underscores=False)
+        self.outputFile.write("".join(["    TREE ", label, " = ", newick, "\n"]))
+        self.numTrees += 1
+
+    def end(self):
+        self.outputFile.write("END;\n\n")
@@ -0,0 +1,291 @@
+import os
+import re
+import random
+import shutil
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import nexusWriter
+
+# Ways of splitting one loaded dataset into independent PhyloNet runs.
+BOOTSTRAP = "Bootstrap replicates"
+SUBSETS = "Locus subsets"
+SEEDS = "Seed list"
+GRID = "Option grid"
+
+# What to enter for each strategy, shown as placeholder text.
+HINTS = {
+    BOOTSTRAP: "10",
+    SUBSETS: "10",
+    SEEDS: "1, 2, 3",
+    GRID: "-mr 1, 2; -sd 1, 2",
+}
+
+_SEED = re.compile(r"-?\d+$")
+_GRID_OPTION = re.compile(r"\s*(-\w+)\s+(\S.*?)\s*$", re.S)
+# Commas inside parentheses, brackets or braces do not separate values, e.g. in "-tp (1.0, 2.0), (1.0)".
+_OPENING = "([{<"
+_CLOSING = ")]}>"
+
+
+class PlanError(Exception):
+    """
+    Raised when the shards entered on a page do not fit the strategy or the data. The message is shown to the user.
+    """
+    pass
+
+
+class Shard(object):
+    """
+    One self-contained run of a sharded generation: the part of the dataset it reads and the options it sets.
+    """
+    def __init__(self, description, indices=None, options=()):
+        """
+        :param description: what the shard holds, written in the manifest, e.g. "replicate 3"
+        :param indices: indices of the loci or sites of the dataset to write, all of them in order if None
+        :param options: (flag, value) pairs replacing the options of the command, e.g. [("-sd", "12")]
+        """
+        self.description = description
+        self.indices = indices
+        self.options = list(options)
+
+    def command(self, command):
+        """
+        The command of this shard, built from the command of the page.
+        :param command: a nexusWriter.Command, left unchanged
+        """
+        command = command.copy()
+        for flag, value in self.options:
+            command.set(flag, value)
+        return command
+
+
+class Plan(object):
+    """
+    How to split a dataset into shards, as entered on a generator page.
+    """
+    def __init__(self, strategy, text, seed=None):
+        """
+        :param strategy: BOOTSTRAP, SUBSETS, SEEDS or GRID
+        :param text: the number of shards, the comma delimited seeds for SEEDS, or the values of each option for
+                     GRID, e.g. "-mr 1, 2; -sd 1, 2" for four shards
+        :param seed: seed of the bootstrap resampling, drawn at random by default and written in the manifest
+        :raise PlanError: if text does not fit the strategy
+        """
+        self.strategy = strategy
+        # Seeds and grids only change the command, so every shard holds the whole dataset.
+        self.sharesData = strategy in (SEEDS, GRID)
+        if strategy == SEEDS:
+            self.seeds = [seed.strip() for seed in text.split(",") if seed.strip()]
+            if not self.seeds or not all(_SEED.match(seed) for seed in self.seeds):
+                raise PlanError("Please enter the seeds of the shards, e.g. 1, 2, 3.")
+            self.count = len(self.seeds)
+        elif strategy == GRID:
+            self.grid = parseGrid(text)
+            self.count = 1
+            for flag, values in self.grid:
+                self.count *= len(values)
+        else:
+            if not text.strip().isdigit() or int(text) < 1:
+                raise PlanError("Please enter the number of shards.")
+            self.count = int(text)
+        if seed is None:
+            seed = random.SystemRandom().randint(1, 2 ** 31 - 1)
+        self.seed = seed
+
+    def shards(self, numItems=None):
+        """
+        The shards of a dataset.
+        :param numItems: number of loci, or of sites for bi-allelic markers. Not needed if sharesData.
+        :return: list of Shard
+        :raise PlanError: if there are fewer loci than subsets
+        """
+        if self.strategy == SEEDS:
+            return [Shard("seed " + seed, options=[("-sd", seed)]) for seed in self.seeds]
+        if self.strategy == GRID:
+            # One shard per combination, the last option varying fastest.
+            flags = [flag for flag, values in self.grid]
+            return [Shard(" ".join(flag + " " + value for flag, value in zip(flags, point)), options=zip(flags, point))
+                    for point in itertools.product(*[values for flag, values in self.grid])]
+        if self.strategy == BOOTSTRAP:
+            # Each replicate draws as many items as the dataset has, with replacement.
+            generator = random.Random(self.seed)
+            return [Shard("replicate %d" % (number + 1), [generator.randrange(numItems) for i in range(numItems)])
+                    for number in range(self.count)]
+        if self.count > numItems:
+            raise PlanError("Cannot split %d loci into %d subsets." % (numItems, self.count))
+        bounds = [numItems * number // self.count for number in range(self.count + 1)]
+        return [Shard("loci %d-%d" % (bounds[number] + 1, bounds[number + 1]),
+                      list(range(bounds[number], bounds[number + 1]))) for number in range(self.count)]
+
+    def header(self):
+        """
+        First line of the manifest, e.g. "# Bootstrap replicates: 100 shards, resampling seed 1234".
+        """
+        text = "# %s: %d shards" % (self.strategy, self.count)
+        if self.strategy == BOOTSTRAP:
+            text += ", resampling seed %d" % self.seed
+        return text + "\n"
+
+
+def parseGrid(text):
+    """
+    Parse the options of a grid, e.g. "-mr 1, 2; -tp (1.0), (1.0, 2.0)".
+    :return: list of (flag, list of values)
+    :raise PlanError: if an option has no value or is given twice
+    """
+    grid = []
+    for option in text.split(";"):
+        if not option.strip():
+            continue
+        match = _GRID_OPTION.match(option)
+        if match is None:
+            raise PlanError("Please enter the values of each option of the grid, e.g. -mr 1, 2; -sd 1, 2.")
+        flag, values = match.group(1), _splitValues(match.group(2))
+        if not all(values) or flag in [other for other, otherValues in grid]:
+            raise PlanError("Please enter the values of each option of the grid, e.g. -mr 1, 2; -sd 1, 2.")
+        grid.append((flag, values))
+    if not grid:
+        raise PlanError("Please enter the values of each option of the grid, e.g. -mr 1, 2; -sd 1, 2.")
+    return grid
+
+
+def _splitValues(text):
+    """
+    Split comma delimited values, leaving commas inside parentheses, brackets and braces alone.
+    """
+    values = []
+    depth = 0
+    start = 0
+    for position, character in enumerate(text):
+        if character in _OPENING:
+            depth += 1
+        elif character in _CLOSING:
+            depth -= 1
+        elif character == "," and depth == 0:
+            values.append(text[start:position].strip())
+            start = position + 1
+    values.append(text[start:].strip())
+    return values
+
+
+def writeShards(directory, plan, shards, writeShard, name=None, threads=1):
+    """
+    Write one NEXUS file per shard, then a manifest listing them, one "file<TAB>description" line per shard.
+    Shard files are named after the manifest, e.g. "14-03-59_01.nexus" for "14-03-59.manifest", and each is
+    published once complete. If any of them fails, the shards already published are removed.
+    :param shards: list of Shard
+    :param writeShard: function writing a shard into the NEXUS file at the given path, called as
+                       writeShard(shard, path)
+    :param name: name of the manifest without extension, the current time by default
+    :param threads: number of shards written at the same time
+    :return: (path of the manifest, list of paths of the shards)
+    """
+    if name is None:
+        name = nexusWriter.timeName()
+    width = len(str(len(shards)))
+
+    def publish(number):
+        with nexusWriter.OutputFile(directory, "%s_%0*d" % (name, width, number + 1)) as output:
+            writeShard(shards[number], output.tempPath)
+        return output.path
+
+    paths = []
+    try:
+        if threads > 1 and len(shards) > 1:
+            pool = ThreadPool(min(threads, len(shards)))
+            results = [pool.apply_async(publish, (number,)) for number in range(len(shards))]
+            pool.close()
+            # Wait for every shard, so that all of the published ones are known if any of them fails.
+            pool.join()
+            for result in results:
+                if result.successful():
+                    paths.append(result.get())
+            for result in results:
+                result.get()
+        else:
+            for number in range(len(shards)):
+                paths.append(publish(number))
+        with nexusWriter.OutputFile(directory, name, ".manifest") as output:
+            with nexusWriter.openOutput(output.tempPath) as outputFile:
+                outputFile.write(plan.header())
+                for path, shard in zip(paths, shards):
+                    outputFile.write(os.path.basename(path) + "\t" + shard.description + "\n")
+    except Exception:
+        remove(paths)
+        raise
+    return output.path, paths
+
+
+def remove(paths):
+    """
+    Remove the files of a sharded run, e.g. when one of its shards fails validation.
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def validate(paths, manifest, checkFile, progress=None):
+    """
+    Validate every file of a run, in order. Validation stops at the first file that fails, and the whole run is
+    then removed, so that a manifest never lists a missing or invalid shard. It is also removed if progress raises
+    an exception, e.g. when validation is cancelled.
+    :param paths: list of paths of the shards, or of the single file of a run without a plan
+    :param manifest: path of the manifest, None for a run without a plan
+    :param checkFile: function checking the file at the given path, called as checkFile(path) and returning the
+                      error message of a file that fails, None otherwise
+    :param progress: if given, called as progress(files validated, number of files) before each file and at the end
+    :return: the error message of the file that failed, or None if every file passed
+    """
+    run = paths + ([] if manifest is None else [manifest])
+
+    def report(done):
+        if progress is not None:
+            try:
+                progress(done, len(paths))
+            except Exception:
+                remove(run)
+                raise
+
+    for i, path in enumerate(paths):
+        report(i)
+        message = checkFile(path)
+        if message is not None:
+            remove(run)
+            return message
+    report(len(paths))
+    return None
+
+
+def writeSweep(directory, plan, writeData, writeCommand, name=None, threads=None):
+    """
+    Write the shards of a plan that only changes the command, e.g. a grid of options, from data written once.
+    The data is written into a temporary file, which is then copied into the file of every shard followed by the
+    command of the shard. Shards are written by several threads at the same time.
+    :param writeData: function writing the data into the NEXUS file at the given path and returning the
+                      nexusWriter.Command of the page for that data, called as writeData(path)
+    :param writeCommand: function appending the PHYLONET block of a command to a file, called as
+                         writeCommand(path, command)
+    :param threads: number of shards written at the same time, the number of CPUs by default
+    :return: (path of the manifest, list of paths of the shards)
+    """
+    if name is None:
+        name = nexusWriter.timeName()
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+    # Only the temporary file is used; it is never published.
+    data = nexusWriter.OutputFile(directory, name)
+    try:
+        command = writeData(data.tempPath)
+
+        def writeShard(shard, path):
+            shutil.copyfile(data.tempPath, path)
+            writeCommand(path, shard.command(command))
+
+        return writeShards(directory, plan, plan.shards(), writeShard, name, threads)
+    finally:
+        data.discard()
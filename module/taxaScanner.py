@@ -0,0 +1,117 @@
+import re
+
+import compression
+
+# NEXUS comments, including hot comments such as [&R].
+_COMMENT = re.compile(r"\[[^\]]*\]")
+# A leaf label is a label that directly follows "(" or ",", or ";" for a single-leaf tree such as "A;".
+# Labels following ")" are internal node labels and are skipped, and branch lengths are never matched because they
+# follow ":".
+_LEAF = re.compile(r"[(,;]\s*([^\s(),:;\[\]']+)")
+_QUOTED_LEAF = re.compile(r"[(,;]\s*('(?:[^']|'')*'|[^\s(),:;\[\]']+)")
+_BLOCK = re.compile(r"\bbegin\s+(trees|taxa)\s*;(.*?)\bend(?:block)?\s*;", re.I | re.S)
+_TAXLABELS = re.compile(r"\btaxlabels\b(.*?);", re.I | re.S)
+_TRANSLATE = re.compile(r"\btranslate\b(.*?);", re.I | re.S)
+_TREE = re.compile(r"\bu?tree\s+(?:\*\s*)?(?:'(?:[^']|'')*'|[^\s=;]+)\s*=\s*([^;]*);", re.I)
+_TOKEN = re.compile(r"'(?:[^']|'')*'|[^\s,;']+")
+
+
+def _unquote(token):
+    """
+    Remove NEXUS / Newick quotes from a label. Underscores are preserved, as with preserve_underscores=True.
+    """
+    if len(token) > 1 and token[0] == "'" and token[-1] == "'":
+        return token[1:-1].replace("''", "'")
+    return token
+
+
+def _orderedUnique(tokens, labelsSoFar, translate=None):
+    """
+    Append the labels of tokens not yet in labelsSoFar, keeping the order they are first seen.
+    Labels are compared case-insensitively, as dendropy does, and the first spelling is kept.
+    Tokens are deduplicated before they are unquoted or translated, and the walk stops as soon as every
+    distinct token has been found, which is usually within the first tree.
+    """
+    seen = set(label.lower() for label in labelsSoFar)
+    remaining = set(tokens)
+    for token in tokens:
+        if not remaining:
+            break
+        if token in remaining:
+            remaining.discard(token)
+            label = _unquote(token)
+            if translate is not None:
+                label = translate.get(label, label)
+            if label.lower() not in seen:
+                seen.add(label.lower())
+                labelsSoFar.append(label)
+
+
+def _leaves(text):
+    """
+    Return the raw leaf label tokens of a string of Newick trees separated by ";".
+    """
+    # The first tree follows the ";" of an empty tree.
+    text = ";" + text
+    if "'" in text:
+        return _QUOTED_LEAF.findall(text)
+    return _LEAF.findall(text)
+
+
+def scanNewick(text):
+    """
+    Find the leaf labels of all trees in a Newick string without building any tree.
+    The cost is one regular expression match per leaf of every tree, about 1.3 s for 100k trees of 20 leaves
+    (50 MB); scanning cannot get below the time to read the text, so a file of that size is never scanned in
+    milliseconds and callers scan in the background.
+    :return: (labels, numTrees), where labels are the distinct leaf labels in the order they are first seen
+    """
+    text = _COMMENT.sub("", text)
+    labels = []
+    _orderedUnique(_leaves(text), labels)
+    return labels, text.count(";")
+
+
+def scanNexus(text):
+    """
+    Find the taxon labels of the TAXA and TREES blocks of a NEXUS string without building any tree.
+    Numbers in tree descriptions are resolved through the TRANSLATE table of their block.
+    :return: (labels, numTrees), where labels are the distinct taxon labels in the order they are first seen
+    """
+    text = _COMMENT.sub("", text)
+    labels = []
+    numTrees = 0
+    for match in _BLOCK.finditer(text):
+        blockType = match.group(1).lower()
+        content = match.group(2)
+        if blockType == "taxa":
+            for statement in _TAXLABELS.findall(content):
+                _orderedUnique(_TOKEN.findall(statement), labels)
+            continue
+
+        # TRANSLATE table of this TREES block.
+        translate = {}
+        for statement in _TRANSLATE.findall(content):
+            tokens = _TOKEN.findall(statement)
+            for key, label in zip(tokens[0::2], tokens[1::2]):
+                translate[_unquote(key)] = _unquote(label)
+            _orderedUnique(tokens[1::2], labels)
+
+        trees = _TREE.findall(content)
+        numTrees += len(trees)
+        _orderedUnique(_leaves(";".join(trees)), labels, translate)
+    return labels, numTrees
+
+
+def scanFile(path, schema):
+    """
+    Scan one gene tree file, possibly compressed, for its taxon labels.
+    :param path: path of a gene tree file
+    :param schema: "nexus" or "newick"
+    :return: (labels, numTrees)
+    """
+    with compression.openInput(path) as inputFile:
+        text = inputFile.read()
+    if schema == "nexus":
+        return scanNexus(text)
+    return scanNewick(text)
@@ -0,0 +1,780 @@
+import os
+import re
+import tempfile
+import dendropy
+from dendropy.dataio import nexusprocessing
+from dendropy.utility.error import DataParseError
+
+try:
+    # Gene tree files are read as byte strings on Python 2.
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import compression
+import nexusWriter
+import workerPool
+
+
+def yieldTrees(path, schema, taxon_namespace=None):
+    """
+    Read a gene tree file tree by tree, without building a TreeList.
+    Compressed files (.gz, .bz2, .xz) are decompressed while they are read.
+    :param path: path of a gene tree file
+    :param schema: "nexus" or "newick"
+    :param taxon_namespace: an optional TaxonNamespace collecting the taxa of all trees
+    :return: an iterator over dendropy Tree objects
+    """
+    with compression.openInput(path) as inputFile:
+        for tree in dendropy.Tree.yield_from_files(files=[inputFile], schema=schema,
+                                                   taxon_namespace=taxon_namespace, preserve_underscores=True):
+            yield tree
+
+
+def newickString(tree):
+    """
+    Serialize one tree the way it appears in the TREES block written by this program.
+    """
+    return tree.as_string(schema="newick", unquoted_underscores=True).rstrip("\n")
+
+
+# Tokens of a Newick string without comments or quoted labels: punctuation, or a label or branch length.
+_NEWICK_TOKEN = re.compile(r"[(),:]|[^\s()\[\]'\",:;]+|\S")
+_BRANCH_LENGTH = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?$")
+_PUNCTUATION = frozenset("(),:")
+# Rooting comment in front of a tree, which dendropy writes followed by a blank.
+_ROOTING = re.compile(r"\s*(\[&[RU]\])")
+_NEXUS_HEADER = re.compile(r"\s*#nexus\s+begin\s+trees\s*$", re.I)
+_NEXUS_BEGIN_TREES = re.compile(r"\s*begin\s+trees\s*$", re.I)
+_NEXUS_END = re.compile(r"\s*end(?:block)?\s*$", re.I)
+_NEXUS_TREE = re.compile(r"\s*tree\s+(?:\*\s*)?[^\s=]+\s*=(.*)$", re.I | re.S)
+# Semicolons end statements, except in quoted labels and comments, which may be nested.
+_STATEMENT_SYNTAX = re.compile(r"[;'\[\]]")
+_COMMENT = re.compile(r"\[[^\[\]]*\]")
+# Branch lengths are written as dendropy writes a float.
+_formatLength = "{}".format
+
+# Number of characters read from a gene tree file at a time.
+CHUNK_SIZE = 1 << 16
+
+# States of a NEXUS file read statement by statement: before, in and after a TREES block.
+_START = 0
+_TREES = 1
+_AFTER = 2
+# What dendropy has to read before the rest of a NEXUS file in each state.
+_RESUME_HEADERS = ("", "#NEXUS\nbegin trees;\n", "#NEXUS\n")
+
+
+class NeedsParsing(Exception):
+    """
+    Raised when a tree cannot be copied as it is, e.g. because dendropy would rewrite a branch length or quote a
+    label, so the tree has to be read by dendropy.
+    """
+    pass
+
+
+class _Taxa(object):
+    """
+    Taxa of a file in the order they are first seen, kept in the TaxonNamespace dendropy reads the other trees of
+    the file into. Like in a dendropy TaxonNamespace, labels that only differ in case are one taxon, which dendropy
+    would write with its first spelling; trees with another spelling are left to dendropy.
+    """
+    def __init__(self, namespace, numbered):
+        """
+        :param numbered: if True, labels made of digits are left to dendropy, which reads them as taxon numbers in
+                         NEXUS trees
+        """
+        self.namespace = namespace
+        self.numbered = numbered
+        self.spelling = {}
+        # Number of taxa of namespace found in spelling.
+        self.known = 0
+        self.inTree = set([])
+
+    def startTree(self):
+        self.inTree = set([])
+
+    def add(self, label):
+        key = label.lower()
+        # A taxon twice in one tree is an error for dendropy to report.
+        if key in self.inTree or (self.numbered and label.isdigit()):
+            raise NeedsParsing()
+        self.inTree.add(key)
+        first = self.spelling.get(key)
+        if first is None:
+            self.spelling[key] = label
+            self.namespace.new_taxon(label)
+            self.known += 1
+        elif first != label:
+            raise NeedsParsing()
+
+    def update(self):
+        """
+        Take in the taxa dendropy added to the namespace.
+        """
+        for taxon in self.namespace[self.known:]:
+            if taxon.label is not None:
+                self.spelling.setdefault(taxon.label.lower(), taxon.label)
+        self.known = len(self.namespace)
+
+
+def _checkLabel(label):
+    # escape_nexus_token quotes somewhat more than the Newick writer of dendropy does, e.g. labels with "-", so
+    # such trees are parsed although they could have been copied. Never the other way around.
+    if nexusprocessing.escape_nexus_token(label, preserve_spaces=False, quote_underscores=False) != label:
+        raise NeedsParsing()
+
+
+def _checkLength(length):
+    if not _BRANCH_LENGTH.match(length) or _formatLength(float(length)) != length:
+        raise NeedsParsing()
+
+
+def _verbatimNewick(text, taxa):
+    """
+    The Newick string dendropy would write for one tree statement, built from its tokens.
+    :param text: the tree without its final semicolon
+    :param taxa: _Taxa collecting the leaf labels
+    :raise NeedsParsing: if dendropy would write anything but the tokens of the tree with blanks removed
+    """
+    rooting = _ROOTING.match(text)
+    prefix = ""
+    if rooting is not None:
+        prefix = rooting.group(1) + " "
+        text = text[rooting.end():]
+    tokens = _NEWICK_TOKEN.findall(text)
+    taxa.startTree()
+    depth = 0
+    i = 0
+    while True:
+        # A node starts with its opening parentheses, down to a leaf, which must have a label.
+        while i < len(tokens) and tokens[i] == "(":
+            depth += 1
+            i += 1
+        if i == len(tokens) or tokens[i] in _PUNCTUATION:
+            raise NeedsParsing()
+        _checkLabel(tokens[i])
+        taxa.add(tokens[i])
+        i += 1
+        # Then come its branch length and the closing parentheses of the nodes it ends, each with an optional
+        # label and branch length, up to the next sibling or the end of the tree.
+        while True:
+            if i < len(tokens) and tokens[i] == ":":
+                if i + 1 == len(tokens):
+                    raise NeedsParsing()
+                _checkLength(tokens[i + 1])
+                i += 2
+            if i == len(tokens):
+                if depth != 0:
+                    raise NeedsParsing()
+                return prefix + "".join(tokens) + ";"
+            if tokens[i] == "," and depth > 0:
+                i += 1
+                break
+            if tokens[i] != ")" or depth == 0:
+                raise NeedsParsing()
+            depth -= 1
+            i += 1
+            if i < len(tokens) and tokens[i] not in _PUNCTUATION:
+                _checkLabel(tokens[i])
+                i += 1
+
+
+def _isBlank(text):
+    """
+    Whether text holds nothing but blanks and comments.
+    """
+    count = 1
+    while count:
+        text, count = _COMMENT.subn("", text)
+    return not text.strip()
+
+
+class _Statements(object):
+    """
+    Split a text stream into statements, reading it a chunk at a time. Iterating yields
+    (statement without its semicolon, line and column where it starts, True) for each statement, then
+    (text after the last semicolon, line, column, False).
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        # Text read, of which the statements before start were yielded.
+        self.text = ""
+        self.start = 0
+        self.line = 1
+        self.column = 0
+
+    def __iter__(self):
+        quoted = False
+        depth = 0
+        # Where to look for the next semicolon, quote or bracket in text.
+        position = 0
+        while True:
+            match = _STATEMENT_SYNTAX.search(self.text, position)
+            if match is None:
+                chunk = self.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                position = len(self.text) - self.start
+                self.text = self.text[self.start:] + chunk
+                self.start = 0
+                continue
+            position = match.end()
+            symbol = match.group()
+            if quoted:
+                # A quote in a quoted label is doubled, which closes and reopens it.
+                quoted = symbol != "'"
+            elif depth:
+                if symbol == "[":
+                    depth += 1
+                elif symbol == "]":
+                    depth -= 1
+            elif symbol == "'":
+                quoted = True
+            elif symbol == "[":
+                depth = 1
+            elif symbol == ";":
+                statement = self.text[self.start:match.start()]
+                line, column = self.line, self.column
+                self._advance(statement)
+                self.start = position
+                yield statement, line, column, True
+        statement = self.text[self.start:]
+        self.start = len(self.text)
+        yield statement, self.line, self.column, False
+
+    def _advance(self, statement):
+        # Move line and column past a statement and its semicolon.
+        newlines = statement.count("\n")
+        if newlines:
+            self.line += newlines
+            self.column = len(statement) - statement.rfind("\n")
+        else:
+            self.column += len(statement) + 1
+
+    def rest(self):
+        """
+        The text read after the last statement yielded. The rest of the file is still in the stream.
+        """
+        return self.text[self.start:]
+
+
+class _Replay(object):
+    """
+    A text stream reading a document, then the rest of the file it was taken from.
+    """
+    def __init__(self, document, rest):
+        self.document = document
+        self.rest = rest
+
+    def read(self, size=-1):
+        text = self.document.read(size)
+        if size < 0:
+            return text + self.rest.read()
+        if len(text) < size:
+            # The rest of the file is read straight from its stream from now on.
+            self.read = self.rest.read
+            text += self.rest.read(size - len(text))
+        return text
+
+
+class _Document(object):
+    """
+    Text dendropy reads some trees of a file from: text of the file with NEXUS statements around it, e.g. the start
+    of a TREES block, then the rest of the file if given. Parts taken from the file start on a line of their own at
+    their column, so that the position of a parse error can be referred back to the file.
+    """
+    def __init__(self, parts, rest=None):
+        """
+        :param parts: list of texts written around the file text, and of (file text, line, column)
+        :param rest: a stream read after the parts
+        """
+        texts = []
+        # (line in the document, line in the file) where each part taken from the file starts
+        self.lines = []
+        line = 1
+        for part in parts:
+            if isinstance(part, tuple):
+                text, fileLine, column = part
+                self.lines.append((line, fileLine))
+                part = " " * column + text
+            texts.append(part)
+            line += part.count("\n")
+        self.text = "".join(texts)
+        self.rest = rest
+
+    def stream(self):
+        """
+        A new stream of the document for dendropy, which reads it a character at a time.
+        """
+        if self.rest is None:
+            return StringIO(self.text)
+        return _Replay(StringIO(self.text), self.rest)
+
+    def locate(self, e, path):
+        """
+        Refer a parse error in the document to the file.
+        """
+        e.decorate_with_name(filename=path)
+        if e.line_num is not None:
+            for line, fileLine in reversed(self.lines):
+                if e.line_num >= line:
+                    e.line_num += fileLine - line
+                    break
+
+
+class TreeReader(object):
+    """
+    Read the trees of a gene tree file as Newick strings, one statement at a time, so that neither the file nor
+    its trees are ever held in memory. Each tree that dendropy would write exactly as it is, apart from blanks, is
+    copied without building any dendropy object: no comments other than a rooting token, no quoted labels, no
+    NEXUS translate table, and branch lengths in the form dendropy writes floats. Whether that holds is checked on
+    every token, and the first tree copied is compared with what dendropy writes for it. Other trees are read by
+    dendropy, into one TaxonNamespace for the whole file, as yieldTrees() would read them. Whatever a NEXUS file
+    holds besides TREES blocks of tree statements, e.g. a translate table or a TAXA block, is left to dendropy from
+    that statement to the end of the file.
+    """
+    def __init__(self, path, schema):
+        """
+        :param path: path of a gene tree file
+        :param schema: "nexus" or "newick"
+        """
+        self.path = path
+        self.schema = schema
+        self.namespace = dendropy.TaxonNamespace()
+        self.taxa = _Taxa(self.namespace, schema == "nexus")
+        # Whether trees may still be copied, and whether the first copy was compared with dendropy.
+        self.verbatim = True
+        self.checked = False
+
+    def labels(self, start=0):
+        """
+        Taxon labels of the trees read so far, in the order they were first seen.
+        :param start: number of labels to skip, e.g. those already seen
+        """
+        return [taxon.label for taxon in self.namespace[start:]]
+
+    def __iter__(self):
+        """
+        Yield the Newick string of each tree of the file.
+        """
+        with compression.openInput(self.path) as inputFile:
+            statements = _Statements(inputFile)
+            if self.schema == "nexus":
+                trees = self._nexusTrees(statements)
+            else:
+                trees = self._newickTrees(statements)
+            for newick in trees:
+                yield newick
+
+    def _newickTrees(self, statements):
+        # Statements without a tree before the first tree, e.g. comments.
+        skipped = []
+        for statement, line, column, ended in statements:
+            if ended:
+                newick = self._newick(statement, [(statement, line, column), ";"])
+                if newick is not None:
+                    skipped = None
+                    yield newick
+                elif skipped is not None:
+                    skipped.append(statement + ";")
+            elif skipped is not None or not _isBlank(statement):
+                # dendropy decides whether text after the last tree, or a file without any tree, is an error.
+                if skipped is not None:
+                    parts = [("".join(skipped) + statement, 1, 0)]
+                else:
+                    parts = [(statement, line, column)]
+                for tree in self._dendropyTrees(_Document(parts)):
+                    yield newickString(tree)
+
+    def _nexusTrees(self, statements):
+        state = _START
+        for statement, line, column, ended in statements:
+            if ended:
+                if state == _START and _NEXUS_HEADER.match(statement):
+                    state = _TREES
+                    continue
+                if state == _TREES:
+                    tree = _NEXUS_TREE.match(statement)
+                    if tree is not None:
+                        # A tree that cannot be copied is read by dendropy from a TREES block of its own.
+                        newick = self._newick(tree.group(1), ["#NEXUS\nbegin trees;\n", (statement, line, column),
+                                                              ";\nend;\n"])
+                        if newick is not None:
+                            yield newick
+                        continue
+                    if _NEXUS_END.match(statement):
+                        state = _AFTER
+                        continue
+                if state == _AFTER and _NEXUS_BEGIN_TREES.match(statement):
+                    state = _TREES
+                    continue
+            elif state == _AFTER and _isBlank(statement):
+                return
+            # Anything else, e.g. a translate table, after which no tree can be copied, is read by dendropy from
+            # here to the end of the file.
+            parts = [_RESUME_HEADERS[state], (statement + (";" if ended else "") + statements.rest(), line, column)]
+            for tree in self._dendropyTrees(_Document(parts, statements.stream)):
+                yield newickString(tree)
+            return
+
+    def _newick(self, text, parts):
+        """
+        The Newick string of one tree statement, copied if possible, otherwise read by dendropy.
+        :param text: the tree, without its semicolon
+        :param parts: the statement in a document dendropy can read, see _Document
+        :return: the Newick string, or None if the statement holds no tree
+        """
+        if self.verbatim:
+            try:
+                newick = _verbatimNewick(text, self.taxa)
+            except NeedsParsing:
+                pass
+            else:
+                if self.checked:
+                    return newick
+                self.checked = True
+                if newickString(dendropy.Tree.get(data=newick, schema="newick",
+                                                  preserve_underscores=True)) == newick:
+                    return newick
+                self.verbatim = False
+        for tree in self._dendropyTrees(_Document(parts)):
+            return newickString(tree)
+        return None
+
+    def _dendropyTrees(self, document):
+        """
+        Yield the trees dendropy reads from a _Document, into the namespace of the file.
+        """
+        try:
+            for tree in dendropy.Tree.yield_from_files(files=[document.stream()], schema=self.schema,
+                                                       taxon_namespace=self.namespace, preserve_underscores=True):
+                self.taxa.update()
+                yield tree
+        except DataParseError as e:
+            document.locate(e, self.path)
+            raise
+
+
+class ParsedTrees(object):
+    """
+    Parsed content of one gene tree file.
+    taxa is the list of taxon labels in the order they were first seen, and newicks holds each tree
+    as a Newick string, which is far smaller than the dendropy object graph.
+    """
+    def __init__(self, taxa, newicks):
+        self.taxa = taxa
+        self.newicks = newicks
+
+
+def fileNewicks(path, schema):
+    """
+    The trees of a gene tree file as Newick strings, read one at a time by a TreeReader.
+    :return: an iterator of Newick strings
+    """
+    return iter(TreeReader(path, schema))
+
+
+def parseTreeFile(path, schema):
+    """
+    Read one gene tree file into a ParsedTrees object.
+    """
+    reader = TreeReader(path, schema)
+    newicks = list(reader)
+    return ParsedTrees(reader.labels(), newicks)
+
+
+def _parseNewicks(args):
+    """
+    Write the trees of one gene tree file to a temporary file, one Newick string per line, so that only its path
+    and taxa are sent back. Runs in a worker process of yieldFileNewicks.
+    :return: (path of the temporary file, taxon labels of the file in the order they were first seen)
+    """
+    path, schema = args
+    descriptor, treesPath = tempfile.mkstemp(".trees")
+    try:
+        reader = TreeReader(path, schema)
+        with os.fdopen(descriptor, "w") as treesFile:
+            for newick in reader:
+                treesFile.write(newick + "\n")
+    except Exception as e:
+        os.remove(treesPath)
+        # Errors of dendropy do not all survive pickling on their way back.
+        raise Exception(str(e))
+    return treesPath, reader.labels()
+
+
+def _readNewicks(treesPath):
+    """
+    Yield the Newick strings of a temporary file written by _parseNewicks().
+    """
+    with open(treesPath) as treesFile:
+        for line in treesFile:
+            yield line.rstrip("\n")
+
+
+def _removeFile(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _removeTrees(parsed):
+    # Result of _parseNewicks() dropped by workerPool.imap().
+    _removeFile(parsed[0])
+
+
+class _Spellings(object):
+    """
+    First spelling of each taxon label of an upload. Like in the TreeList the uploaded files used to be read into,
+    labels that only differ in case are one taxon across all files, written with the spelling of the first file it
+    is seen in, as GeneTreeCache.taxonLabels() lists it.
+    """
+    def __init__(self):
+        self.first = {}
+
+    def newicks(self, trees, labels):
+        """
+        Yield the trees of one file with the spellings of the files before it.
+        :param trees: iterator of Newick strings
+        :param labels: function returning the taxon labels of the trees of the file yielded so far, without the
+                       given number of labels seen before, called as labels(start)
+        """
+        renames = {}
+        seen = 0
+        for newick in trees:
+            for label in labels(seen):
+                seen += 1
+                if label is None:
+                    continue
+                first = self.first.setdefault(label.lower(), label)
+                if first != label:
+                    renames[label] = first
+            if renames:
+                newick = _relabel(newick, renames)
+            yield newick
+
+
+def _relabel(newick, renames):
+    """
+    Rewrite the taxon labels of a Newick string written by newickString().
+    :param renames: dictionary from label to the label to write instead
+    """
+    tree = dendropy.Tree.get(data=newick, schema="newick", preserve_underscores=True)
+    for taxon in tree.taxon_namespace:
+        if taxon.label in renames:
+            taxon.label = renames[taxon.label]
+    return newickString(tree)
+
+
+def yieldFileNewicks(inputFiles, schema, cache=None):
+    """
+    Yield (file, trees as Newick strings) for each uploaded file, in upload order.
+    Files that are not in cache are parsed in parallel in the shared workerPool, a few files ahead of the one
+    being yielded. Each worker writes the trees of its file to a temporary file, which is read back line by line
+    and removed once the next file is asked for, so neither the workers nor the results hold a whole file in
+    memory. Results are merged back in input order so gene tree naming stays deterministic. A single file to parse
+    is streamed in this process. Taxon labels that only differ in case from a label of an earlier file are written
+    with its spelling, see _Spellings.
+    """
+    cached = [cache.lookup(file, schema) if cache is not None else None for file in inputFiles]
+    toParse = [(file, schema) for file, parsed in zip(inputFiles, cached) if parsed is None]
+
+    results = None
+    if len(toParse) > 1:
+        results = workerPool.imap(_parseNewicks, toParse, discard=_removeTrees)
+
+    spellings = _Spellings()
+    try:
+        for file, parsed in zip(inputFiles, cached):
+            if parsed is not None:
+                yield file, spellings.newicks(iter(parsed.newicks), lambda start: parsed.taxa[start:])
+            elif results is None:
+                reader = TreeReader(file, schema)
+                yield file, spellings.newicks(iter(reader), reader.labels)
+            else:
+                treesPath, taxa = next(results)
+                trees = _readNewicks(treesPath)
+                try:
+                    yield file, spellings.newicks(trees, lambda start: taxa[start:])
+                finally:
+                    trees.close()
+                    _removeFile(treesPath)
+    finally:
+        if results is not None:
+            # Temporary files of the files parsed ahead are removed as their workers finish.
+            results.close()
+
+
+def writeGeneTrees(path, inputFiles, schema, cache=None, requireTrees=False):
+    """
+    Stream all trees of the uploaded files into a TREES block.
+    Gene trees are renamed to file name + counter, e.g. locus0, locus1, ...
+    :param path: path of the NEXUS file to create
+    :param inputFiles: list of gene tree files, in upload order
+    :param schema: "nexus" or "newick"
+    :param cache: an optional GeneTreeCache holding files that have already been parsed
+    :param requireTrees: if True, a file without any tree is an error instead of being skipped
+    :return: geneTreeNames, a list of gene tree names in the order they were written
+    """
+    geneTreeNames = []
+    with nexusWriter.openOutput(path) as outputFile:
+        writer = nexusWriter.TreesBlockWriter(outputFile)
+        writer.begin()
+        for file, trees in yieldFileNewicks(inputFiles, schema, cache):
+            fileName = compression.baseName(file)
+            counter = 0
+            for newick in trees:
+                # rename gene trees
+                label = fileName + str(counter)
+                writer.writeNewick(label, newick)
+                geneTreeNames.append(label)
+                counter += 1
+            if requireTrees and counter == 0:
+                raise Exception("No tree data found in gene tree file")
+        writer.end()
+
+    # Raise exception is found no tree data.
+    if writer.numTrees == 0:
+        os.remove(path)
+        raise Exception("No tree data found in data file")
+
+    return geneTreeNames
+
+
+def _writeLocus(writer, name, trees):
+    """
+    Write the trees of one locus. If the locus has only one tree, that tree is given the name of the locus.
+    If it has multiple trees, they are named locus name + counter.
+    :param trees: iterator of Newick strings
+    :return: the name of the tree of a single-tree locus, the list of names of a multi-tree locus, or None if the
+    locus has no tree
+    """
+    # Look one tree ahead to know how the first tree should be named.
+    first = next(trees, None)
+    if first is None:
+        return None
+    second = next(trees, None)
+    if second is None:
+        writer.writeNewick(name, first)
+        return name
+    names = []
+    for counter, newick in enumerate(_chain(first, second, trees)):
+        # rename gene trees
+        label = name + str(counter)
+        writer.writeNewick(label, newick)
+        names.append(label)
+    return names
+
+
+def writeLocusGeneTrees(path, inputFiles, schema, cache=None):
+    """
+    Stream all trees of the uploaded files into a TREES block, treating each file as one locus.
+    If a file contains only one tree, that tree is named after the file. If a file contains multiple trees,
+    they are assumed to come from the same locus and are named file name + counter.
+    :param path: path of the NEXUS file to create
+    :param inputFiles: list of gene tree files, in upload order
+    :param schema: "nexus" or "newick"
+    :param cache: an optional GeneTreeCache holding files that have already been parsed
+    :return: (geneTreeNames, multiTreesPerLocus). geneTreeNames holds a name for each single-tree locus and
+    a list of names for each multi-tree locus.
+    """
+    geneTreeNames = []
+    multiTreesPerLocus = False
+    with nexusWriter.openOutput(path) as outputFile:
+        writer = nexusWriter.TreesBlockWriter(outputFile)
+        writer.begin()
+        for file, trees in yieldFileNewicks(inputFiles, schema, cache):
+            locus = _writeLocus(writer, compression.baseName(file), trees)
+            if locus is None:
+                continue
+            if type(locus) is list:
+                multiTreesPerLocus = True
+            geneTreeNames.append(locus)
+        writer.end()
+
+    # Raise exception is found no tree data.
+    if writer.numTrees == 0:
+        os.remove(path)
+        raise Exception("No tree data found in data file")
+
+    return geneTreeNames, multiTreesPerLocus
+
+
+def readLoci(inputFiles, schema, cache=None):
+    """
+    Read the uploaded files once, treating each file as one locus, so that several files can be written from them.
+    Files without any tree are left out, as writeLocusGeneTrees() does.
+    :return: list of (locus name, list of Newick strings), in upload order
+    """
+    loci = []
+    for file, trees in yieldFileNewicks(inputFiles, schema, cache):
+        newicks = list(trees)
+        if newicks:
+            loci.append((compression.baseName(file), newicks))
+    if not loci:
+        raise Exception("No tree data found in data file")
+    return loci
+
+
+def writeLoci(path, loci, indices=None):
+    """
+    Write a TREES block of loci read by readLoci(), with the names writeLocusGeneTrees() would give their trees.
+    A locus taken more than once, e.g. by a bootstrap replicate, is named locus name + "_2", "_3", ... after its
+    first occurrence. A suffix is skipped if it would give one of the trees the name of another tree, e.g.
+    "locus_2" + "0" when a locus is named "locus_20".
+    :param path: path of the NEXUS file to create
+    :param indices: indices of the loci to write, all loci in order by default
+    :return: (geneTreeNames, multiTreesPerLocus), as returned by writeLocusGeneTrees()
+    """
+    if indices is None:
+        indices = range(len(loci))
+    # Tree names already given. The first occurrence of each locus keeps its names.
+    used = set([])
+    for index in set(indices):
+        name, newicks = loci[index]
+        used.update(_treeNames(name, len(newicks)))
+    geneTreeNames = []
+    multiTreesPerLocus = False
+    # Index of a locus -> suffix of its last occurrence, 1 for the first one.
+    suffixes = {}
+    with nexusWriter.openOutput(path) as outputFile:
+        writer = nexusWriter.TreesBlockWriter(outputFile)
+        writer.begin()
+        for index in indices:
+            name, newicks = loci[index]
+            if index in suffixes:
+                suffix = suffixes[index] + 1
+                while used.intersection(_treeNames(name + "_" + str(suffix), len(newicks))):
+                    suffix += 1
+                name += "_" + str(suffix)
+                used.update(_treeNames(name, len(newicks)))
+            else:
+                suffix = 1
+            suffixes[index] = suffix
+            locus = _writeLocus(writer, name, iter(newicks))
+            if type(locus) is list:
+                multiTreesPerLocus = True
+            geneTreeNames.append(locus)
+        writer.end()
+    return geneTreeNames, multiTreesPerLocus
+
+
+def _treeNames(name, numTrees):
+    """
+    Names _writeLocus() gives the trees of a locus.
+    """
+    if numTrees == 1:
+        return [name]
+    return [name + str(counter) for counter in range(numTrees)]
+
+
+def _chain(first, second, rest):
+    """
+    Put the two look-ahead trees back in front of the remaining ones.
+    """
+    yield first
+    yield second
+    for tree in rest:
+        yield tree
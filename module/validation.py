@@ -0,0 +1,143 @@
+import os
+import sys
+import functools
+import subprocess
+from PyQt4.QtGui import QMessageBox, QProgressDialog
+from PyQt4 import QtCore
+
+import shards
+
+# Stage reported while the files of a run are validated.
+VALIDATE = "Validating"
+
+
+def resource_path(relative_path):
+    """
+    Refer to the location of a file at run-time.
+    This function is from
+    https://www.reddit.com/r/learnpython/comments/4kjie3/how_to_include_gui_images_with_pyinstaller/
+    For more information, visit https://pythonhosted.org/PyInstaller/runtime-information.html#run-time-information
+    """
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.join(sys._MEIPASS, relative_path)
+    return os.path.join(os.path.abspath("."), relative_path)
+
+
+def checkFile(filePath):
+    """
+    Validate a generated .nexus file by feeding it to PhyloNet.
+    Specify -checkParams on command line to make sure PhyloNet checks input without executing the command.
+    :return: the output of PhyloNet if it rejects the file, None otherwise
+    """
+    try:
+        subprocess.check_output(
+            ["java", "-jar", resource_path("testphylonet.jar"),
+             filePath, "checkParams"], stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        return e.output
+    return None
+
+
+class Cancelled(Exception):
+    """
+    Raised by the progress callback of a Validator once it has been cancelled.
+    """
+    pass
+
+
+class Validator(QtCore.QThread):
+    """
+    Worker thread validating the files of a run with shards.validate(), so that a large sweep never blocks the
+    page. Progress is reported per file, and cancel() stops before the next file and removes the run.
+    """
+    # Signal to emit when encounters an exception.
+    exception = QtCore.pyqtSignal(Exception)
+    # Signal to emit after each file: (stage, done, total).
+    progressChanged = QtCore.pyqtSignal(str, int, int)
+
+    def __init__(self, paths, manifest):
+        """
+        :param paths: the files of the run, as given to shards.validate()
+        :param manifest: path of the manifest, None for a run without a plan
+        """
+        QtCore.QThread.__init__(self)
+        self.paths = paths
+        self.manifest = manifest
+        self.cancelRequested = False
+        # Output of PhyloNet for the file that failed, once the thread is done.
+        self.message = None
+
+    def cancel(self):
+        """
+        Ask the thread to stop. Called from the main thread.
+        """
+        self.cancelRequested = True
+
+    def report(self, done, total):
+        if self.cancelRequested:
+            raise Cancelled()
+        self.progressChanged.emit(VALIDATE, done, total)
+
+    def run(self):
+        """
+        Execute the thread. Validate the files of the run.
+        """
+        try:
+            self.message = shards.validate(self.paths, self.manifest, checkFile, self.report)
+        except Cancelled:
+            pass
+        except Exception as e:
+            self.exception.emit(e)
+
+
+class Validations(object):
+    """
+    The Validator threads of a page, each with its own progress bar. Errors are displayed on the page.
+    """
+    def __init__(self, parent):
+        self.parent = parent
+        # Running validators -> their progress dialogs.
+        self.running = {}
+
+    def start(self, paths, manifest):
+        """
+        Validate the files of a run in a new Validator.
+        """
+        validator = Validator(paths, manifest)
+        progress = QProgressDialog("Validating...", "Cancel", 0, len(paths), self.parent)
+        progress.setWindowTitle(os.path.basename(paths[0] if manifest is None else manifest))
+        # The dialog is closed by finish(), not when the bar is full.
+        progress.setAutoReset(False)
+        progress.setAutoClose(False)
+        progress.canceled.connect(functools.partial(self.cancel, validator))
+        self.running[validator] = progress
+        validator.finished.connect(functools.partial(self.finish, validator))
+        validator.exception.connect(functools.partial(self.fail, validator))
+        validator.progressChanged.connect(functools.partial(self.showProgress, validator))
+        validator.start()
+        progress.show()
+
+    def showProgress(self, validator, stage, done, total):
+        progress = self.running[validator]
+        progress.setLabelText("%s file %d of %d..." % (stage, min(done + 1, total), total))
+        progress.setMaximum(total)
+        progress.setValue(done)
+
+    def cancel(self, validator):
+        if validator.isRunning():
+            self.running[validator].setLabelText("Cancelling...")
+            self.running[validator].show()
+            validator.cancel()
+
+    def finish(self, validator):
+        """
+        Close the progress bar of a validator, and display the error of PhyloNet if a file failed.
+        """
+        progress = self.running.pop(validator)
+        progress.reset()
+        progress.hide()
+        if validator.message is not None:
+            QMessageBox.warning(self.parent, "Warning", validator.message, QMessageBox.Ok)
+
+    def fail(self, validator, e):
+        QMessageBox.warning(self.parent, "Warning", str(e), QMessageBox.Ok)
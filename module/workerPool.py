@@ -0,0 +1,95 @@
+import collections
+import itertools
+import threading
+import multiprocessing
+
+# The pool shared by every page, started by start().
+_pool = None
+_processes = 0
+_lock = threading.Lock()
+
+
+def context():
+    """
+    The multiprocessing context worker processes are started with. Workers are spawned where Python supports it,
+    so that they never inherit the Qt application, its threads or its locks through fork(). Python 2 can only
+    fork, which is why the launchers start the pool before the QApplication is created.
+    """
+    if hasattr(multiprocessing, "get_context"):
+        return multiprocessing.get_context("spawn")
+    return multiprocessing
+
+
+def start(processes=None):
+    """
+    Start the shared pool of worker processes, unless it is already running.
+    Called by the launchers before the QApplication is created; get() starts it on first use otherwise,
+    e.g. in a script.
+    :param processes: number of worker processes, all CPUs by default
+    :return: the pool
+    """
+    global _pool, _processes
+    with _lock:
+        if _pool is None:
+            _processes = processes or multiprocessing.cpu_count()
+            _pool = context().Pool(_processes)
+        return _pool
+
+
+def get():
+    """
+    The shared pool, started now if it is not running yet.
+    """
+    return start()
+
+
+def size():
+    """
+    Number of worker processes of the shared pool.
+    """
+    start()
+    return _processes
+
+
+def _discard(results, discard):
+    """
+    Wait for the results of tasks submitted by an iterator of imap() that was closed early, and discard them.
+    """
+    for result in results:
+        try:
+            discard(result.get())
+        except Exception:
+            # A task that failed left nothing behind.
+            pass
+
+
+def imap(function, arguments, window=None, discard=None):
+    """
+    Like Pool.imap() on the shared pool, but with at most window tasks submitted ahead of the results consumed,
+    so that results never pile up in memory when the consumer is slower than the workers. Several threads may use
+    the pool at the same time. Closing the iterator early stops submitting tasks: the pool is never terminated,
+    so tasks already submitted finish in the background and their results are dropped.
+    :param function: a module-level function, called with one argument in a worker process
+    :param arguments: iterable of arguments, each of them pickled and sent to a worker
+    :param window: number of tasks submitted ahead, twice the number of workers by default
+    :param discard: called with each result dropped, e.g. to remove a file a task wrote. Results of tasks still
+                    running when the iterator is closed are discarded by a background thread as they come.
+    :return: iterator of results, in the order of arguments
+    """
+    pool = get()
+    if window is None:
+        window = 2 * _processes
+    arguments = iter(arguments)
+    pending = collections.deque(pool.apply_async(function, (argument,))
+                                for argument in itertools.islice(arguments, window))
+    try:
+        while pending:
+            result = pending.popleft().get()
+            for argument in itertools.islice(arguments, 1):
+                pending.append(pool.apply_async(function, (argument,)))
+            yield result
+    finally:
+        if pending and discard is not None:
+            thread = threading.Thread(target=_discard, args=(list(pending), discard))
+            thread.daemon = True
+            thread.start()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the application import each other by plain name from the module directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module"))
@@ -0,0 +1,215 @@
+import io
+import os
+import subprocess
+import sys
+
+import dendropy
+import pytest
+
+import biMarkers
+import codeMatrix
+import diskCache
+
+# Columns of every kind: bi-allelic, monomorphic, three symbols, ambiguity codes, ignored symbols, gaps and
+# missing data.
+FASTA = """>A
+ACGTAMRWSYKACGTNA-?CAGTMA
+>B_1
+ACGAAACCGTTACGAAAAACCGKMA
+>C
+TCGTGAAAGCGTCGTAAAATAGTCA
+>D
+ACCTAMRWSYKAAGTAV-?CAATCC
+"""
+
+NEXUS = """#NEXUS
+begin data;
+    dimensions ntax=4 nchar=25;
+    format datatype=dna missing=? gap=-;
+    matrix
+    A   ACGTAMRWSYKACGTNA-?CAGTMA
+    B_1 ACGAAACCGTTACGAAAAACCGKMA
+    C   TCGTGAAAGCGTCGTAAAATAGTCA
+    D   ACCTAMRWSYKAAGTAV-?CAATCC
+    ;
+end;
+"""
+
+
+def phasing(dnaMatrix):
+    """
+    The original conversion of unphased data into phased data.
+    """
+    ambiguity_code = {
+        "M": ["A", "C"],
+        "R": ["A", "G"],
+        "W": ["A", "T"],
+        "S": ["C", "G"],
+        "Y": ["C", "T"],
+        "K": ["G", "T"]
+    }
+    ignore_code = ["V", "H", "D", "B", "N", "-"]
+    phased = {}
+    for taxon in dnaMatrix.taxon_namespace:
+        phased[taxon.label + "_0"] = ""
+        phased[taxon.label + "_1"] = ""
+    for i in range(len(dnaMatrix[0])):
+        nucleotides = set([])
+        for taxon in dnaMatrix:
+            nucleotides.add(str(dnaMatrix[taxon][i]))
+        if any(x in ignore_code for x in nucleotides):
+            continue
+        else:
+            for taxon in dnaMatrix:
+                if str(dnaMatrix[taxon][i]) not in ambiguity_code:
+                    phased[taxon.label + "_0"] += str(dnaMatrix[taxon][i])
+                    phased[taxon.label + "_1"] += str(dnaMatrix[taxon][i])
+                else:
+                    phased[taxon.label + "_0"] += ambiguity_code[str(dnaMatrix[taxon][i])][0]
+                    phased[taxon.label + "_1"] += ambiguity_code[str(dnaMatrix[taxon][i])][1]
+    return phased
+
+
+def phasedToBi(dnaMatrix):
+    """
+    The original conversion of phased data into bi-allelic markers.
+    """
+    bimarkers = {}
+    for taxon in dnaMatrix.taxon_namespace:
+        bimarkers[taxon.label] = ""
+    for i in range(len(dnaMatrix[0])):
+        nucleotides = set([])
+        for taxon in dnaMatrix:
+            nucleotides.add(str(dnaMatrix[taxon][i]))
+        if len(nucleotides) == 2 and "-" not in nucleotides:
+            uniqueNucleotides = list(nucleotides)
+            zero = uniqueNucleotides[0]
+            for taxon in dnaMatrix:
+                if str(dnaMatrix[taxon][i]) == zero:
+                    bimarkers[taxon.label] += "0"
+                else:
+                    bimarkers[taxon.label] += "1"
+    return bimarkers
+
+
+def originalData(path, schema, dataType, **kwargs):
+    """
+    The DATA block the bi-marker pages wrote before the conversion was rewritten.
+    """
+    data = dendropy.DnaCharacterMatrix.get(path=path, schema=schema, **kwargs)
+    if dataType == biMarkers.PHASED:
+        ntax = len(data.taxon_namespace)
+        bimarkers = phasedToBi(data)
+    else:
+        ntax = 2 * len(data.taxon_namespace)
+        bimarkers = phasedToBi(dendropy.DnaCharacterMatrix.from_dict(phasing(data)))
+    outputFile = io.StringIO()
+    outputFile.write("#NEXUS\n")
+    outputFile.write("Begin data;\n")
+    outputFile.write("Dimensions ntax=")
+    outputFile.write(str(ntax))
+    outputFile.write(" nchar=")
+    outputFile.write(str(len(list(bimarkers.values())[0])))
+    outputFile.write(";\n")
+    outputFile.write('Format datatype=dna symbols="012" missing=? gap=-;\n')
+    outputFile.write("Matrix\n\n")
+    for taxon in bimarkers:
+        outputFile.write(taxon)
+        outputFile.write(" ")
+        outputFile.write(bimarkers[taxon])
+        outputFile.write("\n")
+    outputFile.write(";End;\n\n")
+    return outputFile.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def cacheDir(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "CACHE_DIR", str(tmpdir.join("cache")))
+    monkeypatch.setattr(codeMatrix, "CHUNK_SIZE", 7)
+
+
+@pytest.mark.parametrize("dataType", [biMarkers.PHASED, biMarkers.UNPHASED])
+@pytest.mark.parametrize("text, schema, kwargs", [
+    (FASTA, "fasta", {}),
+    (NEXUS, "nexus", {"preserve_underscores": True}),
+])
+@pytest.mark.parametrize("blockSize", [4, biMarkers.BLOCK_SIZE])
+def test_output_matches_original_conversion(tmpdir, text, schema, kwargs, dataType, blockSize):
+    path = str(tmpdir.join("data." + schema))
+    with open(path, "w") as outputFile:
+        outputFile.write(text)
+    conversion = biMarkers.convert(biMarkers.readData(path, schema, dataType), dataType, blockSize=blockSize,
+                                   processes=1)
+    outputFile = io.StringIO()
+    biMarkers.writeData(outputFile, conversion.markers)
+    assert outputFile.getvalue() == originalData(path, schema, dataType, **kwargs)
+
+
+# Converts the same data in the calling process and in workerPool, whose workers have another hash seed, and
+# prints both outputs.
+POOLED_SCRIPT = """
+import io
+import os
+import sys
+
+import biMarkers
+import diskCache
+import workerPool
+
+
+def output(path, dataType, processes):
+    conversion = biMarkers.convert(biMarkers.readData(path, "fasta", dataType), dataType, blockSize=4,
+                                   processes=processes)
+    outputFile = io.StringIO()
+    biMarkers.writeData(outputFile, conversion.markers)
+    return outputFile.getvalue()
+
+
+if __name__ == "__main__":
+    diskCache.CACHE_DIR = sys.argv[2]
+    biMarkers.PARALLEL_MIN_SIZE = 0
+    os.environ["PYTHONHASHSEED"] = str(int(os.environ["PYTHONHASHSEED"]) + 1)
+    workerPool.start(2)
+    for dataType in (biMarkers.PHASED, biMarkers.UNPHASED):
+        print(output(sys.argv[1], dataType, 1) == output(sys.argv[1], dataType, None))
+"""
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_pooled_output_does_not_depend_on_hash_seeds(tmpdir, seed):
+    path = str(tmpdir.join("data.fasta"))
+    with open(path, "w") as outputFile:
+        # Every pair of nucleotides in bi-allelic columns.
+        outputFile.write(">A\nAAAACCGGAACCGTAC\n>B\nCGTCGTTTAACCGTAC\n>C\nACGTCGTGAAMRWSYK\n")
+    script = str(tmpdir.join("pooled.py"))
+    with open(script, "w") as scriptFile:
+        scriptFile.write(POOLED_SCRIPT)
+    environment = dict(os.environ, PYTHONHASHSEED=str(seed),
+                       PYTHONPATH=os.pathsep.join([os.path.dirname(biMarkers.__file__)] + sys.path))
+    output = subprocess.check_output([sys.executable, script, path, str(tmpdir.join("cache"))], env=environment)
+    assert output.split() == [b"True", b"True"]
+
+
+@pytest.mark.parametrize("dataType", [biMarkers.PHASED, biMarkers.UNPHASED])
+def test_packed_conversion_is_kept(tmpdir, monkeypatch, dataType):
+    path = str(tmpdir.join("data.fasta"))
+    with open(path, "w") as outputFile:
+        outputFile.write(FASTA)
+    data = biMarkers.readData(path, "fasta", dataType)
+    conversion = biMarkers.convert(data, dataType, blockSize=4, processes=1)
+    packed = conversion.packed()
+    outputFile = io.StringIO()
+    biMarkers.writeData(outputFile, packed)
+    assert outputFile.getvalue() == originalData(path, "fasta", dataType)
+
+    # Rows are never converted again, and subsets and column selections are taken from the packed markers.
+    def convertRows(markers):
+        raise AssertionError("rows converted again")
+
+    monkeypatch.setattr(biMarkers.ConvertedMarkers, "rows", convertRows)
+    assert conversion.packed() is packed
+    assert conversion.matches(data, dataType)
+    assert not conversion.matches(biMarkers.readData(path, "fasta", dataType), dataType)
+    labels = packed.labels[::-1]
+    subset = conversion.packed().subset(labels).selectColumns([1, 0])
+    assert [subset.row(label) for label in labels] == [packed.row(label)[1::-1] for label in labels]
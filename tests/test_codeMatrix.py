@@ -0,0 +1,134 @@
+import gzip
+import os
+
+import dendropy
+import pytest
+
+import codeMatrix
+import diskCache
+
+FASTA = """>a
+ACGTMR
+wsykac
+>b_1
+ACGTAA
+CC--??
+"""
+
+NEXUS = """#NEXUS
+begin data;
+    dimensions ntax=2 nchar=12;
+    format datatype=dna missing=? gap=-;
+    matrix
+    'a x' ACGTMR wsykac
+    b_1
+    ACGTAACC
+    --??
+    ;
+end;
+"""
+
+# An interleaved matrix is left to dendropy.
+INTERLEAVED_NEXUS = """#NEXUS
+begin data;
+    dimensions ntax=2 nchar=12;
+    format datatype=dna interleave missing=? gap=-;
+    matrix
+    a ACGTMR
+    b ACGTAA
+
+    a wsykac
+    b CC--??
+    ;
+end;
+"""
+
+
+@pytest.fixture(autouse=True)
+def cacheDir(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "CACHE_DIR", str(tmpdir.join("cache")))
+    # Small chunks, so that labels, tokens and lines are cut at every position.
+    monkeypatch.setattr(codeMatrix, "CHUNK_SIZE", 5)
+
+
+def dendropyRows(path, schema, **kwargs):
+    matrix = dendropy.DnaCharacterMatrix.get(path=path, schema=schema, **kwargs)
+    return [(taxon.label, matrix[taxon].symbols_as_string()) for taxon in matrix]
+
+
+def codeRows(matrix):
+    codes = matrix.codes()
+    return [(label, codes[row].tobytes().decode("ascii")) for row, label in enumerate(matrix.labels)]
+
+
+@pytest.mark.parametrize("text, schema, kwargs", [
+    (FASTA, "fasta", {}),
+    (NEXUS, "nexus", {"preserve_underscores": True}),
+    (INTERLEAVED_NEXUS, "nexus", {"preserve_underscores": True}),
+])
+def test_rows_match_dendropy(tmpdir, text, schema, kwargs):
+    path = str(tmpdir.join("data." + schema))
+    with open(path, "w") as outputFile:
+        outputFile.write(text)
+    matrix = codeMatrix.readMatrix(path, schema, **kwargs)
+    assert codeRows(matrix) == dendropyRows(path, schema, **kwargs)
+    # Read again from diskCache.
+    assert codeRows(codeMatrix.readMatrix(path, schema, **kwargs)) == codeRows(matrix)
+
+
+def writeFasta(tmpdir, name, text):
+    path = str(tmpdir.join(name))
+    with open(path, "w") as outputFile:
+        outputFile.write(text)
+    return path
+
+
+def test_matrix_larger_than_the_cache_is_kept_privately(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "MAX_CACHE_BYTES", 8)
+    path = writeFasta(tmpdir, "data.fasta", FASTA)
+    matrix = codeMatrix.readMatrix(path, "fasta")
+    assert matrix.temporary and os.path.exists(matrix.path)
+    assert codeRows(matrix) == dendropyRows(path, "fasta")
+    arrayPath = matrix.path
+    del matrix
+    assert not os.path.exists(arrayPath)
+
+
+def test_matrices_in_use_are_never_evicted(tmpdir, monkeypatch):
+    # Room for one matrix only.
+    monkeypatch.setattr(diskCache, "MAX_CACHE_BYTES", 30)
+    first = codeMatrix.readMatrix(writeFasta(tmpdir, "first.fasta", FASTA), "fasta")
+    second = codeMatrix.readMatrix(writeFasta(tmpdir, "second.fasta", FASTA.replace("ACGTAA", "ACGTAC")), "fasta")
+    assert not first.temporary and not second.temporary
+    assert os.path.exists(first.path) and os.path.exists(second.path)
+    # Once released, the least recently used one goes at the next store.
+    firstPath = first.path
+    del first
+    codeMatrix.readMatrix(writeFasta(tmpdir, "third.fasta", FASTA.replace("ACGTAA", "ACGTAG")), "fasta")
+    assert not os.path.exists(firstPath) and os.path.exists(second.path)
+
+
+class Stop(Exception):
+    pass
+
+
+@pytest.mark.parametrize("name", ["data.fasta", "data.fasta.gz"])
+def test_reading_reports_progress_and_can_be_stopped(tmpdir, name):
+    path = str(tmpdir.join(name))
+    with (gzip.open(path, "wt") if name.endswith(".gz") else open(path, "w")) as outputFile:
+        outputFile.write(FASTA)
+    reported = []
+    rows = codeRows(codeMatrix.readMatrix(path, "fasta", lambda done, total: reported.append((done, total))))
+    assert reported[-1] == (os.path.getsize(path), os.path.getsize(path))
+
+    def stop(done, total):
+        raise Stop()
+
+    cache = str(tmpdir.join("cache"))
+    for entry in os.listdir(cache):
+        os.remove(os.path.join(cache, entry))
+    with pytest.raises(Stop):
+        codeMatrix.readMatrix(path, "fasta", stop)
+    # Nothing is left in the cache, and the file is read again.
+    assert os.listdir(cache) == []
+    assert codeRows(codeMatrix.readMatrix(path, "fasta")) == rows
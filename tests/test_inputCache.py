@@ -0,0 +1,36 @@
+import pytest
+
+import diskCache
+import inputCache
+
+
+@pytest.fixture(autouse=True)
+def cacheDir(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "CACHE_DIR", str(tmpdir.join("cache")))
+
+
+def test_parsed_files_are_found_until_changed(tmpdir):
+    path = str(tmpdir.join("locus.newick"))
+    with open(path, "w") as outputFile:
+        outputFile.write("((a,b),c);\n(a,(B,c));\n")
+    parsed, message = inputCache.parseFile((path, "newick"))
+    assert message is None
+    assert (parsed.taxa, parsed.newicks) == (["a", "b", "c"], ["((a,b),c);", "(a,(b,c));"])
+    cache = inputCache.GeneTreeCache()
+    cache.put(path, inputCache.fileKey(path, "newick"), parsed)
+    assert cache.lookup(path, "newick") is parsed
+    assert cache.taxonLabels([path], "newick") == ["a", "b", "c"]
+    # Read back from diskCache by a worker of the next session.
+    assert inputCache.parseFile((path, "newick"))[0].newicks == parsed.newicks
+    with open(path, "a") as outputFile:
+        outputFile.write("(c,d);\n")
+    assert cache.lookup(path, "newick") is None
+
+
+def test_parse_errors_are_returned(tmpdir):
+    path = str(tmpdir.join("locus.newick"))
+    with open(path, "w") as outputFile:
+        outputFile.write("((a,b),c;\n")
+    parsed, message = inputCache.parseFile((path, "newick"))
+    assert parsed is None
+    assert "Unbalanced" in message
@@ -0,0 +1,66 @@
+import dendropy
+import pytest
+
+import diskCache
+import locusStore
+
+# The TAXA block orders the taxa z, a, while the matrix lists them as a, z.
+TAXA_BLOCK_NEXUS = """#NEXUS
+begin taxa;
+    dimensions ntax=2;
+    taxlabels z a;
+end;
+begin data;
+    dimensions ntax=2 nchar=4;
+    format datatype=dna missing=? gap=-;
+    matrix
+    a ACGT
+    z TTG-
+    ;
+end;
+"""
+
+PLAIN_NEXUS = """#NEXUS
+begin data;
+    dimensions ntax=2 nchar=4;
+    format datatype=dna missing=? gap=-;
+    matrix
+    a ACGT
+    z TTG-
+    ;
+end;
+"""
+
+
+@pytest.fixture(autouse=True)
+def cacheDir(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "CACHE_DIR", str(tmpdir.join("cache")))
+
+
+def writeFile(tmpdir, text):
+    path = str(tmpdir.join("locus.nex"))
+    with open(path, "w") as outputFile:
+        outputFile.write(text)
+    return path
+
+
+def dendropyItems(path):
+    matrix = dendropy.DnaCharacterMatrix.get(path=path, schema="nexus", preserve_underscores=True)
+    return [(taxon.label, matrix[taxon].symbols_as_string()) for taxon in matrix]
+
+
+def test_taxa_block_is_left_to_dendropy(tmpdir):
+    path = writeFile(tmpdir, TAXA_BLOCK_NEXUS)
+    with pytest.raises(locusStore.UnsupportedLayout):
+        locusStore.indexFile(path, "nexus")
+
+    locus = locusStore.LocusStore().addFile("locus", path, "nexus", preserve_underscores=True)
+    assert locus.labels() == ["z", "a"]
+    assert list(locus.items()) == dendropyItems(path)
+
+
+def test_plain_matrix_is_indexed(tmpdir):
+    path = writeFile(tmpdir, PLAIN_NEXUS)
+    locus = locusStore.LocusStore().addFile("locus", path, "nexus", preserve_underscores=True)
+    assert isinstance(locus, locusStore.IndexedLocus)
+    assert list(locus.items()) == dendropyItems(path)
@@ -0,0 +1,42 @@
+import numpy
+import pytest
+
+import markerMatrix
+
+# Rows with missing data, a symbol kept as an exception and a row shorter than the others.
+ROWS = [
+    ("a", "0120?1-0210"),
+    ("b", "1111000022?"),
+    ("c", "2?0-1"),
+    ("d", "00112??2101"),
+]
+
+
+def unpackedCodes(rows, nchar):
+    """
+    2-bit codes of the rows, computed from their strings, with missing codes past the end of short rows.
+    """
+    codes = numpy.full((len(rows), nchar), 3, dtype=numpy.uint8)
+    for row, (label, sequence) in enumerate(rows):
+        for column, symbol in enumerate(sequence[:nchar]):
+            codes[row, column] = markerMatrix.MARKERS.index(symbol) if symbol in markerMatrix.MARKERS else 3
+    return codes
+
+
+@pytest.mark.parametrize("blockSize", [1, 2, 1 << 16])
+def test_columns_match_unpacked_rows(blockSize):
+    matrix = markerMatrix.MarkerMatrix.fromRows(ROWS)
+    expected = unpackedCodes(ROWS, matrix.nchar)
+    for column in range(matrix.nchar):
+        assert list(matrix.column(column)) == list(expected[:, column])
+    counts = matrix.columnCounts(blockSize)
+    assert counts.shape == (4, matrix.nchar)
+    for code in range(4):
+        assert list(counts[code]) == list((expected == code).sum(axis=0))
+    # Columns of a subset and of selected columns come from their own packed rows.
+    subset = matrix.subset(["d", "a"])
+    assert list(subset.column(5)) == [expected[3, 5], expected[0, 5]]
+    # Selecting columns expects rows of nchar characters.
+    selected = matrix.subset(["a", "b", "d"]).selectColumns([10, 0, 0])
+    full = expected[[0, 1, 3]]
+    assert [list(selected.column(column)) for column in range(3)] == [list(full[:, 10])] + [list(full[:, 0])] * 2
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import shards
+
+
+def writeRun(tmpdir, count):
+    paths = []
+    for number in range(count):
+        path = str(tmpdir.join("run_%d.nexus" % (number + 1)))
+        with open(path, "w") as outputFile:
+            outputFile.write("#NEXUS\n")
+        paths.append(path)
+    manifest = str(tmpdir.join("run.manifest"))
+    with open(manifest, "w") as outputFile:
+        outputFile.write("")
+    return paths, manifest
+
+
+def test_every_shard_is_validated(tmpdir):
+    paths, manifest = writeRun(tmpdir, 3)
+    validated = []
+    progress = []
+
+    def checkFile(path):
+        validated.append(path)
+        return None
+
+    assert shards.validate(paths, manifest, checkFile, lambda done, total: progress.append((done, total))) is None
+    assert validated == paths
+    assert progress == [(0, 3), (1, 3), (2, 3), (3, 3)]
+    assert all(os.path.exists(path) for path in paths + [manifest])
+
+
+def test_a_failing_shard_removes_the_run(tmpdir):
+    paths, manifest = writeRun(tmpdir, 3)
+    validated = []
+
+    def checkFile(path):
+        validated.append(path)
+        return "invalid" if path == paths[1] else None
+
+    assert shards.validate(paths, manifest, checkFile) == "invalid"
+    assert validated == paths[:2]
+    assert not any(os.path.exists(path) for path in paths + [manifest])
+
+
+def test_cancelled_validation_removes_the_run(tmpdir):
+    paths, manifest = writeRun(tmpdir, 3)
+    validated = []
+
+    class Cancelled(Exception):
+        pass
+
+    def progress(done, total):
+        if done == 2:
+            raise Cancelled()
+
+    def checkFile(path):
+        validated.append(path)
+
+    with pytest.raises(Cancelled):
+        shards.validate(paths, manifest, checkFile, progress)
+    assert validated == paths[:2]
+    assert not any(os.path.exists(path) for path in paths + [manifest])
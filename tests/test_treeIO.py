@@ -0,0 +1,105 @@
+import dendropy
+import pytest
+from dendropy.utility.error import DataParseError
+
+import diskCache
+import inputCache
+import treeIO
+
+NEWICK = "((a:1,b:2.5),(c,'d e'));\n[&R] ((a,b),(c,D));\n"
+VERBATIM_NEWICK = "((a,b),(c,d));\n(a,(b,(c,d)));\n"
+
+
+def writeFiles(tmpdir, texts):
+    paths = []
+    for i, text in enumerate(texts):
+        path = str(tmpdir.join("locus%d.tre" % i))
+        with open(path, "w") as outputFile:
+            outputFile.write(text)
+        paths.append(path)
+    return paths
+
+
+def test_pooled_files_match_files_read_one_by_one(tmpdir):
+    paths = writeFiles(tmpdir, [NEWICK, VERBATIM_NEWICK, NEWICK * 3])
+    # Read into one namespace, as "D" of the first file is also "d" of the second one.
+    namespace = dendropy.TaxonNamespace()
+    expected = [(path, [treeIO.newickString(tree) for tree in treeIO.yieldTrees(path, "newick", namespace)])
+                for path in paths]
+    assert [(path, list(trees)) for path, trees in treeIO.yieldFileNewicks(paths, "newick")] == expected
+    # Stopping after the first file leaves the files parsed ahead to the pool.
+    files = treeIO.yieldFileNewicks(paths, "newick")
+    path, trees = next(files)
+    assert next(trees) == expected[0][1][0]
+    files.close()
+
+
+def test_pooled_parse_errors_are_raised(tmpdir):
+    paths = writeFiles(tmpdir, [NEWICK, "((a,b),(c,d);\n"])
+    with pytest.raises(Exception):
+        for path, trees in treeIO.yieldFileNewicks(paths, "newick"):
+            list(trees)
+
+
+def readWhole(path, schema):
+    namespace = dendropy.TaxonNamespace()
+    newicks = [treeIO.newickString(tree) for tree in treeIO.yieldTrees(path, schema, namespace)]
+    return newicks, [taxon.label for taxon in namespace]
+
+
+@pytest.mark.parametrize("text, schema", [
+    (VERBATIM_NEWICK, "newick"),
+    (NEWICK, "newick"),
+    # Trees copied and trees read by dendropy in one file, with labels differing in case.
+    ("(a,b);\n((a,b),'c;d');\n(A,(b,c));\n[a [nested;] comment];\n(c:1.0,d:2.5);\n", "newick"),
+    ("[&R] (a,b);\n[&U] (a,c);\n(a,b)[&R];\n", "newick"),
+    ("(a,b);\n[comment]\n", "newick"),
+    ("#NEXUS\nbegin trees;\ntree t1 = ((a,b),c);\ntree t2 = ((1,2),3);\ntree * t3 = [&R] ((a,'b c'),C);\nend;\n",
+     "nexus"),
+    ("#NEXUS\nbegin trees;\ntree t1 = ((a,b),c);\nend;\nbegin trees;\ntranslate 1 c, 2 d;\ntree t2 = (1,(2,a));\n"
+     "end;\n", "nexus"),
+    ("#NEXUS\nbegin taxa;\ndimensions ntax=3;\ntaxlabels c b a;\nend;\nbegin trees;\ntree t1 = ((a,b),c);\nend;\n",
+     "nexus"),
+])
+def test_reader_matches_dendropy(tmpdir, monkeypatch, text, schema):
+    # Small chunks, so that statements, quoted labels and comments are cut at every position.
+    monkeypatch.setattr(treeIO, "CHUNK_SIZE", 3)
+    path = writeFiles(tmpdir, [text])[0]
+    reader = treeIO.TreeReader(path, schema)
+    assert (list(reader), reader.labels()) == readWhole(path, schema)
+
+
+def test_reader_reports_errors_at_their_line(tmpdir):
+    path = writeFiles(tmpdir, ["(a,b);\n(c,d);\n\n((a,b),c;\n"])[0]
+    with pytest.raises(DataParseError) as error:
+        list(treeIO.TreeReader(path, "newick"))
+    assert error.value.line_num == 4
+    assert error.value.filename == path
+
+
+def originalTreesBlock(paths, schema):
+    """
+    Trees of the files written the way the pages did before trees were streamed: one TreeList extended with each
+    file.
+    """
+    data = dendropy.TreeList()
+    for path in paths:
+        data.extend(dendropy.TreeList.get(path=path, schema=schema, preserve_underscores=True))
+    return [treeIO.newickString(tree) for tree in data]
+
+
+# Files parsed in the pool, a file parsed by the IngestWorker before a file streamed, and files all parsed before.
+@pytest.mark.parametrize("numCached", [0, 1, 2])
+def test_labels_differing_in_case_keep_the_first_spelling(tmpdir, monkeypatch, numCached):
+    monkeypatch.setattr(diskCache, "CACHE_DIR", str(tmpdir.join("cache")))
+    paths = writeFiles(tmpdir, ["((a,b),c);\n", "((a,B),(C,d));\n(d,(c,'b'));\n"])
+    cache = inputCache.GeneTreeCache()
+    for path in paths[:numCached]:
+        cache.put(path, inputCache.fileKey(path, "newick"), inputCache.parseFile((path, "newick"))[0])
+    output = str(tmpdir.join("output.nexus"))
+    treeIO.writeGeneTrees(output, paths, "newick", cache)
+    # Read as text, as dendropy would fold the labels of the output file itself.
+    with open(output) as outputFile:
+        written = [line.split(" = ", 1)[1].rstrip("\n") for line in outputFile if line.startswith("    TREE ")]
+    assert written == originalTreesBlock(paths, "newick")
+    assert cache.taxonLabels(paths, "newick") == ["a", "b", "c", "d"]